@@ -0,0 +1,291 @@
+import os
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from ledger import Ledger
+from planner import month_days
+from extract import iter_members, open_grid, time_block
+
+# 聚合配置
+workers = max(1, (os.cpu_count() or 2) - 1)  # 按月分片的进程数
+worker_memory = 4 * 1024 ** 3  # 每个进程（含主进程）可用的内存（字节），据此选择行块大小
+tile_rows = None  # 每个任务处理的纬度行数；None 时取 worker_memory 能容纳的最大行数。每个文件要读取 行块数 次
+accumulate_block = 24  # 读取的时间块再按这么多时刻一组计算风速、风功率密度和直方图，限制中间数组大小
+histogram_cells = 8192  # 直方图每次 bincount 的格点数，限制临时数组大小（分箱数 × 格点数 × 8 字节）
+speed_bins = np.arange(0, 40.25, 0.25)  # 风速直方图分箱边界（m/s），合并后用于计算分位数
+percentiles = (50, 90, 95, 99)
+gas_constant = 287.05  # 干空气气体常数 J/(kg·K)
+standard_temperature = 288.15  # 没有2米气温时按15℃估算空气密度
+standard_density = 1.225  # 没有地面气压时使用的空气密度 kg/m³
+
+
+def new_partial(lat, lon, days, r0, r1):
+    """一个月在 [r0:r1] 行上的累计量：逐日和/计数，当月风速与风功率密度的和/计数，风速直方图"""
+    shape = (r1 - r0, len(lon))
+    return {
+        "lat": lat,
+        "lon": lon,
+        "rows": (r0, r1),
+        "present": set(),
+        "daily": {name: np.zeros((days,) + shape, np.float32) for name in ("u10", "v10", "sp", "wind_speed")},
+        "daily_count": np.zeros((days,) + shape, np.int32),
+        "sum_speed": np.zeros(shape),
+        "sum_wpd": np.zeros(shape),
+        "count": np.zeros(shape, np.int64),
+        "histogram": np.zeros((len(speed_bins) - 1,) + shape, np.uint32),
+    }
+
+
+def accumulate(partial, day_index, u, v, sp, t2m):
+    """把一个时间块 (时刻, 纬度, 经度) 加入累计量"""
+    speed = np.hypot(u, v)
+    valid = ~np.isnan(speed)
+    if sp is not None:
+        rho = sp / (gas_constant * (t2m if t2m is not None else standard_temperature))
+    else:
+        rho = standard_density
+    wpd = 0.5 * rho * speed ** 3  # 风功率密度 W/m²
+
+    for day in np.unique(day_index):
+        rows = day_index == day
+        for name, data in (("u10", u), ("v10", v), ("sp", sp), ("wind_speed", speed)):
+            if data is not None:
+                partial["daily"][name][day] += np.where(valid[rows], data[rows], 0).sum(axis=0)
+                partial["present"].add(name)
+        partial["daily_count"][day] += valid[rows].sum(axis=0)
+
+    partial["sum_speed"] += np.where(valid, speed, 0).sum(axis=0)
+    partial["sum_wpd"] += np.nan_to_num(np.where(valid, wpd, 0)).sum(axis=0)
+    partial["count"] += valid.sum(axis=0)
+
+    # 每个格点的风速直方图：把 (分箱, 格点) 展平后 bincount，按 histogram_cells 个格点一组，临时数组不随行块增大
+    nbins = len(speed_bins) - 1
+    bins = np.clip(np.digitize(speed, speed_bins) - 1, 0, nbins - 1).reshape(len(speed), -1)
+    valid = valid.reshape(len(speed), -1)
+    histogram = partial["histogram"].reshape(nbins, -1)
+    for c0 in range(0, bins.shape[1], histogram_cells):
+        c1 = min(c0 + histogram_cells, bins.shape[1])
+        flat = (bins[:, c0:c1] * (c1 - c0) + np.arange(c1 - c0))[valid[:, c0:c1]]
+        histogram[:, c0:c1] += np.bincount(flat, minlength=nbins * (c1 - c0)).reshape(nbins, c1 - c0).astype(np.uint32)
+
+
+def row_bytes(nx):
+    """一个纬度行占用的内存：工作进程的累计量（按31天计）、直方图、一个时间块的读取与中间数组，
+    主进程的逐月气候态、uint64 直方图与收到的一个月结果，取较大者"""
+    nbins = len(speed_bins) - 1
+    worker = 31 * 5 * 4 + 3 * 8 + nbins * 4 + time_block * 4 * 4 + accumulate_block * 12 * 4
+    main = 12 * 3 * 8 + nbins * 8 + 3 * 8 + nbins * 4
+    return nx * max(worker, main)
+
+
+def grid_shape(paths):
+    """同月文件中第一个含 u10/v10 的网格的 (行数, 列数)，没有时返回 None"""
+    for path in paths:
+        for member in iter_members(path):
+            with open_grid(member) as grid:
+                if "u10" in grid.variables and "v10" in grid.variables:
+                    return len(grid.lat), len(grid.lon)
+    return None
+
+
+def choose_tile_rows(ny, nx):
+    """行块大小：配置了 tile_rows 时直接使用，否则取 worker_memory 能容纳的最大行数（整个网格放得下时只需读一遍）"""
+    if tile_rows:
+        return tile_rows
+    return max(1, min(ny, worker_memory // row_bytes(nx)))
+
+
+def aggregate_month(year, month, paths, output_dir, r0=0, rows=None):
+    """按月、按行块分片：按时间块读取该月 [r0:r0+rows] 行的数据，逐日平均直接写入对应行，返回累计量供主进程合并"""
+    days = month_days(year, month)
+    partial, seen = None, set()
+    for path in paths:
+        for member in iter_members(path):
+            with open_grid(member) as grid:
+                if "u10" not in grid.variables or "v10" not in grid.variables:
+                    continue
+                # 同一时刻可能出现在多个文件中（补缺重下），只统计一次
+                index = [i for i, t in enumerate(grid.times) if (t.year, t.month) == (year, month) and t not in seen]
+                if not index:
+                    continue
+                ny, nx = len(grid.lat), len(grid.lon)
+                if partial is None:
+                    if r0 >= ny:
+                        return None
+                    partial = new_partial(grid.lat, grid.lon, days, r0, min(r0 + (rows or ny), ny))
+                elif partial["lat"].shape != grid.lat.shape or partial["lon"].shape != grid.lon.shape:
+                    raise ValueError(f"{os.path.basename(path)} 的网格与同月其他文件不一致")
+                seen.update(grid.times[i] for i in index)
+                r1 = partial["rows"][1]
+
+                for start in range(0, len(index), time_block):
+                    block = np.array(index[start:start + time_block])
+                    t0, t1 = block[0], block[-1] + 1
+                    keep = block - t0
+
+                    def read(name):
+                        if name not in grid.variables:
+                            return None
+                        return grid.read(name, t0, t1, r0, r1, 0, nx)[keep]
+
+                    day_index = np.array([grid.times[i].day - 1 for i in block])
+                    data = [read(name) for name in ("u10", "v10", "sp", "t2m")]
+                    for s0 in range(0, len(block), accumulate_block):
+                        s1 = s0 + accumulate_block
+                        accumulate(partial, day_index[s0:s1], *(x if x is None else x[s0:s1] for x in data))
+
+    if partial is None:
+        return None
+    write_daily(os.path.join(output_dir, "daily", f"{year}-{month:02d}.h5"), year, month, partial)
+    del partial["daily"], partial["daily_count"], partial["present"]
+    partial["month"] = month
+    return partial
+
+
+def write_daily(path, year, month, partial):
+    """把一个月的逐日平均写入文件的对应行（第一个行块新建文件，按行块大小分块）"""
+    import h5py
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    count = partial["daily_count"]
+    r0, r1 = partial["rows"]
+    shape = (len(count), len(partial["lat"]), len(partial["lon"]))
+    with h5py.File(path, "w" if r0 == 0 else "a") as f, np.errstate(invalid="ignore", divide="ignore"):
+        if "latitude" not in f:
+            f["latitude"], f["longitude"] = partial["lat"], partial["lon"]
+            f["date"] = np.array([f"{year}-{month:02d}-{d:02d}" for d in range(1, len(count) + 1)], dtype="S10")
+        for name, total in partial["daily"].items():
+            if name in partial["present"]:
+                if name not in f:
+                    f.create_dataset(name, shape, np.float32, compression="gzip", compression_opts=4,
+                                     chunks=(1, r1 - r0, shape[2]), fillvalue=np.nan)
+                f[name][:, r0:r1] = np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+
+def percentile_from_histogram(histogram, q):
+    """由合并后的直方图计算分位数（箱内线性插值）"""
+    cdf = np.cumsum(histogram, axis=0, dtype=np.int64)
+    total = cdf[-1]
+    target = total * q / 100.0
+    index = np.minimum((cdf < target).sum(axis=0), len(speed_bins) - 2)
+    below = np.where(index > 0, np.take_along_axis(cdf, np.maximum(index - 1, 0)[None], 0)[0], 0)
+    inside = np.take_along_axis(histogram, index[None], 0)[0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(inside > 0, (target - below) / inside, 0)
+    value = speed_bins[index] + fraction * (speed_bins[index + 1] - speed_bins[index])
+    return np.where(total > 0, value, np.nan)
+
+
+def merge(climatology, partial):
+    """把一个月的累计量并入对应日历月的气候态"""
+    if climatology.get("lat") is None:
+        shape = partial["count"].shape
+        climatology.update(
+            lat=partial["lat"], lon=partial["lon"],
+            sum_speed=np.zeros((12,) + shape), sum_wpd=np.zeros((12,) + shape),
+            count=np.zeros((12,) + shape, np.int64),
+            histogram=np.zeros(partial["histogram"].shape, np.uint64),
+        )
+    elif climatology["count"].shape[1:] != partial["count"].shape or len(climatology["lat"]) != len(partial["lat"]):
+        raise ValueError("各月网格不一致，无法合并")
+    m = partial["month"] - 1
+    for name in ("sum_speed", "sum_wpd", "count"):
+        climatology[name][m] += partial[name]
+    climatology["histogram"] += partial["histogram"]
+
+
+def write_climatology(path, climatology, r0=0):
+    """把一个行块的逐月气候态（平均风速、平均风功率密度）及全时段风速分位数写入对应行（第一个行块新建文件）"""
+    import h5py
+
+    count = climatology["count"]
+    r1 = r0 + count.shape[1]
+    ny, nx = len(climatology["lat"]), len(climatology["lon"])
+    with h5py.File(path, "w" if r0 == 0 else "a") as f, np.errstate(invalid="ignore", divide="ignore"):
+        if r0 == 0:
+            f["latitude"], f["longitude"] = climatology["lat"], climatology["lon"]
+            f["month"] = np.arange(1, 13)
+            f["percentile"] = np.array(percentiles)
+            chunks = (1, r1 - r0, nx)
+            for name, depth, dtype in (("mean_wind_speed", 12, np.float32), ("mean_power_density", 12, np.float32),
+                                       ("sample_count", 12, np.int64),
+                                       ("wind_speed_percentile", len(percentiles), np.float32)):
+                f.create_dataset(name, (depth, ny, nx), dtype, chunks=chunks, compression="gzip",
+                                 fillvalue=0 if dtype is np.int64 else np.nan)
+        f["mean_wind_speed"][:, r0:r1] = np.where(count > 0, climatology["sum_speed"] / count, np.nan)
+        f["mean_power_density"][:, r0:r1] = np.where(count > 0, climatology["sum_wpd"] / count, np.nan)
+        f["sample_count"][:, r0:r1] = count
+        f["wind_speed_percentile"][:, r0:r1] = np.stack([
+            percentile_from_histogram(climatology["histogram"], q) for q in percentiles
+        ])
+
+
+def run(ledger, dataset, request, start_year, end_year, output_dir):
+    """按行块依次处理：每个行块按月分片提交到进程池，完成一个合并一个，整块完成后写入气候态的对应行
+
+    同一时刻只处理一个行块，各月的逐日文件不会被两个进程同时写。每个行块都要把所有文件读一遍，
+    行块越小内存越省，但读取量成倍增加，所以默认取内存放得下的最大行块。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    months = []
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            start = f"{year}-{month:02d}-01"
+            end = f"{year}-{month:02d}-{month_days(year, month):02d}"
+            paths = ledger.files_between(dataset, request, start, end)
+            if paths:
+                months.append((year, month, paths))
+    shape = next(filter(None, (grid_shape(paths) for _, _, paths in months)), None)
+    if shape is None:
+        print("没有可聚合的 u10/v10 数据")
+        return
+    ny, nx = shape
+    rows = choose_tile_rows(ny, nx)
+    tiles = -(-ny // rows)
+    print(f"共 {len(months)} 个月待聚合，{workers} 个进程；网格 {ny}×{nx}，每块 {rows} 行，共 {tiles} 块"
+          f"（每个文件读取 {tiles} 次，每个进程约占 {rows * row_bytes(nx) / 1024 ** 2:.0f}MB 内存）")
+
+    path = os.path.join(output_dir, "climatology.h5")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for r0 in range(0, ny, rows):
+            climatology = {}
+            futures = {pool.submit(aggregate_month, year, month, paths, output_dir, r0, rows): (year, month)
+                       for year, month, paths in months}
+            for done, future in enumerate(as_completed(futures), 1):
+                year, month = futures.pop(future)  # 合并后不再保留各月结果
+                try:
+                    partial = future.result()
+                except Exception as e:
+                    print(f"⚠️ {year}-{month:02d} 第 {r0} 行起聚合失败: {str(e)}")
+                    continue
+                if partial is not None:
+                    merge(climatology, partial)
+                print(f"[{done}/{len(months)}] {year}-{month:02d} 第 {r0} 行起完成")
+            if not climatology:
+                print(f"⚠️ 第 {r0} 行起没有可合并的结果，停止聚合")
+                return
+            write_climatology(path, climatology, r0)
+
+    print(f"✅ 气候态已写入 {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算逐日平均、逐月气候态、风速分位数和风功率密度")
+    parser.add_argument("ledger", help="台账文件路径，如 F:\\era5\\download_ledger.sqlite")
+    parser.add_argument("--script", required=True, help="下载脚本模块名（如 era5_month），用于读取 dataset 与 request_template")
+    parser.add_argument("--start-year", type=int, default=1990)
+    parser.add_argument("--end-year", type=int, default=2019)
+    parser.add_argument("--output", default="aggregates", help="输出目录")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.script)
+    ledger = Ledger(args.ledger)
+    run(ledger, module.dataset, module.request_template, args.start_year, args.end_year, args.output)
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import importlib
+import subprocess
+import threading
+
+import requests
+
+import metrics
+import retry
+from pipeline import Pipeline
+
+# 压测配置
+default_script = "era5_faster"  # 使用哪个下载脚本的 profile
+mock_port = 8765
+poll_interval = 1  # 模拟服务器排队时间短，轮询间隔同比例缩短
+retry_delay = 2  # 重试退避起点（秒），同上
+tolerance = 0.1  # 与基准结果相比下降超过 10% 视为退化
+sample_interval = 0.5  # 内存采样间隔（秒）
+
+
+def start_mock_server(args):
+    """在子进程中启动模拟服务器（不计入流水线的CPU和内存），等待其就绪"""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mockcds.py"),
+        "--port", str(args.port), "--latency", str(args.latency[0]), str(args.latency[1]),
+        "--failure-rate", str(args.failure_rate), "--max-active", str(args.max_active),
+        "--field-bytes", str(args.field_bytes), "--bandwidth", str(args.bandwidth),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}/api/v2"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/status.json", timeout=1).raise_for_status()
+            return process, url
+        except requests.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("模拟服务器启动失败")
+
+
+class ResourceSampler:
+    """后台线程定期采样本进程（含校验子进程）的内存，记录峰值"""
+
+    def __init__(self):
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name="sampler", daemon=True)
+
+    def loop(self):
+        while not self.stop.wait(sample_interval):
+            self.peak = max(self.peak, current_memory())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_memory())
+
+
+def current_memory():
+    """本进程及子进程的常驻内存（字节）；没有 psutil 时只能读 Linux 的 /proc"""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            return 0
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def cpu_seconds():
+    """本进程及已结束子进程（校验进程池）的CPU时间"""
+    total = time.process_time()
+    try:
+        import resource
+    except ImportError:  # Windows
+        return total
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return total + usage.ru_utime + usage.ru_stime
+
+
+def complete_months(ledger, dataset, request, start, end):
+    """区间内已完整下载的月份数"""
+    missing = {d[:7] for d in ledger.missing_dates(dataset, request, start, end)}
+    months = set()
+    current = start[:7]
+    while current <= end[:7]:
+        months.add(current)
+        year, month = int(current[:4]), int(current[5:7])
+        current = f"{year + month // 12}-{month % 12 + 1:02d}"
+    return len(months - missing)
+
+
+def run_benchmark(args, url):
+    """用模拟服务器从空目录跑一遍流水线，返回各项指标"""
+    module = importlib.import_module(args.script)
+    directory = tempfile.mkdtemp(prefix="cds_bench_")
+    start, end = f"{args.start_year}-01-01", f"{args.end_year}-12-31"
+    profile = dict(
+        module.profile,
+        install_directory=directory,
+        ledger_file=os.path.join(directory, "download_ledger.sqlite"),
+        storage_volumes=[directory],
+        min_free_space=0,
+        cache_directory=None,
+        zarr_store=None,
+        legacy_dates_file=None,
+        metrics_port=None,
+        metrics_textfile=None,
+        use_idm=False,
+        poll_interval=poll_interval,
+        ranges=[(start, end)],
+    )
+    if args.inflight:
+        profile["max_inflight_requests"] = args.inflight
+    os.environ["CDSAPI_URL"], os.environ["CDSAPI_KEY"] = url, "1:mock"
+    retry.base_delay = retry_delay
+
+    pipeline = Pipeline(profile)
+    pipeline.open()
+    try:
+        cpu_start, start_time = cpu_seconds(), time.time()
+        with ResourceSampler() as sampler:
+            asyncio.run(pipeline.run())
+        elapsed, cpu = time.time() - start_time, cpu_seconds() - cpu_start
+        months = complete_months(pipeline.ledger, pipeline.dataset, pipeline.template, start, end)
+    finally:
+        pipeline.ledger.close()
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    downloaded = sum(value for _, _, value in metrics.bytes_downloaded.samples())
+    return {
+        "script": args.script,
+        "months": months,
+        "elapsed": round(elapsed, 2),
+        "months_per_hour": round(months / elapsed * 3600, 2),
+        "bytes": downloaded,
+        "bytes_per_second": round(downloaded / elapsed),
+        "cpu_seconds": round(cpu, 2),
+        "cpu_percent": round(cpu / elapsed * 100, 1),
+        "peak_memory": sampler.peak,
+        "stats": pipeline.stats,
+        "settings": {
+            "latency": args.latency, "failure_rate": args.failure_rate, "max_active": args.max_active,
+            "field_bytes": args.field_bytes, "bandwidth": args.bandwidth,
+            "inflight": profile.get("max_inflight_requests"),
+        },
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def print_report(result):
+    print(f"\n📊 压测结果（{result['script']}）")
+    print(f"  完整下载 {result['months']} 个月，用时 {result['elapsed']:.1f} 秒 → {result['months_per_hour']:.1f} 月/小时")
+    print(f"  下载 {result['bytes'] / 1024 ** 2:.1f}MB，平均 {result['bytes_per_second'] / 1024 ** 2:.2f}MB/s")
+    print(f"  CPU {result['cpu_seconds']:.1f} 秒（{result['cpu_percent']:.0f}%），内存峰值 "
+          f"{result['peak_memory'] / 1024 ** 2:.0f}MB")
+    print(f"  流水线统计：{result['stats']}")
+
+
+def compare(result, baseline):
+    """与基准结果比较，吞吐量下降或资源占用上升超过 tolerance 时返回退化项"""
+    regressions = []
+    for key in ("months_per_hour", "bytes_per_second"):
+        if baseline.get(key) and result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {baseline[key]} → {result[key]}")
+    for key in ("cpu_seconds", "peak_memory"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]} → {result[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地模拟CDS服务器压测下载流水线，报告 月/小时、下载速度、CPU和内存")
+    parser.add_argument("--script", default=default_script, help="下载脚本模块名，使用其 profile")
+    parser.add_argument("--start-year", type=int, default=2000)
+    parser.add_argument("--end-year", type=int, default=2000)
+    parser.add_argument("--inflight", type=int, help="覆盖脚本中的 max_inflight_requests")
+    parser.add_argument("--port", type=int, default=mock_port)
+    parser.add_argument("--latency", type=float, nargs=2, default=(2, 10), metavar=("最短", "最长"),
+                        help="模拟申请排队时间范围（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-active", type=int, default=0, help="模拟账户排队数上限，0 不限")
+    parser.add_argument("--field-bytes", type=int, default=16 * 1024, help="每个字段生成的字节数")
+    parser.add_argument("--bandwidth", type=float, default=0, help="每个连接限速（字节/秒），0 不限")
+    parser.add_argument("--output", help="把结果写入该 JSON 文件")
+    parser.add_argument("--baseline", help="基准结果 JSON，退化超过阈值时以非零状态退出")
+    parser.add_argument("--keep", action="store_true", help="保留下载的临时目录")
+    args = parser.parse_args()
+
+    server, url = start_mock_server(args)
+    try:
+        result = run_benchmark(args, url)
+    finally:
+        server.terminate()
+        server.wait()
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != json.loads(json.dumps(result["settings"])):
+            print("⚠️ 基准结果的模拟参数与本次不同，比较结果仅供参考")
+        regressions = compare(result, baseline)
+        if regressions:
+            print("❌ 与基准相比出现退化：\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("✅ 未发现退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from ledger import as_list, request_fingerprint, request_hours, request_dates
+
+# 缓存配置
+max_cache_size = 500 * 1024 ** 3  # 缓存目录内文件总大小上限，超出后按最近最少使用淘汰
+
+schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    request TEXT NOT NULL,
+    first_date TEXT,
+    last_date TEXT,
+    path TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    owned INTEGER NOT NULL,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS entries_lookup ON entries(dataset, fingerprint, first_date, last_date);
+"""
+
+
+def request_key(dataset, request):
+    """数据集 + 规范化请求参数的哈希"""
+    body = {key: sorted(as_list(value)) for key, value in request.items()}
+    for key in ("area", "grid"):  # 顺序有意义的字段不排序
+        if key in request:
+            body[key] = as_list(request[key])
+    canonical = json.dumps({"dataset": dataset, "request": body}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def covers(cached, request):
+    """cached 请求是否包含 request 的全部日期、小时和变量"""
+    return (
+        set(as_list(request["variable"])) <= set(as_list(cached["variable"]))
+        and set(request_hours(request)) <= set(request_hours(cached))
+        and set(request_dates(request)) <= set(request_dates(cached))
+    )
+
+
+class ResultCache:
+    """按请求内容寻址的下载结果缓存，多个脚本、多个下载目录共用
+
+    缓存目录与文件在同一个卷上时以硬链接保存（不额外占空间），否则只登记原文件路径；
+    命中时以硬链接（跨卷时复制）放到目标位置，不再向CDS排队。
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size or max_cache_size
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, "cache.sqlite"), timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(schema)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def lookup(self, dataset, request):
+        """查找与请求相同或包含该请求的缓存文件，返回 {key, path, size, sha256} 或 None"""
+        dates = request_dates(request)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, request, path, size, sha256 FROM entries "
+                "WHERE dataset = ? AND fingerprint = ? AND first_date <= ? AND last_date >= ? "
+                "ORDER BY size",
+                (dataset, request_fingerprint(request), dates[0], dates[-1]),
+            ).fetchall()
+        for key, cached, path, size, sha256 in rows:
+            if not covers(json.loads(cached), request):
+                continue
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                self.discard(key)
+                continue
+            with self.lock, self.conn:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return {"key": key, "path": path, "size": size, "sha256": sha256}
+        return None
+
+    def store(self, dataset, request, path, size=None, sha256=None):
+        """登记一个校验通过的下载结果"""
+        key = request_key(dataset, request)
+        size = os.path.getsize(path) if size is None else size
+        cached_path, owned = os.path.join(self.directory, key + os.path.splitext(path)[1]), 1
+        try:
+            if not os.path.exists(cached_path):
+                os.link(path, cached_path)
+        except OSError:
+            cached_path, owned = os.path.abspath(path), 0  # 跨卷无法硬链接，只登记原文件
+
+        dates = request_dates(request)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, dataset, request_fingerprint(request), json.dumps(request), dates[0], dates[-1],
+                 cached_path, size, sha256, owned, time.time()),
+            )
+        self.evict()
+        return key
+
+    def materialize(self, entry, target):
+        """把缓存文件放到目标位置：同卷硬链接，跨卷复制"""
+        try:
+            os.link(entry["path"], target)
+        except OSError:
+            shutil.copyfile(entry["path"], target)
+        return target
+
+    def discard(self, key):
+        """删除一条缓存（文件已丢失或校验失败）"""
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT path, owned FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if row and row[1] and os.path.exists(row[0]):
+            os.remove(row[0])
+
+    def evict(self):
+        """缓存目录内文件超出上限时按最近最少使用淘汰（硬链接的其他副本不受影响）"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, size FROM entries WHERE owned = 1 ORDER BY last_used"
+            ).fetchall()
+        total = sum(size or 0 for _, size in rows)
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.discard(key)
+            total -= size or 0
@@ -0,0 +1,323 @@
+import os
+import time
+import shutil
+import hashlib
+import zipfile
+import argparse
+import importlib
+from datetime import date, datetime
+
+import numpy as np
+
+from ledger import Ledger
+from extract import iter_members, open_grid
+from scanner import read_archive_contents, record_contents, short_names
+from verify import check_download
+from zip_refs import refs_suffix
+
+# 合并配置
+min_fragments = 2  # 一个月至少分散在几个文件中才合并
+copy_block = 24  # 每次复制的时刻数，决定内存占用
+chunk_shape = (24, 256, 256)  # 输出文件的分块（时刻, 纬度, 经度）
+compression_level = 4
+min_free_space = 10 * 1024 ** 3  # 合并后目标卷至少保留的空间
+member_name = "data.nc"
+read_size = 4 * 1024 ** 2
+
+_epoch = datetime(1970, 1, 1)
+_variable_names = {name: short for short, name in short_names.items()}  # CDS 变量名 -> NetCDF 变量名
+
+
+def month_bounds(year, month):
+    last = date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+    return f"{year}-{month:02d}-01", date.fromordinal(last).isoformat()
+
+
+def canonical_path(directory, year, month):
+    return os.path.join(directory, f"{year}-{month:02d}.zip")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(read_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fsync_path(path):
+    """把文件（或目录项）刷到磁盘；Windows 不能打开目录，跳过"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MonthWriter:
+    """按时间顺序排好的整月 NetCDF4 文件：valid_time/latitude/longitude 维度 + 各变量 float32（缺测为 NaN）"""
+
+    def __init__(self, path, times, variables):
+        self.path = path
+        self.times = times
+        self.index = {t: i for i, t in enumerate(times)}
+        self.variables = variables
+        self.file = None
+        self.written = np.zeros((len(variables), len(times)), dtype=bool)
+
+    def _create(self, grid):
+        import h5py
+
+        self.lat, self.lon = grid.lat, grid.lon
+        self.file = h5py.File(self.path, "w")
+        seconds = [int((t - _epoch).total_seconds()) for t in self.times]
+        time_var = self.file.create_dataset("valid_time", data=np.array(seconds, dtype="i8"))
+        time_var.attrs["units"] = "seconds since 1970-01-01"
+        time_var.attrs["calendar"] = "proleptic_gregorian"
+        time_var.attrs["standard_name"] = "time"
+        self.file["latitude"] = self.lat
+        self.file["latitude"].attrs["units"] = "degrees_north"
+        self.file["longitude"] = self.lon
+        self.file["longitude"].attrs["units"] = "degrees_east"
+        for name in ("valid_time", "latitude", "longitude"):
+            self.file[name].make_scale(name)
+
+    def _create_variable(self, name, grid):
+        """变量第一次出现时创建（按变量拆分的文件各自只有部分变量），属性取自该文件"""
+        shape = (len(self.times), len(self.lat), len(self.lon))
+        chunks = tuple(min(c, s) for c, s in zip(chunk_shape, shape))
+        var = self.file.create_dataset(name, shape, dtype="f4", chunks=chunks, compression="gzip",
+                                       compression_opts=compression_level, shuffle=True, fillvalue=np.nan)
+        var.attrs["_FillValue"] = np.float32(np.nan)
+        for key in ("units", "long_name", "standard_name"):
+            value = grid.attr(grid.variables[name], key)
+            if value is not None:
+                var.attrs[key] = value
+        for axis, dim in enumerate(("valid_time", "latitude", "longitude")):
+            var.dims[axis].attach_scale(self.file[dim])
+
+    def copy(self, grid):
+        """复制一个成员中属于本月的时刻；后复制的覆盖先复制的（较新的下载优先）"""
+        if self.file is None:
+            self._create(grid)
+        elif grid.lat.shape != self.lat.shape or grid.lon.shape != self.lon.shape or \
+                not np.allclose(grid.lat, self.lat) or not np.allclose(grid.lon, self.lon):
+            raise ValueError("各文件的经纬度网格不一致")
+
+        pairs = [(src, self.index[t]) for src, t in enumerate(grid.times) if t in self.index]
+        names = [name for name in self.variables if name in grid.variables]
+        for name in names:
+            if name not in self.file:
+                self._create_variable(name, grid)
+        runs = []  # 源和目标都连续的时刻段
+        for src, dst in pairs:
+            if runs and runs[-1][1] == src and runs[-1][3] == dst and runs[-1][1] - runs[-1][0] < copy_block:
+                runs[-1][1], runs[-1][3] = src + 1, dst + 1
+            else:
+                runs.append([src, src + 1, dst, dst + 1])
+        for src0, src1, dst0, dst1 in runs:
+            for name in names:
+                self.file[name][dst0:dst1] = grid.read(name, src0, src1, 0, len(self.lat), 0, len(self.lon))
+                self.written[self.variables.index(name), dst0:dst1] = True
+        return len(pairs)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def plan_month(ledger, dataset, request, year, month):
+    """找出覆盖某月的所有文件，读取实际内容，返回合并方案；不需要或暂时不能合并时返回 None
+
+    合并结果包含各文件变量的并集，每个变量都要覆盖本月出现过的全部时刻（整月文件的内容按文件整体记账）。
+    按变量拆分的申请、补缺申请合起来齐全时才合并；还缺内容的月份等补全后再合并，不会反复重写。
+    """
+    start, end = month_bounds(year, month)
+    fragments = [p for p in ledger.files_between(dataset, request, start, end) if os.path.exists(p)]
+    if len(fragments) < min_fragments:
+        return None
+    fragments.sort(key=os.path.getmtime)
+
+    provided = {}  # 变量 -> 有该变量的时刻
+    for path in fragments:
+        contents = read_archive_contents(path)
+        if not contents["variables"]:
+            raise ValueError(f"{os.path.basename(path)} 中没有可识别的变量")
+        times = {datetime.strptime(date_str, "%Y-%m-%d").replace(hour=h)
+                 for date_str, hours in contents["times"].items() if start <= date_str <= end for h in hours}
+        for v in contents["variables"]:
+            if v in _variable_names:
+                provided.setdefault(_variable_names[v], set()).update(times)
+    if not provided:
+        raise ValueError("各文件中没有可合并的变量")
+
+    times = set().union(*provided.values())
+    incomplete = sorted(name for name, covered in provided.items() if covered != times)
+    if incomplete:
+        print(f"⏸ {year}-{month:02d}: 变量 {', '.join(incomplete)} 还缺部分时刻，补全后再合并")
+        return None
+
+    directory = os.path.dirname(max(fragments, key=os.path.getsize))
+    return {"target": canonical_path(directory, year, month), "fragments": fragments,
+            "times": sorted(times), "variables": sorted(provided)}
+
+
+def write_month(plan):
+    """把各文件中本月的数据按时间顺序写入临时 NetCDF，再不压缩地打包为临时 ZIP，返回临时 ZIP 路径"""
+    target = plan["target"]
+    nc_path, zip_path = target[:-4] + ".nc.tmp", target + ".tmp"
+    needed = 2 * sum(os.path.getsize(p) for p in plan["fragments"]) + min_free_space
+    if shutil.disk_usage(os.path.dirname(target)).free < needed:
+        raise IOError(f"{os.path.dirname(target)} 剩余空间不足 {needed / 1024 ** 3:.1f}GB")
+
+    writer = MonthWriter(nc_path, plan["times"], plan["variables"])
+    try:
+        for path in plan["fragments"]:
+            for member in iter_members(path):
+                with open_grid(member) as grid:
+                    writer.copy(grid)
+        writer.close()
+        if not writer.written.all():
+            missing = [v for v, row in zip(plan["variables"], writer.written) if not row.all()]
+            raise ValueError(f"变量 {', '.join(missing)} 有时刻没有写入")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+            zf.write(nc_path, member_name)
+    except BaseException:
+        writer.close()
+        remove_quietly(zip_path)
+        raise
+    finally:
+        remove_quietly(nc_path)
+    return zip_path
+
+
+def verify_month(zip_path, plan):
+    """校验临时 ZIP 的 CRC，并确认读回的时间轴与计划一致"""
+    ok, reason = check_download(zip_path)
+    if not ok:
+        raise ValueError(reason)
+    contents = read_archive_contents(zip_path)
+    times = sorted(datetime.strptime(d, "%Y-%m-%d").replace(hour=h)
+                   for d, hours in contents["times"].items() for h in hours)
+    if times != plan["times"]:
+        raise ValueError(f"合并结果时间轴不符：{len(times)}/{len(plan['times'])} 个时刻")
+    return contents
+
+
+def finish(ledger, dataset, request, target, fragments, contents=None):
+    """整月文件已就位：改为由它覆盖这些日期，删除已不再被台账引用的旧文件"""
+    contents = contents or read_archive_contents(target)
+    record_contents(ledger, dataset, request, target, os.path.getsize(target), contents,
+                    sha256=file_sha256(target))
+    removed = []
+    for path in fragments:
+        if os.path.abspath(path) == os.path.abspath(target) or ledger.coverage_count(path):
+            continue  # 仍有其他变量/日期只在该文件中，保留
+        ledger.remove_file(path)
+        remove_quietly(path + refs_suffix)
+        remove_quietly(path)
+        removed.append(path)
+    ledger.finish_compaction(target)
+    return removed
+
+
+def compact_month(ledger, dataset, request, year, month, dry_run=False):
+    """合并一个月：写临时文件 → 校验 → 记录意图 → 原子替换 → 更新台账 → 删除已被取代的文件"""
+    plan = plan_month(ledger, dataset, request, year, month)
+    if plan is None:
+        return None
+    names = ", ".join(os.path.basename(p) for p in plan["fragments"])
+    if dry_run:
+        print(f"{year}-{month:02d}: {len(plan['fragments'])} 个文件 → {os.path.basename(plan['target'])}（{names}）")
+        return plan
+
+    zip_path = write_month(plan)
+    try:
+        contents = verify_month(zip_path, plan)
+        fsync_path(zip_path)
+    except BaseException:
+        remove_quietly(zip_path)
+        raise
+    ledger.save_compaction(plan["target"], plan["fragments"])
+    remove_quietly(plan["target"] + refs_suffix)
+    os.replace(zip_path, plan["target"])
+    fsync_path(os.path.dirname(plan["target"]))
+    removed = finish(ledger, dataset, request, plan["target"], plan["fragments"], contents)
+    print(f"✅ {year}-{month:02d}: 合并 {names} → {os.path.basename(plan['target'])}，"
+          f"{len(plan['times'])} 个时刻，删除 {len(removed)} 个旧文件")
+    return plan
+
+
+def resume_pending(ledger, dataset, request):
+    """继续上次在替换后中断的合并；替换前中断的只需清理临时文件"""
+    for target, fragments in ledger.pending_compactions().items():
+        remove_quietly(target + ".tmp")
+        remove_quietly(target[:-4] + ".nc.tmp")
+        if os.path.exists(target) and check_download(target)[0]:
+            removed = finish(ledger, dataset, request, target, fragments)
+            print(f"🔁 已完成上次中断的合并 {os.path.basename(target)}，删除 {len(removed)} 个旧文件")
+        else:
+            ledger.finish_compaction(target)
+
+
+def busy_months(ledger, dataset, request):
+    """还有在途申请的月份，合并会和正在下载的文件冲突，跳过"""
+    return {d[:7] for job in ledger.load_jobs(dataset, request) for d in job["item"].get("dates", [])}
+
+
+def compact_range(ledger, dataset, request, start_year, end_year, dry_run=False):
+    if not dry_run:
+        resume_pending(ledger, dataset, request)
+    busy = busy_months(ledger, dataset, request)
+    compacted = 0
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            if f"{year}-{month:02d}" in busy:
+                continue
+            try:
+                if compact_month(ledger, dataset, request, year, month, dry_run):
+                    compacted += 1
+            except Exception as e:
+                print(f"⚠️ {year}-{month:02d} 合并失败: {str(e)}")
+    return compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把分散在多个补缺文件中的月份合并为按时间排序的整月文件")
+    parser.add_argument("--script", default="era5_faster", help="下载脚本模块名，使用其 profile 的台账与请求")
+    parser.add_argument("--start-year", type=int, default=1990)
+    parser.add_argument("--end-year", type=int, default=2019)
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要合并的月份")
+    parser.add_argument("--interval", type=float, default=0, help="后台运行：每隔多少分钟检查一次，0 只运行一次")
+    args = parser.parse_args()
+
+    profile = importlib.import_module(args.script).profile
+    ledger = Ledger(profile["ledger_file"])
+    try:
+        while True:
+            compacted = compact_range(ledger, profile["dataset"], profile["request_template"],
+                                      args.start_year, args.end_year, args.dry_run)
+            print(f"本轮{'需要' if args.dry_run else '已'}合并 {compacted} 个月")
+            if not args.interval or args.dry_run:
+                break
+            time.sleep(args.interval * 60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
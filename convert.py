@@ -0,0 +1,225 @@
+import os
+import shutil
+import zipfile
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from ledger import Ledger
+
+# 转换配置（需要 xarray>=2025.1、zarr>=3；GRIB 另需 cfgrib）。存储为 Zarr v3 格式，不写合并元数据，
+# 延长时间轴、增加变量后读取方直接看到新的形状
+time_chunk = 24 * 7  # 时间方向分块（小时）：按点读取长时间序列时一次读一周，也决定每次写入的内存占用
+space_chunk = 32  # 经纬度方向分块（格点数），越小单点读取的数据量越少
+compression_level = 5  # zstd 压缩等级
+convert_workers = 1  # 转换进程数（同一个存储只能串行追加，解压、解码和压缩都在子进程中完成，不占用下载进程）
+read_size = 4 * 1024 ** 2
+time_units = "hours since 1900-01-01 00:00:00"  # 存储时间坐标的编码
+
+_convert_pool = None
+_pool_lock = threading.Lock()
+
+
+def time_dim(ds):
+    """时间维名称：新版CDS为 valid_time，旧版为 time"""
+    return "valid_time" if "valid_time" in ds.dims else "time"
+
+
+def open_member(path):
+    """按文件头选择引擎打开 NetCDF 或 GRIB"""
+    import xarray as xr
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    return xr.open_dataset(path, engine="cfgrib" if magic == b"GRIB" else None)
+
+
+def open_archive(path, workdir):
+    """把压缩包成员逐个流式解压到临时目录后打开，返回合并后的 Dataset 及需要关闭的成员"""
+    import xarray as xr
+
+    if not zipfile.is_zipfile(path):
+        ds = open_member(path)
+        return ds, [ds]
+
+    members = []
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            target = os.path.join(workdir, os.path.basename(name))
+            with zf.open(name) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, read_size)
+            members.append(open_member(target))
+    # 新版CDS把瞬时量和累积量拆成两个文件，时间轴相同，直接合并
+    return (xr.merge(members) if len(members) > 1 else members[0]), members
+
+
+def encoding_for(ds, dim):
+    """新建存储时的分块与压缩设置（时间坐标固定为整小时，便于按位置写入）"""
+    from zarr.codecs import BloscCodec
+
+    compressor = BloscCodec(cname="zstd", clevel=compression_level, shuffle="bitshuffle")
+    encoding = {dim: {"units": time_units, "dtype": "int64", "chunks": (time_chunk,)}}
+    for name, var in ds.data_vars.items():
+        chunks = tuple(
+            time_chunk if d == dim else min(space_chunk, size)
+            for d, size in zip(var.dims, var.shape)
+        )
+        encoding[name] = {"chunks": chunks, "compressors": (compressor,)}
+    return encoding
+
+
+def create_store(store, ds, dim, start):
+    """新建存储：时间轴从 start 开始、只有一个全空时刻，之后按需要延长"""
+    import numpy as np
+
+    template = ds.isel({dim: slice(0, 1)}).load().where(False)
+    template = template.assign_coords({dim: [np.datetime64(start, "ns")]})
+    template.to_zarr(store, encoding=encoding_for(template, dim), zarr_format=3, consolidated=False)
+
+
+def add_variables(store, ds, dim, names, length):
+    """存储中还没有的变量：按同样的编码建一个全空的数组（只写元数据，未写入的分块读出为缺测）"""
+    import zarr
+
+    group = zarr.open_group(store, mode="r+")
+    with tempfile.TemporaryDirectory(prefix="template_", dir=os.path.dirname(os.path.abspath(store))) as workdir:
+        template = ds[names].isel({dim: slice(0, 1)}).load()
+        template.to_zarr(workdir, encoding=encoding_for(template, dim), zarr_format=3, consolidated=False)
+        source = zarr.open_group(workdir, mode="r")
+        for name in names:
+            array = source[name]
+            dims = array.metadata.dimension_names
+            group.create_array(
+                name, shape=tuple(length if d == dim else n for d, n in zip(dims, array.shape)),
+                chunks=array.chunks, dtype=array.dtype, filters=array.filters, serializer=array.serializer,
+                compressors=array.compressors, fill_value=array.fill_value, dimension_names=dims,
+                attributes=dict(array.attrs),
+            )
+
+
+def extend_time(store, dim, times, length):
+    """把存储的时间轴延长到 length 个时刻：只改数组形状，新时刻的数据读出为缺测"""
+    import zarr
+    from xarray.coding.times import encode_cf_datetime
+
+    group = zarr.open_group(store, mode="r+")
+    old = group[dim].shape[0]
+    for name, array in group.arrays():
+        dims = array.metadata.dimension_names or ()
+        if dim in dims:
+            axis = dims.index(dim)
+            array.resize(array.shape[:axis] + (length,) + array.shape[axis + 1:])
+    values, _, _ = encode_cf_datetime(times[old:], group[dim].attrs["units"], group[dim].attrs.get("calendar"))
+    group[dim][old:] = values
+
+
+def contiguous_runs(index):
+    """把升序的位置切成连续的段 [(开始, 结束)]"""
+    import numpy as np
+
+    breaks = np.flatnonzero(np.diff(index) != 1) + 1
+    return [(int(run[0]), int(run[-1]) + 1) for run in np.split(index, breaks)]
+
+
+def convert_archive(path, store, start=None):
+    """把一个压缩包按时刻写入 Zarr 存储的对应位置，返回写入的时刻数
+
+    存储的时间轴是从起始时刻开始的逐小时轴，按需要延长；每个压缩包只写它包含的变量和时刻，
+    所以按变量拆分或补缺下载的文件可以按任意顺序写入，时间轴始终有序，重复的时刻以后写入的为准。
+    新建存储时起始时刻取 start（默认为本文件的第一个时刻），早于起始时刻的文件无法写入。
+    """
+    import numpy as np
+    import xarray as xr
+
+    workdir = tempfile.mkdtemp(prefix="convert_", dir=os.path.dirname(os.path.abspath(store)))
+    members = []
+    try:
+        ds, members = open_archive(path, workdir)
+        dim = time_dim(ds)
+        # 随时间变化的附加坐标（如 expver）不写入，各文件只按时刻对齐
+        ds = ds.drop_vars([name for name in ds.coords if name != dim and dim in ds[name].dims])
+        ds = ds.sortby(dim).drop_duplicates(dim, keep="last")
+        times = ds[dim].values
+        if not os.path.exists(store):
+            create_store(store, ds, dim, start or times[0])
+
+        with xr.open_zarr(store, consolidated=False) as existing:
+            axis = existing[dim].values
+            known = set(existing.data_vars)
+        step = np.timedelta64(1, "h")
+        offset = (times - axis[0]) / step
+        if offset[0] < 0:
+            raise ValueError(f"{times[0]} 早于存储的起始时刻 {axis[0]}")
+        if not np.allclose(offset, np.round(offset)):
+            raise ValueError("时刻不在存储的逐小时时间轴上")
+        index = np.round(offset).astype(np.int64)
+
+        names = list(ds.data_vars)
+        missing = [name for name in names if name not in known]
+        if index[-1] >= len(axis):
+            extend_time(store, dim, axis[0] + np.arange(index[-1] + 1) * step, int(index[-1]) + 1)
+        if missing:
+            add_variables(store, ds, dim, missing, max(len(axis), int(index[-1]) + 1))
+
+        # 每段连续的时刻分块写入限制内存；分块与存储的时间分块对齐，只写本文件包含的变量
+        ds = ds[names]
+        position = 0
+        for first, last in contiguous_runs(index):
+            lo = first
+            while lo < last:
+                hi = min(last, lo - lo % time_chunk + time_chunk)
+                block = ds.isel({dim: slice(position + lo - first, position + hi - first)}).load()
+                block = block.drop_vars([name for name in block.variables if dim not in block[name].dims])
+                block.to_zarr(store, region={dim: slice(lo, hi)}, consolidated=False)
+                lo = hi
+            position += last - first
+        return len(times)
+    finally:
+        for member in members:
+            member.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def get_convert_pool():
+    """获取转换进程池（首次使用时创建）"""
+    global _convert_pool
+    with _pool_lock:
+        if _convert_pool is None:
+            _convert_pool = ProcessPoolExecutor(max_workers=convert_workers)
+        return _convert_pool
+
+
+def shutdown_convert_pool():
+    """等待所有转换任务结束"""
+    global _convert_pool
+    with _pool_lock:
+        if _convert_pool is not None:
+            _convert_pool.shutdown(wait=True)
+            _convert_pool = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把台账中已下载但尚未转换的压缩包按日期顺序写入 Zarr")
+    parser.add_argument("ledger", help="台账文件路径，如 M:\\era5\\download_ledger.sqlite")
+    parser.add_argument("store", help="Zarr 存储路径，如 M:\\era5\\era5_land.zarr")
+    parser.add_argument("--dataset", required=True, help="数据集名，如 reanalysis-era5-land")
+    parser.add_argument("--start", help="新建存储时时间轴的起始日期，如 1990-01-01；默认取最早的待转换文件")
+    args = parser.parse_args()
+
+    ledger = Ledger(args.ledger)
+    pending = ledger.pending_conversions(args.dataset, args.store)
+    print(f"待转换 {len(pending)} 个文件")
+    for i, path in enumerate(pending, 1):
+        try:
+            steps = convert_archive(path, args.store, args.start)
+        except Exception as e:
+            print(f"⚠️ 转换失败 {os.path.basename(path)}: {str(e)}")
+            continue
+        ledger.mark_converted(path, args.store, steps)
+        print(f"[{i}/{len(pending)}] 已写入 {os.path.basename(path)}（{steps} 个时刻）")
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import time
+import zlib
+import argparse
+import importlib
+from datetime import date, timedelta
+
+import numpy as np
+
+# 位图配置
+origin = date(1940, 1, 1)  # 位图第 0 天（ERA5 最早日期）
+hours_per_day = 24
+
+
+def day_index(date_str):
+    """日期在位图中的下标"""
+    index = (date.fromisoformat(date_str) - origin).days
+    if index < 0:
+        raise ValueError(f"日期 {date_str} 早于位图起点 {origin}")
+    return index
+
+
+def hour_mask(hours):
+    """小时列表对应的位掩码"""
+    mask = 0
+    for hour in hours:
+        mask |= 1 << int(hour)
+    return mask
+
+
+class CoverageBitmap:
+    """一个 (数据集, 请求指纹) 的覆盖位图：每个变量每天一个 uint32，第 h 位为 1 表示该小时已下载
+
+    30 年 × 每个变量只占约 44KB，按日期区间查询缺失的小时/变量只需几次数组运算。
+    """
+
+    def __init__(self, bits=None):
+        self.bits = bits or {}  # 变量 -> np.uint32 数组，下标为 day_index
+
+    def add(self, dates, hours, variables):
+        """标记 dates × hours × variables 已下载"""
+        if not dates:
+            return
+        index = np.array([day_index(d) for d in dates])
+        for variable in variables:
+            self.add_masks(variable, index, hour_mask(hours))
+
+    def add_masks(self, variable, index, masks):
+        """按下标批量并入小时位（masks 可为单个掩码或与 index 等长的数组）"""
+        bits = self._grow(variable, int(np.max(index)) + 1)
+        np.bitwise_or.at(bits, index, np.asarray(masks, np.uint32))
+
+    def last_date(self):
+        """有数据的最后一天，没有数据时返回起点"""
+        last = max((int(np.flatnonzero(bits)[-1]) for bits in self.bits.values() if bits.any()), default=0)
+        return (origin + timedelta(days=last)).isoformat()
+
+    def _grow(self, variable, length):
+        bits = self.bits.get(variable, np.zeros(0, np.uint32))
+        if len(bits) < length:
+            bits = np.concatenate([bits, np.zeros(length - len(bits) + 366, np.uint32)])  # 多留一年，减少扩容
+            self.bits[variable] = bits
+        return bits
+
+    def _slice(self, variable, first, last):
+        """[first, last] 天的位，超出已有长度的部分为 0"""
+        bits = self.bits.get(variable, np.zeros(0, np.uint32))[first:last + 1]
+        if len(bits) < last - first + 1:
+            bits = np.concatenate([bits, np.zeros(last - first + 1 - len(bits), np.uint32)])
+        return bits
+
+    def lacking(self, start, end, hours, variables):
+        """[start, end] 内每个变量每天缺失的小时位，返回 {变量: 数组}"""
+        first, last = day_index(start), day_index(end)
+        mask = np.uint32(hour_mask(hours))
+        return {v: mask & ~self._slice(v, first, last) for v in variables}
+
+    def complete(self, start, end, hours, variables):
+        """所有小时、所有变量均已下载的日期集合"""
+        lacking = self.lacking(start, end, hours, variables)
+        incomplete = np.zeros(day_index(end) - day_index(start) + 1, bool)
+        for bits in lacking.values():
+            incomplete |= bits != 0
+        first = date.fromisoformat(start)
+        return {(first + timedelta(days=int(i))).isoformat() for i in np.flatnonzero(~incomplete)}
+
+    def missing(self, start, end, hours, variables):
+        """[start, end] 内缺失的 {日期: {(小时, 变量)}}，完整的日期不出现"""
+        first = date.fromisoformat(start)
+        missing = {}
+        for variable, bits in self.lacking(start, end, hours, variables).items():
+            for i in np.flatnonzero(bits):
+                value = int(bits[i])
+                fields = missing.setdefault((first + timedelta(days=int(i))).isoformat(), set())
+                fields.update((h, variable) for h in hours if value >> h & 1)
+        return dict(sorted(missing.items()))
+
+    def to_blobs(self):
+        """{变量: 压缩后的字节}，整天已下载的位大多相同，压缩后很小"""
+        return {v: zlib.compress(bits.tobytes()) for v, bits in self.bits.items()}
+
+    @classmethod
+    def from_blobs(cls, blobs):
+        return cls({v: np.frombuffer(zlib.decompress(blob), np.uint32).copy() for v, blob in blobs.items()})
+
+
+def main():
+    from ledger import Ledger, as_list, request_hours
+
+    parser = argparse.ArgumentParser(description="按覆盖位图列出某时间段内缺失的小时/变量")
+    parser.add_argument("ledger", help="台账文件路径，如 F:\\era5\\download_ledger.sqlite")
+    parser.add_argument("--script", required=True, help="下载脚本模块名（如 era5_month），用于读取 dataset 与 request_template")
+    parser.add_argument("--start", default="1990-01-01")
+    parser.add_argument("--end", default="2019-12-31")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.script)
+    ledger = Ledger(args.ledger)
+    start_time = time.perf_counter()
+    missing = ledger.missing_fields(module.dataset, module.request_template, args.start, args.end)
+    elapsed = time.perf_counter() - start_time
+    ledger.close()
+
+    fields = len(request_hours(module.request_template)) * len(as_list(module.request_template["variable"]))
+    partial = {d: f for d, f in missing.items() if len(f) < fields}
+    print(f"{args.start} ~ {args.end}：缺 {len(missing)} 天，其中 {len(partial)} 天只缺部分小时/变量"
+          f"（查询用时 {elapsed * 1000:.1f}ms）")
+    for date_str, fields in list(partial.items())[:50]:
+        hours = sorted({h for h, _ in fields})
+        variables = sorted({v for _, v in fields})
+        print(f"  {date_str}: 小时 {hours} 变量 {variables}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import re
+import time
+import socket
+import argparse
+import importlib
+
+from pipeline import Pipeline, run_pipeline
+from retry import max_attempts
+
+# 分布式配置：本机多个进程共用一个台账（必须在本机磁盘上），协调者规划、各工作进程领取
+publish_interval = 10 * 60  # 协调者重新扫描、规划并补充工作表的间隔（秒）
+
+
+def worker_name():
+    """默认工作进程名：主机名-进程号（用于租约归属和文件名，只保留安全字符）"""
+    return re.sub(r"[^0-9A-Za-z.-]", "-", f"{socket.gethostname()}-{os.getpid()}")
+
+
+def network_path(path):
+    """是否为网络共享路径（UNC 路径 \\\\server\\share 或 //server/share）"""
+    return path.startswith(("\\\\", "//"))
+
+
+def shared_profile(profile, ledger_file=None, volumes=None):
+    """分布式模式下的 profile：台账改用适合多进程的日志模式，可为工作进程指定存储卷"""
+    profile = dict(profile, shared_ledger=True)
+    if ledger_file:
+        profile["ledger_file"] = ledger_file
+    if volumes:
+        profile["storage_volumes"] = volumes
+    return profile
+
+
+def coordinate(profile, interval=None, once=False):
+    """协调者：按台账缺失内容规划申请并放入共享工作表（已在工作表中待处理的不重复规划），直到全部完成"""
+    pipeline = Pipeline(profile)
+    pipeline.open()
+    ledger = pipeline.ledger
+    try:
+        while True:
+            active = ledger.active_work(pipeline.dataset, pipeline.template)
+            plan = pipeline.plan(active)
+            added = ledger.publish_work(pipeline.dataset, pipeline.template, plan, max_attempts)
+            summary = ledger.work_summary(pipeline.dataset, pipeline.template)
+            print(f"📋 {time.strftime('%H:%M:%S')} 新增 {added} 个申请；工作表 "
+                  + "，".join(f"{state} {count}" for state, count in sorted(summary.items())))
+            if once or not any(summary.get(state) for state in ("pending", "leased", "expired")):
+                break
+            time.sleep(interval or publish_interval)
+    finally:
+        ledger.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多个进程共同下载：协调者规划申请，工作进程凭租约领取、下载并记录到共享台账")
+    parser.add_argument("mode", choices=("coordinator", "worker"))
+    parser.add_argument("--script", default="era5_faster", help="下载脚本模块名，使用其 profile")
+    parser.add_argument("--ledger", help="共享台账路径，必须在本机磁盘上（不支持 SMB/NFS 网络共享目录）")
+    parser.add_argument("--volume", action="append", help="工作进程的存储卷，可重复；默认使用脚本中的配置")
+    parser.add_argument("--name", help="工作进程名，默认 主机名-进程号")
+    parser.add_argument("--start-year", type=int)
+    parser.add_argument("--end-year", type=int)
+    parser.add_argument("--interval", type=float, help="协调者重新规划的间隔（分钟）")
+    parser.add_argument("--once", action="store_true", help="协调者只规划一次")
+    args = parser.parse_args()
+
+    profile = shared_profile(importlib.import_module(args.script).profile, args.ledger, args.volume)
+    if network_path(profile["ledger_file"]):
+        print(f"⚠️ 台账 {profile['ledger_file']} 位于网络共享目录，文件锁不可靠，多个进程同时写可能重复领取或损坏台账")
+    if args.start_year and args.end_year:
+        profile["ranges"] = [(f"{args.start_year}-01-01", f"{args.end_year}-12-31")]
+    if args.mode == "coordinator":
+        coordinate(profile, args.interval * 60 if args.interval else None, args.once)
+    else:
+        run_pipeline(profile, worker=args.name or worker_name())
+
+
+if __name__ == "__main__":
+    main()
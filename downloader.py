@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from verify import StreamingHasher
+
+# 下载器配置
+segment_count = 8  # 单个文件的并发连接数
+min_segment_size = 16 * 1024 ** 2  # 每段最小16MB，小文件不再细分
+chunk_size = 1024 ** 2  # 每次写入1MB
+segment_retries = 5  # 单段断线重连次数
+progress_interval = 2  # 进度回调与断点记录间隔（秒）
+request_timeout = (30, 300)  # 连接/读取超时
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=32, session=None):
+    """创建带连接池和自动重试的会话（传入 session 时在其上配置）"""
+    session = session or requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("HEAD", "GET"),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """获取进程内共享的连接池会话"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def probe_url(session, url):
+    """HEAD 请求获取文件大小、ETag 以及是否支持 Range"""
+    response = session.head(url, allow_redirects=True, timeout=request_timeout)
+    response.raise_for_status()
+    size = int(response.headers.get("Content-Length", 0)) or None
+    return {
+        "url": response.url,
+        "size": size,
+        "etag": response.headers.get("ETag"),
+        "ranges": response.headers.get("Accept-Ranges", "").lower() == "bytes",
+    }
+
+
+def split_segments(size, count):
+    """把文件切分为若干段，pos 为该段下一个待写字节"""
+    count = max(1, min(count, size // min_segment_size or 1))
+    step = -(-size // count)
+    return [
+        {"start": start, "end": min(start + step, size) - 1, "pos": start}
+        for start in range(0, size, step)
+    ]
+
+
+def load_progress(progress_path, meta):
+    """读取断点记录，文件大小或ETag不一致时作废"""
+    try:
+        with open(progress_path, "r") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get("size") != meta["size"] or saved.get("etag") != meta["etag"]:
+        return None
+    return saved["segments"]
+
+
+def save_progress(progress_path, meta, segments):
+    """原子化写入断点记录"""
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"size": meta["size"], "etag": meta["etag"], "segments": segments}, f)
+    os.replace(tmp_path, progress_path)
+
+
+def _fetch_segment(session, url, part_path, segment, state):
+    """下载单个分段，断线后从已写位置继续；连续 segment_retries 次没有收到新数据时放弃"""
+    attempt = 0
+    while segment["pos"] <= segment["end"] and not state["stop"].is_set():
+        start = segment["pos"]
+        try:
+            headers = {"Range": f"bytes={segment['pos']}-{segment['end']}"}
+            with session.get(url, headers=headers, stream=True, timeout=request_timeout) as response:
+                if response.status_code != 206 and not (response.status_code == 200 and segment["pos"] == 0):
+                    raise IOError(f"服务器未返回分段内容 (HTTP {response.status_code})")
+                with open(part_path, "r+b") as f:
+                    f.seek(segment["pos"])
+                    for chunk in response.iter_content(chunk_size):
+                        if state["stop"].is_set():
+                            return
+                        chunk = chunk[:segment["end"] + 1 - segment["pos"]]
+                        f.write(chunk)
+                        f.flush()
+                        state["hasher"].update(segment["pos"], chunk)
+                        with state["lock"]:
+                            segment["pos"] += len(chunk)
+                            state["done"] += len(chunk)
+                        if segment["pos"] > segment["end"]:
+                            break
+            error = IOError(f"分段在 {segment['pos']}/{segment['end'] + 1} 字节处提前结束")
+        except Exception as e:
+            error = e
+        if segment["pos"] > start:
+            attempt = 0  # 本次连接有进展（含正常下完），继续从新位置开始
+            continue
+        attempt += 1
+        if attempt > segment_retries:
+            state["errors"].append(error)
+            state["stop"].set()
+            return
+        time.sleep(min(2 ** attempt, 60))
+
+
+def _fetch_whole(session, url, part_path, state):
+    """服务器不支持 Range 时单连接顺序下载，出错记入 state["errors"]"""
+    try:
+        with session.get(url, stream=True, timeout=request_timeout) as response:
+            response.raise_for_status()
+            if "Content-Encoding" not in response.headers:
+                # HEAD 没给出大小时，用 GET 响应的 Content-Length 检查是否下载完整
+                state["length"] = int(response.headers.get("Content-Length", 0)) or None
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    if state["stop"].is_set():
+                        return
+                    f.write(chunk)
+                    state["hasher"].update(state["done"], chunk)
+                    with state["lock"]:
+                        state["done"] += len(chunk)
+    except Exception as e:
+        state["errors"].append(e)
+        state["stop"].set()
+
+
+def segmented_download(url, output_path, session=None, segments=None, progress_callback=None):
+    """多连接分段下载到预分配文件，支持断点续传，返回文件信息（含 Content-Length 与边下边算的 SHA-256）"""
+    session = session or get_session()
+    meta = probe_url(session, url)
+    part_path = output_path + ".part"
+    progress_path = output_path + ".progress"
+    start_time = time.time()
+    state = {
+        "done": 0,
+        "lock": threading.Lock(),
+        "stop": threading.Event(),
+        "errors": [],
+        "hasher": StreamingHasher(part_path),
+        "length": None,
+    }
+
+    if meta["size"] and meta["ranges"]:
+        plan = load_progress(progress_path, meta) if os.path.exists(part_path) else None
+        if plan is None:
+            plan = split_segments(meta["size"], segments or segment_count)
+            with open(part_path, "wb") as f:
+                f.truncate(meta["size"])  # 预分配
+        state["done"] = sum(seg["pos"] - seg["start"] for seg in plan)
+        for seg in plan:
+            state["hasher"].add_written(seg["start"], seg["pos"])
+        workers = [
+            threading.Thread(target=_fetch_segment, args=(session, meta["url"], part_path, seg, state), daemon=True)
+            for seg in plan if seg["pos"] <= seg["end"]
+        ]
+    else:
+        plan = None
+        workers = [threading.Thread(target=_fetch_whole, args=(session, meta["url"], part_path, state), daemon=True)]
+
+    resumed = state["done"]
+    if progress_callback:
+        progress_callback(resumed, meta["size"], 0.0)  # 起点（断点续传时为已下载部分）
+    for worker in workers:
+        worker.start()
+
+    last_done, last_time = state["done"], time.time()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=progress_interval / len(workers))
+            now = time.time()
+            with state["lock"]:
+                done = state["done"]
+                if plan is not None:
+                    save_progress(progress_path, meta, plan)
+            if progress_callback:
+                progress_callback(done, meta["size"], (done - last_done) / max(now - last_time, 1e-6))
+            last_done, last_time = done, now
+    except BaseException:
+        state["stop"].set()
+        raise
+    finally:
+        if plan is not None:
+            with state["lock"]:
+                save_progress(progress_path, meta, plan)
+
+    if state["errors"]:
+        raise state["errors"][0]
+    expected_size = meta["size"] or state["length"]
+    if expected_size and state["done"] != expected_size:
+        raise IOError(f"下载不完整: {state['done']}/{expected_size} 字节")
+    sha256 = state["hasher"].hexdigest(state["done"])
+
+    os.replace(part_path, output_path)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+    elapsed = time.time() - start_time
+    return {
+        "path": output_path,
+        "size": state["done"],
+        "expected_size": expected_size,
+        "sha256": sha256,
+        "elapsed": elapsed,
+        "speed": (state["done"] - resumed) / max(elapsed, 1e-6),
+    }
+
+
+def print_progress(output_path):
+    """生成打印下载进度的回调"""
+    name = os.path.basename(output_path)
+
+    def callback(done, total, speed):
+        percent = f"{done / total * 100:5.1f}%" if total else f"{done / 1024 ** 2:.1f}MB"
+        print(f"\r📥 {name} {percent} {speed / 1024 ** 2:.1f}MB/s", end="", flush=True)
+
+    return callback
+
+
+def idm_download(idm_path, url, output_path):
+    """交给IDM下载（仅限Windows），只负责创建任务"""
+    subprocess.run(
+        [
+            idm_path,
+            '/d', url,
+            '/p', os.path.dirname(output_path),
+            '/f', os.path.basename(output_path),
+            '/n', '/s'
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_for_stable_size(path, interval=30, min_size=1024, timeout=3600):
+    """外部下载器兜底：无法得知总大小时，以文件大小稳定作为完成条件"""
+    start_time = time.time()
+    last_size = -1
+    while time.time() - start_time < timeout:
+        size = os.path.getsize(path) if os.path.exists(path) else -1
+        if size == last_size and size > min_size:
+            return True
+        last_size = size
+        time.sleep(interval)
+    return False
+
+
+class DownloadManager:
+    """下载任务池：多个文件并发下载，字节数达到 Content-Length 即通过回调通知完成"""
+
+    def __init__(self, max_workers=4, session=None):
+        self.session = session or get_session()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+
+    def submit(self, url, output_path, on_complete=None, on_error=None, progress_callback=None):
+        """提交下载任务，返回 Future；完成时调用 on_complete(info)，失败时调用 on_error(output_path, error)"""
+        future = self.executor.submit(
+            segmented_download, url, output_path, self.session, None, progress_callback
+        )
+
+        def _notify(f):
+            error = f.exception()
+            if error is None:
+                if on_complete:
+                    on_complete(f.result())
+            elif on_error:
+                on_error(output_path, error)
+
+        future.add_done_callback(_notify)
+        return future
+
+    def shutdown(self, wait=True):
+        """等待（或放弃）所有下载任务"""
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,326 @@
+import os
+import csv
+import shutil
+import zipfile
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from scanner import parse_cf_times
+from zip_refs import ArchiveDataset, open_archive
+
+# 提取配置
+points_file = "CHN_wind-speed_10m.csv"
+method = "bilinear"  # bilinear: 双线性插值；nearest: 最近格点
+time_block = 24 * 7  # 每次读取的时刻数，决定内存占用
+output_chunk = 24 * 31  # 输出文件时间方向分块
+u_name, v_name = "u10", "v10"
+read_size = 4 * 1024 ** 2
+
+_epoch = datetime(1970, 1, 1)
+
+
+def load_points(path):
+    """读取站点表，返回经度、纬度数组和原有的 value（空值为 None）"""
+    xs, ys, values = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            xs.append(float(row["x_coordinate"]))
+            ys.append(float(row["y_coordinate"]))
+            values.append(float(row["value"]) if row["value"].strip() else None)
+    return np.array(xs), np.array(ys), values
+
+
+def interpolation_weights(lat, lon, xs, ys, how=None):
+    """一次性计算所有站点在网格上的行号、列号和权重，形状 (站点数, 4) 或 (站点数, 1)；网格外的站点权重为0"""
+    how = how or method
+    dlat, dlon = lat[1] - lat[0], lon[1] - lon[0]
+    periodic = abs(dlon * len(lon)) >= 360 - 1e-6  # 全球网格经度首尾相接
+    fi = (ys - lat[0]) / dlat
+    fj = ((xs - lon[0]) % 360) / dlon
+
+    if how == "nearest":
+        rows = np.rint(fi)[:, None]
+        cols = np.rint(fj)[:, None]
+        weights = np.ones_like(rows)
+    else:
+        i0, j0 = np.floor(fi), np.floor(fj)
+        wi, wj = fi - i0, fj - j0
+        rows = np.stack([i0, i0, i0 + 1, i0 + 1], axis=1)
+        cols = np.stack([j0, j0 + 1, j0, j0 + 1], axis=1)
+        weights = np.stack([(1 - wi) * (1 - wj), (1 - wi) * wj, wi * (1 - wj), wi * wj], axis=1)
+
+    if periodic:
+        cols = cols % len(lon)
+    # 恰好落在最后一行/列上的点不需要下一个格点
+    rows = np.where((rows == len(lat)) & (weights == 0), rows - 1, rows)
+    cols = np.where((cols == len(lon)) & (weights == 0), cols - 1, cols)
+    inside = ((rows >= 0) & (rows < len(lat)) & (cols >= 0) & (cols < len(lon))).all(axis=1, keepdims=True)
+    weights = np.where(inside, weights, 0.0)
+    rows = np.where(inside, rows, 0).astype(np.int64)
+    cols = np.where(inside, cols, 0).astype(np.int64)
+    return rows, cols, weights
+
+
+class PointExtractor:
+    """站点时间序列提取：每种网格只计算一次插值索引，每个文件的每个时间块只做一次向量化取值"""
+
+    def __init__(self, xs, ys, how=None):
+        self.xs, self.ys = xs, ys
+        self.how = how or method
+        self.cache = {}  # 网格特征 -> (行, 列, 权重, 读取范围)
+
+    def weights_for(self, lat, lon):
+        key = (len(lat), len(lon), float(lat[0]), float(lon[0]), float(lat[1] - lat[0]), float(lon[1] - lon[0]))
+        if key not in self.cache:
+            rows, cols, weights = interpolation_weights(lat, lon, self.xs, self.ys, self.how)
+            used = weights.sum(axis=1) > 0
+            r0, r1 = (rows[used].min(), rows[used].max() + 1) if used.any() else (0, 1)
+            c0, c1 = (cols[used].min(), cols[used].max() + 1) if used.any() else (0, 1)
+            # 只读取覆盖全部站点的矩形范围；网格外的站点（权重为0）指向范围内第一个格点
+            rows = np.where(used[:, None], rows - r0, 0)
+            cols = np.where(used[:, None], cols - c0, 0)
+            self.cache[key] = (rows, cols, weights, (r0, r1, c0, c1))
+        return self.cache[key]
+
+    def gather(self, block, rows, cols, weights):
+        """block 形状 (时刻, 行, 列)，返回 (时刻, 站点)；缺测格点（如海面）不参与加权"""
+        values = block[:, rows, cols]  # (时刻, 站点, 格点)
+        valid = ~np.isnan(values)
+        w = np.where(valid, weights, 0.0)
+        total = w.sum(axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(total > 0, (np.where(valid, values, 0.0) * w).sum(axis=2) / total, np.nan)
+
+    def extract_file(self, path):
+        """读取一个 NetCDF 文件的 u10/v10，返回 (时间[自1970年的小时], 风速[时刻, 站点])，文件中没有风速分量时返回 None"""
+        with open_grid(path) as grid:
+            if u_name not in grid.variables or v_name not in grid.variables:
+                return None
+            rows, cols, weights, (r0, r1, c0, c1) = self.weights_for(grid.lat, grid.lon)
+            speeds = []
+            for t0 in range(0, len(grid.times), time_block):
+                t1 = min(len(grid.times), t0 + time_block)
+                u = self.gather(grid.read(u_name, t0, t1, r0, r1, c0, c1), rows, cols, weights)
+                v = self.gather(grid.read(v_name, t0, t1, r0, r1, c0, c1), rows, cols, weights)
+                speeds.append(np.hypot(u, v).astype(np.float32))
+            hours = np.array([(t - _epoch).total_seconds() // 3600 for t in grid.times], dtype=np.int64)
+        return hours, np.concatenate(speeds) if speeds else np.empty((0, len(self.xs)), np.float32)
+
+    def extract_archive(self, path):
+        """逐个成员提取，返回同上；一个压缩包的多个成员按时间合并"""
+        results = [r for r in map(self.extract_file, iter_members(path)) if r is not None]
+        if not results:
+            return None
+        hours = np.concatenate([h for h, _ in results])
+        order = np.argsort(hours, kind="stable")
+        return hours[order], np.concatenate([s for _, s in results])[order]
+
+
+def iter_members(path):
+    """依次给出压缩包中每个成员流式解压后的临时文件路径（用完即删）；未打包的文件直接给出
+
+    成员不压缩存储且为 NetCDF4 时，按分块引用把整个压缩包作为一个数据集给出，不解压、不占临时空间。
+    """
+    if not zipfile.is_zipfile(path):
+        yield path
+        return
+    archive = open_archive(path)
+    if archive is not None:
+        with archive:
+            yield archive
+        return
+    with tempfile.TemporaryDirectory(prefix="extract_") as workdir, zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            target = os.path.join(workdir, os.path.basename(name))
+            with zf.open(name) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, read_size)
+            yield target
+            os.remove(target)
+
+
+class open_grid:
+    """打开 NetCDF4(HDF5) 或 NetCDF3 文件，提供坐标、时间和按范围读取（已处理缩放与缺测值）"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        if isinstance(self.path, ArchiveDataset):  # 按引用直接读取的压缩包，由 iter_members 负责关闭
+            self.file, self.variables = None, self.path.variables
+        else:
+            self.file, self.variables = self.open_file(self.path)
+
+        lat_name = "latitude" if "latitude" in self.variables else "lat"
+        lon_name = "longitude" if "longitude" in self.variables else "lon"
+        time_name = "valid_time" if "valid_time" in self.variables else "time"
+        self.lat = np.asarray(self.variables[lat_name][:], dtype=np.float64)
+        self.lon = np.asarray(self.variables[lon_name][:], dtype=np.float64)
+        units = self.attr(self.variables[time_name], "units")
+        self.times = parse_cf_times(self.variables[time_name][:], units)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            self.file.close()
+
+    @staticmethod
+    def open_file(path):
+        """按文件头选择 h5py 或 scipy 打开，返回 (文件, 变量表)"""
+        with open(path, "rb") as f:
+            magic = f.read(4)
+        if magic.startswith(b"\x89HDF"):
+            import h5py
+
+            f = h5py.File(path, "r")
+            return f, f
+        if magic.startswith(b"CDF"):
+            from scipy.io import netcdf_file
+
+            f = netcdf_file(path, "r", mmap=False)
+            return f, f.variables
+        raise ValueError("只支持 NetCDF 文件")
+
+    @staticmethod
+    def attr(var, name, default=None):
+        attrs = getattr(var, "attrs", None)
+        value = attrs.get(name, default) if attrs is not None else getattr(var, name, default)
+        if isinstance(value, bytes):
+            return value.decode()
+        if isinstance(value, np.ndarray) and value.size == 1:
+            return value.item()
+        return value
+
+    def read(self, name, t0, t1, r0, r1, c0, c1):
+        """读取 [t0:t1, r0:r1, c0:c1] 范围并转换为 float32，缺测值为 NaN"""
+        var = self.variables[name]
+        raw = np.asarray(var[t0:t1, r0:r1, c0:c1])
+        data = raw.astype(np.float32)
+        for key in ("_FillValue", "missing_value"):
+            fill = self.attr(var, key)
+            if fill is not None:
+                data[raw == fill] = np.nan
+        scale, offset = self.attr(var, "scale_factor", 1.0), self.attr(var, "add_offset", 0.0)
+        if scale != 1.0 or offset != 0.0:
+            data = data * np.float32(scale) + np.float32(offset)
+        return data
+
+
+class SeriesWriter:
+    """列式输出：HDF5 中 wind_speed[时刻, 站点] 按时间追加，按站点分块，读单个站点的长序列只需读少量块"""
+
+    def __init__(self, path, xs, ys):
+        import h5py
+
+        self.file = h5py.File(path, "a")
+        if "wind_speed" not in self.file:
+            self.file["x_coordinate"] = xs
+            self.file["y_coordinate"] = ys
+            self.file.create_dataset("time", (0,), maxshape=(None,), dtype="i8", chunks=(output_chunk,))
+            self.file["time"].attrs["units"] = "hours since 1970-01-01 00:00:00"
+            self.file.create_dataset(
+                "wind_speed", (0, len(xs)), maxshape=(None, len(xs)), dtype="f4",
+                chunks=(output_chunk, min(len(xs), 32)), compression="gzip", compression_opts=4,
+                fillvalue=np.nan,
+            )
+        self.seen = set(self.file["time"][:].tolist())
+
+    def append(self, hours, speeds):
+        """写入新的时刻（已写入过的和同一批中重复的时刻跳过），保持时间轴有序，返回写入的时刻数"""
+        hours, first = np.unique(hours, return_index=True)
+        new = np.array([h not in self.seen for h in hours.tolist()], dtype=bool)
+        hours, speeds = hours[new], speeds[first[new]]
+        if not len(hours):
+            return 0
+        added = hours
+        times, data = self.file["time"], self.file["wind_speed"]
+        start = end = times.shape[0]
+        if end and times[end - 1] > hours[0]:
+            # 早于已写入时刻的（补缺文件、文件名排在后面的日文件）插入对应位置，其后已写入的时刻整体后移
+            start = int(np.searchsorted(times[:], hours[0]))
+            order = np.argsort(np.concatenate([times[start:], hours]), kind="stable")
+            hours = np.concatenate([times[start:], hours])[order]
+            speeds = np.concatenate([data[start:], speeds])[order]
+        for dataset in (times, data):
+            dataset.resize(end + len(added), axis=0)
+        times[start:] = hours
+        data[start:] = speeds
+        self.seen.update(added.tolist())
+        return len(added)
+
+    def mean_speed(self):
+        """各站点的平均风速"""
+        data = self.file["wind_speed"]
+        total, count = np.zeros(data.shape[1]), np.zeros(data.shape[1])
+        for t0 in range(0, data.shape[0], output_chunk):
+            block = data[t0:t0 + output_chunk]
+            total += np.nansum(block, axis=0)
+            count += (~np.isnan(block)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, total / count, np.nan)
+
+    def close(self):
+        self.file.close()
+
+
+def fill_points_file(path, output_path, means):
+    """把平均风速填入站点表中 value 为空的行"""
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    filled = 0
+    for row, mean in zip(rows, means):
+        if not row["value"].strip() and not np.isnan(mean):
+            row["value"] = f"{mean:.6f}"
+            filled += 1
+    with open(output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["x_coordinate", "y_coordinate", "value"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"已填充 {filled} 个空值，保存到 {output_path}")
+
+
+def list_archives(inputs):
+    """展开输入的文件和目录，按文件名（即日期）排序"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in os.listdir(item) if name.endswith((".zip", ".nc")))
+        else:
+            paths.append(item)
+    return sorted(paths, key=os.path.basename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从下载的 ERA5-Land 文件中提取站点10米风速时间序列")
+    parser.add_argument("inputs", nargs="+", help="压缩包/NetCDF 文件或所在目录")
+    parser.add_argument("--points", default=points_file, help="站点表（x_coordinate, y_coordinate, value）")
+    parser.add_argument("--output", default="wind_speed_10m.h5", help="输出的 HDF5 时间序列文件")
+    parser.add_argument("--method", choices=("bilinear", "nearest"), default=method)
+    parser.add_argument("--fill", help="把平均风速填入站点表空值后另存为该文件")
+    args = parser.parse_args()
+
+    xs, ys, _ = load_points(args.points)
+    extractor = PointExtractor(xs, ys, args.method)
+    writer = SeriesWriter(args.output, xs, ys)
+    archives = list_archives(args.inputs)
+    for i, path in enumerate(archives, 1):
+        try:
+            result = extractor.extract_archive(path)
+        except Exception as e:
+            print(f"⚠️ 无法读取 {os.path.basename(path)}: {str(e)}")
+            continue
+        if result is None:
+            print(f"跳过 {os.path.basename(path)}：没有 {u_name}/{v_name}")
+            continue
+        written = writer.append(*result)
+        print(f"[{i}/{len(archives)}] {os.path.basename(path)}：写入 {written} 个时刻")
+
+    if args.fill:
+        fill_points_file(args.points, args.fill, writer.mean_speed())
+    writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import os
+import argparse
+import importlib
+from datetime import datetime, timedelta
+
+# GRIB 参数 -> 变量短名（与 NetCDF 变量名一致）
+grib1_params = {  # ECMWF 参数表 128
+    129: "z", 130: "t", 131: "u", 132: "v", 133: "q", 134: "sp", 135: "w", 157: "r",
+    165: "u10", 166: "v10", 167: "t2m",
+}
+grib2_params = {  # (学科, 类别, 编号)
+    (0, 0, 0): "t", (0, 1, 0): "q", (0, 1, 1): "r", (0, 2, 2): "u", (0, 2, 3): "v", (0, 2, 8): "w",
+    (0, 3, 0): "sp", (0, 3, 4): "z",
+}
+height_names = {("u", 10): "u10", ("v", 10): "v10", ("t", 2): "t2m"}  # 离地高度层上的同名参数
+time_units = {0: 60, 1: 3600, 2: 86400, 10: 3 * 3600, 11: 6 * 3600, 12: 12 * 3600, 13: 1}  # 时间单位代码 -> 秒
+isobaric = 100  # 等压面层类型
+height_above_ground = 105  # GRIB1 离地高度层（GRIB2 为 103）
+
+
+def _reference_time(edition, section1):
+    """从第1段解析资料参考时间"""
+    if edition == 1:
+        century, year = section1[24], section1[12]
+        return datetime((century - 1) * 100 + year, section1[13], section1[14], section1[15], section1[16])
+    year = int.from_bytes(section1[12:14], "big")
+    return datetime(year, section1[14], section1[15], section1[16], section1[17], section1[18])
+
+
+def _signed(data):
+    """GRIB 用最高位表示符号的整数"""
+    value = int.from_bytes(data, "big")
+    sign = 1 << (len(data) * 8 - 1)
+    return -(value & (sign - 1)) if value & sign else value
+
+
+def _grib1_fields(pds):
+    """GRIB1 产品定义段：参数、层次、有效时间"""
+    reference = _reference_time(1, pds)
+    step = pds[19] if pds[20] in (2, 3, 4, 5) else pds[18]  # 时间范围类产品取区间结束时刻
+    level_type, level = pds[9], int.from_bytes(pds[10:12], "big")
+    variable = grib1_params.get(pds[8], f"param{pds[8]}")
+    if level_type == height_above_ground:
+        variable = height_names.get((variable, level), variable)
+    return variable, level, reference + timedelta(seconds=step * time_units.get(pds[17], 3600))
+
+
+def _grib2_fields(discipline, section1, section4):
+    """GRIB2 标识段与产品定义段：参数、层次、有效时间"""
+    template = int.from_bytes(section4[7:9], "big")
+    if template == 8 and len(section4) >= 41:  # 统计类产品取区间结束时刻
+        year = int.from_bytes(section4[34:36], "big")
+        valid = datetime(year, *section4[36:41])
+    else:
+        step = int.from_bytes(section4[18:22], "big")
+        valid = _reference_time(2, section1) + timedelta(seconds=step * time_units.get(section4[17], 3600))
+
+    surface, scale, value = section4[22], _signed(section4[23:24]), _signed(section4[24:28])
+    level = value / 10 ** scale if section4[23:28] != b"\xff" * 5 else None
+    if surface == isobaric and level is not None:
+        level /= 100  # Pa -> hPa
+    level = int(level) if level is not None and level == int(level) else level
+    variable = grib2_params.get((discipline, section4[9], section4[10]),
+                                f"param{discipline}.{section4[9]}.{section4[10]}")
+    if surface == 103:
+        variable = height_names.get((variable, level), variable)
+    return variable, level, valid
+
+
+def iter_grib_messages(f):
+    """顺序遍历GRIB1/GRIB2消息，只读每条消息的头部，返回 {offset, length, edition, variable, level, valid_time}"""
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        if header[:4] != b"GRIB":
+            raise ValueError(f"偏移 {offset} 处不是GRIB消息")
+
+        edition = header[7]
+        if edition == 1:
+            length = int.from_bytes(header[4:7], "big")
+            f.seek(offset + 8)
+            variable, level, valid_time = _grib1_fields(f.read(28))
+        elif edition == 2:
+            length = int.from_bytes(header[8:16], "big")
+            section1 = section4 = None
+            position = offset + 16
+            while section4 is None:
+                f.seek(position)
+                head = f.read(5)
+                if len(head) < 5 or head[:4] == b"7777":
+                    raise ValueError(f"偏移 {offset} 处的GRIB2消息缺少产品定义段")
+                size, number = int.from_bytes(head[:4], "big"), head[4]
+                if number == 1:
+                    section1 = head + f.read(16)
+                elif number == 4:
+                    section4 = head + f.read(min(size, 64) - 5)
+                position += size
+            variable, level, valid_time = _grib2_fields(header[6], section1, section4)
+        else:
+            raise ValueError(f"不支持的GRIB版本 {edition}")
+
+        yield {"offset": offset, "length": length, "edition": edition, "variable": variable, "level": level,
+               "valid_time": valid_time}
+        offset += length
+
+
+def index_file(path):
+    """为一个未打包的GRIB文件建立消息索引，非GRIB文件返回 None"""
+    with open(path, "rb") as f:
+        if f.read(4) != b"GRIB":
+            return None
+        return list(iter_grib_messages(f))
+
+
+class GribReader:
+    """按 (变量, 气压层, 时刻) 直接定位到GRIB消息的字节位置读取，不解码整个文件"""
+
+    def __init__(self, ledger, dataset, request):
+        self.ledger = ledger
+        self.dataset = dataset
+        self.request = request
+        self.files = {}
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, variable, level, valid_time):
+        """查询消息位置，返回 (文件路径, 偏移, 长度)，未索引时返回 None"""
+        return self.ledger.find_grib_message(self.dataset, self.request, variable, level, valid_time)
+
+    def read_message(self, variable, level, valid_time):
+        """读取一条GRIB消息的原始字节"""
+        location = self.find(variable, level, valid_time)
+        if location is None:
+            raise KeyError(f"未找到 {variable} {level}hPa {valid_time} 的GRIB消息")
+        path, offset, length = location
+        if path not in self.files:
+            self.files[path] = open(path, "rb")
+        f = self.files[path]
+        f.seek(offset)
+        data = f.read(length)
+        if len(data) != length or not data.startswith(b"GRIB"):
+            raise IOError(f"{os.path.basename(path)} 偏移 {offset} 处的消息与索引不符，请重新建立索引")
+        return data
+
+    def read(self, variable, level, valid_time):
+        """解码一条消息为二维数组（需要 eccodes）"""
+        import numpy as np
+        import eccodes
+
+        handle = eccodes.codes_new_from_message(self.read_message(variable, level, valid_time))
+        try:
+            values = eccodes.codes_get_values(handle)
+            shape = (eccodes.codes_get(handle, "Nj"), eccodes.codes_get(handle, "Ni"))
+        finally:
+            eccodes.codes_release(handle)
+        return np.asarray(values).reshape(shape)
+
+
+def index_pending(ledger, dataset, request):
+    """为台账中尚未建立索引的GRIB文件补建索引"""
+    pending = ledger.unindexed_files(dataset, request)
+    indexed = 0
+    for path in pending:
+        try:
+            messages = index_file(path)
+        except Exception as e:
+            print(f"⚠️ 无法建立索引 {os.path.basename(path)}: {str(e)}")
+            continue
+        if messages is None:
+            continue
+        ledger.save_grib_index(dataset, request, path, messages)
+        indexed += 1
+        print(f"[{indexed}] 已索引 {os.path.basename(path)}（{len(messages)} 条消息）")
+    return indexed
+
+
+def main():
+    from ledger import Ledger
+
+    parser = argparse.ArgumentParser(description="为台账中已下载的GRIB文件建立消息字节位置索引")
+    parser.add_argument("ledger", help="台账文件路径，如 G:\\data_from_era5\\download_ledger.sqlite")
+    parser.add_argument("--script", default="era5_daqi", help="下载脚本模块名，用于读取 dataset 与 request_template")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.script)
+    ledger = Ledger(args.ledger)
+    print(f"共索引 {index_pending(ledger, module.dataset, module.request_template)} 个文件")
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,622 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import importlib
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from coverage_index import CoverageBitmap, day_index, origin
+
+# 请求中描述时间范围的字段，不参与指纹计算
+temporal_keys = ("year", "month", "day", "date", "time")
+# 取值顺序有意义的字段（area 为 北/西/南/东），计算指纹时不排序
+ordered_keys = ("area", "grid")
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    recorded REAL,
+    volume TEXT
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    variable TEXT NOT NULL,
+    file_id INTEGER REFERENCES files(id),
+    PRIMARY KEY (dataset, fingerprint, date, hour, variable)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS coverage_file ON coverage(file_id);
+CREATE TABLE IF NOT EXISTS scan_cache (
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (dataset, fingerprint, directory, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversions (
+    path TEXT NOT NULL,
+    store TEXT NOT NULL,
+    time_steps INTEGER,
+    converted REAL,
+    PRIMARY KEY (path, store)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS jobs (
+    request_id TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    item TEXT NOT NULL,
+    request TEXT NOT NULL,
+    state TEXT,
+    path TEXT,
+    volume TEXT,
+    submitted REAL,
+    updated REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bitmaps (
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    bits BLOB NOT NULL,
+    PRIMARY KEY (dataset, fingerprint, variable)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS grib_messages (
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    level REAL NOT NULL,
+    valid_time TEXT NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (dataset, fingerprint, variable, level, valid_time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS grib_messages_file ON grib_messages(file_id);
+CREATE TABLE IF NOT EXISTS work (
+    id TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    first_date TEXT NOT NULL,
+    item TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    request_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS work_state ON work(dataset, fingerprint, state, first_date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def as_list(value):
+    """请求参数统一为字符串列表"""
+    if isinstance(value, (list, tuple, set)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def request_fingerprint(request):
+    """请求指纹：去掉时间与变量后的规范化参数哈希（区分格式、气压层、区域等）"""
+    body = {
+        key: as_list(value) if key in ordered_keys else sorted(as_list(value))
+        for key, value in request.items()
+        if key not in temporal_keys and key != "variable"
+    }
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def request_hours(request):
+    """请求中的小时列表"""
+    return sorted({int(t.split(":")[0]) for t in as_list(request.get("time", "00:00"))})
+
+
+def request_dates(request):
+    """展开请求中 year × month × day 对应的有效日期"""
+    dates = []
+    for year in as_list(request["year"]):
+        for month in as_list(request["month"]):
+            for day in as_list(request["day"]):
+                try:
+                    dates.append(date(int(year), int(month), int(day)).isoformat())
+                except ValueError:
+                    continue  # 2月30日之类的无效日期
+    return sorted(dates)
+
+
+def date_range(start, end):
+    """生成 [start, end] 内的日期字符串"""
+    current = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    while current <= last:
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+
+class Ledger:
+    """SQLite（WAL）下载台账，按 (数据集, 请求指纹, 日期, 小时, 变量) 记录已下载内容
+
+    shared=True 时供多个进程同时读写工作表，改用回滚日志。文件锁在 SMB/NFS 上不可靠，台账只能放在本机磁盘上。
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        if shared:
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(schema)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if "volume" not in columns:  # 旧版台账没有记录所在卷
+            self.conn.execute("ALTER TABLE files ADD COLUMN volume TEXT")
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(scan_cache)")}
+        if "dataset" not in columns:  # 旧版扫描缓存不区分数据集，只是缓存，删除后重新扫描即可
+            self.conn.execute("DROP TABLE scan_cache")
+            self.conn.executescript(schema)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def record_archive(self, dataset, request, path, size=None, sha256=None, dates=None, hours=None, volume=None):
+        """一个压缩包下载完成后，在一个事务内记录文件（及所在卷）和它包含的全部日期/小时/变量"""
+        fingerprint = request_fingerprint(request)
+        variables = as_list(request["variable"])
+        hours = request_hours(request) if hours is None else hours
+        dates = request_dates(request) if dates is None else dates
+        if size is None and os.path.exists(path):
+            size = os.path.getsize(path)
+        volume = os.path.abspath(volume or os.path.dirname(path))
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO files (path, size, sha256, recorded, volume) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size=excluded.size, sha256=excluded.sha256, "
+                "recorded=excluded.recorded, volume=excluded.volume",
+                (os.path.abspath(path), size, sha256, time.time(), volume),
+            )
+            file_id = self.conn.execute(
+                "SELECT id FROM files WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (dataset, fingerprint, d, h, v, file_id)
+                    for d in dates for h in hours for v in variables
+                ),
+            )
+            self._merge_bitmap(dataset, fingerprint, dates, hours, variables)
+        return file_id
+
+    def _load_bitmap(self, dataset, fingerprint):
+        """读取覆盖位图（调用方持有锁并处于事务中）；旧台账第一次使用时由 coverage 表生成"""
+        key = f"bitmap:{dataset}:{fingerprint}"
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            rows = self.conn.execute(
+                "SELECT variable, bits FROM bitmaps WHERE dataset = ? AND fingerprint = ?", (dataset, fingerprint)
+            )
+            return CoverageBitmap.from_blobs(dict(rows))
+
+        masks = defaultdict(lambda: defaultdict(int))
+        for date_str, hour, variable in self.conn.execute(
+            "SELECT date, hour, variable FROM coverage WHERE dataset = ? AND fingerprint = ?", (dataset, fingerprint)
+        ):
+            masks[variable][date_str] |= 1 << hour
+        bitmap = CoverageBitmap()
+        for variable, by_date in masks.items():
+            bitmap.add_masks(variable, [day_index(d) for d in by_date], list(by_date.values()))
+        self._save_bitmap(dataset, fingerprint, bitmap)
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(time.time())))
+        return bitmap
+
+    def _save_bitmap(self, dataset, fingerprint, bitmap):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO bitmaps VALUES (?, ?, ?, ?)",
+            ((dataset, fingerprint, variable, blob) for variable, blob in bitmap.to_blobs().items()),
+        )
+
+    def _merge_bitmap(self, dataset, fingerprint, dates, hours, variables):
+        """在写入 coverage 的同一事务内更新位图，两者始终一致"""
+        bitmap = self._load_bitmap(dataset, fingerprint)
+        bitmap.add(dates, hours, variables)
+        self._save_bitmap(dataset, fingerprint, bitmap)
+
+    def coverage_bitmap(self, dataset, request):
+        """该请求指纹的覆盖位图"""
+        with self.lock, self.conn:
+            return self._load_bitmap(dataset, request_fingerprint(request))
+
+    def downloaded_dates(self, dataset, request, start=None, end=None):
+        """返回所有小时、所有变量均已下载的日期集合"""
+        bitmap = self.coverage_bitmap(dataset, request)
+        return bitmap.complete(start or origin.isoformat(), end or bitmap.last_date(),
+                               request_hours(request), as_list(request["variable"]))
+
+    def missing_dates(self, dataset, request, start, end):
+        """返回 [start, end] 内尚未完整下载的日期（升序）"""
+        done = self.downloaded_dates(dataset, request, start, end)
+        return [d for d in date_range(start, end) if d not in done]
+
+    def missing_fields(self, dataset, request, start, end):
+        """返回 [start, end] 内缺失的 {日期: {(小时, 变量)}}，供规划器只申请缺失的小时/变量"""
+        bitmap = self.coverage_bitmap(dataset, request)
+        return bitmap.missing(start, end, request_hours(request), as_list(request["variable"]))
+
+    def file_for(self, dataset, request, date_str, hour=0):
+        """查询某日期/小时所在的文件路径"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT files.path FROM coverage JOIN files ON files.id = coverage.file_id "
+                "WHERE dataset = ? AND fingerprint = ? AND date = ? AND hour = ? LIMIT 1",
+                (dataset, request_fingerprint(request), date_str, hour),
+            ).fetchone()
+        return row[0] if row else None
+
+    def files_between(self, dataset, request, start, end):
+        """[start, end] 内有数据的文件路径（按最早日期排序）"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT files.path, MIN(coverage.date) AS first_date FROM coverage "
+                "JOIN files ON files.id = coverage.file_id "
+                "WHERE dataset = ? AND fingerprint = ? AND date BETWEEN ? AND ? "
+                "GROUP BY files.id ORDER BY first_date",
+                (dataset, request_fingerprint(request), start, end),
+            ).fetchall()
+        return [path for path, _ in rows]
+
+    def locate(self, dataset, request, date_str, hour=0, variable=None):
+        """按主键直接查询某日期/小时/变量所在的 (卷, 文件路径)，未下载时返回 None"""
+        variable = variable or as_list(request["variable"])[0]
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT files.volume, files.path FROM coverage JOIN files ON files.id = coverage.file_id "
+                "WHERE dataset = ? AND fingerprint = ? AND date = ? AND hour = ? AND variable = ?",
+                (dataset, request_fingerprint(request), date_str, hour, variable),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def save_grib_index(self, dataset, request, path, messages):
+        """记录一个已入账GRIB文件中每条消息的 (变量, 层次, 有效时间, 偏移, 长度)"""
+        fingerprint = request_fingerprint(request)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT id FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            if row is None:
+                raise KeyError(f"{path} 尚未记录到台账")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO grib_messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (dataset, fingerprint, m["variable"], m["level"] or 0, _time_key(m["valid_time"]), row[0],
+                     m["offset"], m["length"])
+                    for m in messages
+                ),
+            )
+
+    def find_grib_message(self, dataset, request, variable, level, valid_time):
+        """按主键查询一条GRIB消息所在的 (文件路径, 偏移, 长度)，未索引时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT files.path, grib_messages.offset, grib_messages.length FROM grib_messages "
+                "JOIN files ON files.id = grib_messages.file_id "
+                "WHERE dataset = ? AND fingerprint = ? AND variable = ? AND level = ? AND valid_time = ?",
+                (dataset, request_fingerprint(request), variable, level or 0, _time_key(valid_time)),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def unindexed_files(self, dataset, request):
+        """已入账但还没有GRIB消息索引的文件"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT files.id, files.path FROM coverage JOIN files ON files.id = coverage.file_id "
+                "WHERE dataset = ? AND fingerprint = ? "
+                "AND NOT EXISTS (SELECT 1 FROM grib_messages WHERE grib_messages.file_id = files.id)",
+                (dataset, request_fingerprint(request)),
+            ).fetchall()
+        return [path for _, path in rows if os.path.exists(path)]
+
+    def coverage_count(self, path):
+        """还有多少条覆盖记录指向该文件；为 0 表示其内容已全部由其他文件提供"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM coverage JOIN files ON files.id = coverage.file_id WHERE files.path = ?",
+                (os.path.abspath(path),),
+            ).fetchone()[0]
+
+    def remove_file(self, path):
+        """删除已被取代的文件的记录"""
+        path = os.path.abspath(path)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return
+            if self.conn.execute("SELECT 1 FROM coverage WHERE file_id = ? LIMIT 1", row).fetchone():
+                raise ValueError(f"{path} 仍有覆盖记录，不能删除")
+            self.conn.execute("DELETE FROM grib_messages WHERE file_id = ?", row)
+            self.conn.execute("DELETE FROM conversions WHERE path = ?", (path,))
+            self.conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    def save_compaction(self, target, fragments):
+        """记录一次月度合并的目标文件和待删除的碎片，中断后可以继续"""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              (f"compaction:{os.path.abspath(target)}", json.dumps(fragments)))
+
+    def finish_compaction(self, target):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM meta WHERE key = ?", (f"compaction:{os.path.abspath(target)}",))
+
+    def pending_compactions(self):
+        """上次中断、尚未完成的月度合并 {目标文件: [碎片]}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT key, value FROM meta WHERE key LIKE 'compaction:%'").fetchall()
+        return {key[len("compaction:"):]: json.loads(value) for key, value in rows}
+
+    def mark_converted(self, path, store, time_steps):
+        """记录压缩包已写入 Zarr 存储"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?)",
+                (os.path.abspath(path), os.path.abspath(store), time_steps, time.time()),
+            )
+
+    def pending_conversions(self, dataset, store):
+        """已下载但尚未写入该存储的文件，按最早日期排序"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT files.path, MIN(coverage.date) AS first_date FROM files "
+                "JOIN coverage ON coverage.file_id = files.id "
+                "WHERE coverage.dataset = ? AND files.path NOT IN (SELECT path FROM conversions WHERE store = ?) "
+                "GROUP BY files.id ORDER BY first_date",
+                (dataset, os.path.abspath(store)),
+            ).fetchall()
+        return [path for path, _ in rows if os.path.exists(path)]
+
+    def save_job(self, dataset, request_id, item, request, state, submitted):
+        """提交成功后立即记录CDS申请，程序中断后可以重新接上"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?)",
+                (request_id, dataset, request_fingerprint(request), json.dumps(item), json.dumps(request),
+                 state, submitted, time.time()),
+            )
+
+    def update_job(self, request_id, state=None, path=None, volume=None):
+        """更新申请状态或下载位置（None 表示不变）"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = COALESCE(?, state), path = COALESCE(?, path), "
+                "volume = COALESCE(?, volume), updated = ? WHERE request_id = ?",
+                (state, path, volume, time.time(), request_id),
+            )
+
+    def delete_job(self, request_id):
+        """申请已记录完成、最终失败或需要重新提交"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM jobs WHERE request_id = ?", (request_id,))
+
+    def load_jobs(self, dataset, request):
+        """上次运行留下的在途申请"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT request_id, item, request, state, path, volume, submitted FROM jobs "
+                "WHERE dataset = ? AND fingerprint = ? ORDER BY submitted",
+                (dataset, request_fingerprint(request)),
+            ).fetchall()
+        return [
+            {"request_id": request_id, "item": json.loads(item), "request": json.loads(req), "state": state,
+             "path": path, "volume": volume, "submitted": submitted}
+            for request_id, item, req, state, path, volume, submitted in rows
+        ]
+
+    def publish_work(self, dataset, request, plan, max_attempts=None):
+        """协调者把规划好的申请放入共享工作表，返回新增（或重新开放）的条数
+
+        同一申请（日期、小时、变量相同）只有一行；已完成但仍被规划的（CDS少给了内容）和失败次数未满的重新开放。
+        """
+        fingerprint = request_fingerprint(request)
+        now = time.time()
+        added = 0
+        with self.lock, self.conn:
+            for item in plan:
+                key = json.dumps([dataset, fingerprint, item["dates"], item["hours"], item["variables"]])
+                work_id = hashlib.sha256(key.encode()).hexdigest()[:16]
+                cursor = self.conn.execute(
+                    "INSERT INTO work (id, dataset, fingerprint, first_date, item, state, updated) "
+                    "VALUES (?, ?, ?, ?, ?, 'pending', ?) "
+                    "ON CONFLICT(id) DO UPDATE SET state = 'pending', owner = NULL, lease_expires = NULL, "
+                    "request_id = NULL, item = excluded.item, updated = excluded.updated "
+                    "WHERE state = 'done' OR (state = 'failed' AND attempts < ?)",
+                    (work_id, dataset, fingerprint, item["dates"][0], json.dumps(item), now, max_attempts or 1 << 30),
+                )
+                added += cursor.rowcount
+        return added
+
+    def claim_work(self, dataset, request, owner, lease):
+        """领取一条待处理（或租约已过期）的申请，租约 lease 秒；没有可领取的返回 None
+
+        BEGIN IMMEDIATE 先取得写锁再查询，本机多个进程同时领取也不会拿到同一条（依赖文件锁，见 Ledger 说明）。
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id, item, request_id, owner FROM work WHERE dataset = ? AND fingerprint = ? "
+                    "AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                    "ORDER BY first_date LIMIT 1",
+                    (dataset, request_fingerprint(request), now),
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE work SET state = 'leased', owner = ?, lease_expires = ?, updated = ? WHERE id = ?",
+                        (owner, now + lease, now, row[0]),
+                    )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        if row is None:
+            return None
+        work_id, item, request_id, previous = row
+        return {"id": work_id, "item": json.loads(item), "request_id": request_id, "previous_owner": previous}
+
+    def renew_leases(self, owner, work_ids, lease):
+        """心跳：延长本进程仍持有的租约，返回仍持有的 id 集合（已过期并被别人领走的不在其中）"""
+        if not work_ids:
+            return set()
+        now = time.time()
+        held = set()
+        with self.lock, self.conn:
+            for work_id in work_ids:
+                cursor = self.conn.execute(
+                    "UPDATE work SET lease_expires = ?, updated = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                    (now + lease, now, work_id, owner),
+                )
+                if cursor.rowcount:
+                    held.add(work_id)
+        return held
+
+    def update_work(self, work_id, owner, request_id):
+        """记录申请对应的CDS申请号，租约过期后接手的进程可以直接接上，不必重新提交"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE work SET request_id = ?, updated = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (request_id, time.time(), work_id, owner),
+            )
+
+    def finish_work(self, work_id, owner, state):
+        """结束租约：done 已记录到台账，failed 最终失败，pending 未处理完放回工作表"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE work SET state = ?, lease_expires = NULL, updated = ?, "
+                "owner = CASE WHEN ? = 'pending' THEN NULL ELSE owner END, "
+                "attempts = attempts + (? = 'failed') WHERE id = ? AND owner = ? AND state = 'leased'",
+                (state, time.time(), state, state, work_id, owner),
+            )
+
+    def active_work(self, dataset, request):
+        """工作表中尚未完成（待领取或已领取）的申请"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT item FROM work WHERE dataset = ? AND fingerprint = ? AND state IN ('pending', 'leased')",
+                (dataset, request_fingerprint(request)),
+            ).fetchall()
+        return [json.loads(item) for item, in rows]
+
+    def work_summary(self, dataset, request):
+        """工作表各状态的条数，租约已过期的单独计为 expired"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT CASE WHEN state = 'leased' AND lease_expires < ? THEN 'expired' ELSE state END, COUNT(*) "
+                "FROM work WHERE dataset = ? AND fingerprint = ? GROUP BY 1",
+                (time.time(), dataset, request_fingerprint(request)),
+            ).fetchall()
+        return dict(rows)
+
+    def scan_cache(self, dataset, request, directory):
+        """已扫描文件的 (大小, 修改时间) 缓存；按数据集和请求指纹区分，多个脚本共用一个卷时各自扫描"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, size, mtime_ns FROM scan_cache WHERE dataset = ? AND fingerprint = ? AND directory = ?",
+                (dataset, request_fingerprint(request), os.path.abspath(directory)),
+            ).fetchall()
+        return {name: (size, mtime_ns) for name, size, mtime_ns in rows}
+
+    def save_scan(self, dataset, request, directory, name, size, mtime_ns):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scan_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (dataset, request_fingerprint(request), os.path.abspath(directory), name, size, mtime_ns),
+            )
+
+    def prune_scan(self, dataset, request, directory, names):
+        """删除已不存在文件的扫描缓存"""
+        if not names:
+            return
+        fingerprint = request_fingerprint(request)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM scan_cache WHERE dataset = ? AND fingerprint = ? AND directory = ? AND name = ?",
+                ((dataset, fingerprint, os.path.abspath(directory), name) for name in names),
+            )
+
+    def import_dates_file(self, txt_path, dataset, request):
+        """一次性导入旧的 downloaded_dates.txt（已导入过的文件自动跳过）"""
+        if not os.path.exists(txt_path):
+            return 0
+        key = f"imported:{os.path.abspath(txt_path)}"
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return 0
+
+        with open(txt_path, "r") as f:
+            dates = sorted({line.strip() for line in f if line.strip()})
+        dates = [d for d in dates if _valid_date(d)]
+
+        fingerprint = request_fingerprint(request)
+        variables = as_list(request["variable"])
+        hours = request_hours(request)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO coverage VALUES (?, ?, ?, ?, ?, NULL)",
+                (
+                    (dataset, fingerprint, d, h, v)
+                    for d in dates for h in hours for v in variables
+                ),
+            )
+            self._merge_bitmap(dataset, fingerprint, dates, hours, variables)
+            self.conn.execute("INSERT INTO meta VALUES (?, ?)", (key, str(time.time())))
+        print(f"已从 {txt_path} 导入 {len(dates)} 个日期到台账")
+        return len(dates)
+
+
+def _time_key(value):
+    """有效时间统一为 YYYY-MM-DDTHH:MM 字符串"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime("%Y-%m-%dT%H:%M")
+
+
+def _valid_date(date_str):
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把旧的 downloaded_dates.txt 导入SQLite台账")
+    parser.add_argument("dates_file", help="downloaded_dates.txt 路径")
+    parser.add_argument("ledger", help="台账文件路径，如 F:\\era5\\download_ledger.sqlite")
+    parser.add_argument("--script", required=True,
+                        help="产生该记录的脚本模块名（如 era5_month），用于读取 dataset 与 request_template")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.script)
+    ledger = Ledger(args.ledger)
+    if not ledger.import_dates_file(args.dates_file, module.dataset, module.request_template):
+        print("没有需要导入的记录")
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,215 @@
 import os
+import csv
 import time
-from urllib.parse import quote
+import threading
+from http.cookiejar import MozillaCookieJar
+from urllib.parse import quote, unquote, urlparse
+
+import requests
+
+from downloader import DownloadManager, create_session, request_timeout
+from verify import check_download, file_sha256
 
 # 配置
 idm_path = r"D:\Internet Download Manager\IDMan.exe"  # IDM 安装路径
 links_file = "merra2.txt"  # 包含下载链接的文本文件
 download_folder = r"F:\merra2"  # 下载文件保存路径
+use_idm = False  # True 时改用IDM下载（仅限Windows）
+
+# 批量下载配置
+max_concurrent = 8  # 同时下载的文件数
+earthdata_host = "urs.earthdata.nasa.gov"  # 账号密码写在 ~/.netrc（Windows 为 %USERPROFILE%\_netrc）中
+cookie_file = os.path.join(download_folder, ".earthdata_cookies.txt")  # 登录后的cookie，下次运行直接复用
+manifest_file = os.path.join(download_folder, "manifest.csv")  # 每个文件的下载结果
+manifest_fields = ["name", "url", "status", "size", "sha256", "elapsed", "error", "time"]
+verify_sha256 = True  # 跳过已下载的文件前重新计算 SHA-256 与清单核对；文件多时较慢，False 时只核对大小和格式
+
+
+class EarthdataSession(requests.Session):
+    """NASA Earthdata 登录会话：重定向到登录服务器时带上账号密码，其他主机不带"""
+
+    def rebuild_auth(self, prepared_request, response):
+        if "Authorization" in prepared_request.headers:
+            original = urlparse(response.request.url).hostname
+            redirect = urlparse(prepared_request.url).hostname
+            if original != redirect and earthdata_host not in (original, redirect):
+                del prepared_request.headers["Authorization"]
+
+
+def create_earthdata_session(pool_size, first_url):
+    """登录一次（用第一个链接走完登录重定向拿到cookie），之后所有下载共用连接池和cookie"""
+    session = create_session(pool_size, EarthdataSession())
+    session.auth = requests.utils.get_netrc_auth(f"https://{earthdata_host}")
+    if session.auth is None:
+        print(f"⚠️ 未在 netrc 中找到 {earthdata_host} 的账号，只能下载无需登录的文件")
+    session.cookies = MozillaCookieJar(cookie_file)
+    if os.path.exists(cookie_file):
+        session.cookies.load(ignore_discard=True, ignore_expires=True)
+    with session.get(first_url, stream=True, timeout=request_timeout) as response:
+        response.raise_for_status()
+    return session
+
+
+def load_links(path):
+    """读取链接文件，返回 [(文件名, 编码后的链接)]"""
+    links = []
+    with open(path, "r") as f:
+        for link in f.read().splitlines():
+            if not link.strip():  # 跳过空行
+                continue
+            name = unquote(os.path.basename(urlparse(link).path))
+            links.append((name, quote(link.strip(), safe=":/?=&%")))
+    return links
+
+
+def load_manifest(path):
+    """读取已有清单，同名文件以最后一条为准"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="") as f:
+        return {row["name"]: row for row in csv.DictReader(f)}
+
+
+class Manifest:
+    """下载结果清单：每完成一个文件追加一行，中断后不丢失"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        new = not os.path.exists(path)
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=manifest_fields)
+        if new:
+            self.writer.writeheader()
+
+    def write(self, **row):
+        row["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def already_valid(path, entry):
+    """文件已存在且与清单中记录的大小、SHA-256 一致（verify_sha256 为 False 时不核对哈希）、格式完整时跳过"""
+    if not entry or entry["status"] != "ok" or not os.path.exists(path):
+        return False
+    ok, _ = check_download(path, int(entry["size"]))
+    if ok and verify_sha256 and entry["sha256"]:
+        ok = file_sha256(path) == entry["sha256"]
+    return ok
+
+
+def adopt_existing(path):
+    """清单中没有记录的已有文件（如IDM或旧版脚本下载的）：格式完整时返回补记到清单的大小和 SHA-256，否则返回 None
+
+    下载器先写 .part 完成后才改名，已有同名文件即为完整下载；清单中没有大小可比，只校验格式（压缩包校验CRC）。
+    """
+    if not os.path.exists(path):
+        return None
+    ok, _ = check_download(path)
+    if not ok:
+        return None
+    return {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+
+
+def bulk_download(links):
+    """登录一次后用共享连接池并发下载全部文件，跳过已下载且有效的文件（不在清单中的校验后补记），结果写入清单"""
+    previous = load_manifest(manifest_file)
+    manifest = Manifest(manifest_file)
+    try:
+        pending, adopted = [], 0
+        for name, url in links:
+            path = os.path.join(download_folder, name)
+            entry = previous.get(name)
+            if already_valid(path, entry):
+                continue
+            found = adopt_existing(path) if entry is None else None
+            if found:
+                manifest.write(name=name, url=url, status="ok", elapsed="", error="", **found)
+                adopted += 1
+                continue
+            pending.append((name, url))
+        print(f"共 {len(links)} 个文件，{len(links) - len(pending)} 个已下载（其中 {adopted} 个不在清单中，已校验补记），"
+              f"{len(pending)} 个待下载")
+        if pending:
+            download_pending(pending, manifest)
+    finally:
+        manifest.close()
+
+
+def download_pending(pending, manifest):
+    """并发下载 pending 中的文件，完成或失败都写入清单；回调来自下载线程，计数加锁"""
+    session = create_earthdata_session(max_concurrent * 4, pending[0][1])
+    manager = DownloadManager(max_workers=max_concurrent, session=session)
+    counts = {"ok": 0, "failed": 0}
+    counts_lock = threading.Lock()
+    start_time = time.time()
+
+    def count(outcome):
+        with counts_lock:
+            counts[outcome] += 1
+            return counts["ok"] + counts["failed"]
+
+    def on_complete(name, url, info):
+        ok, reason = check_download(info["path"], info["expected_size"])
+        if not ok:
+            on_error(name, url, info["path"], IOError(f"校验失败: {reason}"))
+            return
+        done = count("ok")
+        manifest.write(name=name, url=url, status="ok", size=info["size"], sha256=info["sha256"],
+                       elapsed=f"{info['elapsed']:.1f}", error="")
+        print(f"✅ [{done}/{len(pending)}] {name} ({info['speed'] / 1024 ** 2:.1f}MB/s)")
+
+    def on_error(name, url, path, error):
+        done = count("failed")
+        if os.path.exists(path):
+            os.remove(path)
+        manifest.write(name=name, url=url, status="failed", size="", sha256="", elapsed="", error=str(error))
+        print(f"❌ [{done}/{len(pending)}] {name}: {str(error)}")
+
+    try:
+        for name, url in pending:
+            manager.submit(
+                url, os.path.join(download_folder, name),
+                on_complete=lambda info, name=name, url=url: on_complete(name, url, info),
+                on_error=lambda path, error, name=name, url=url: on_error(name, url, path, error),
+            )
+        manager.shutdown(wait=True)
+    finally:
+        session.cookies.save(ignore_discard=True, ignore_expires=True)
+    print(f"下载结束：成功 {counts['ok']}，失败 {counts['failed']}，用时 {(time.time() - start_time) / 60:.1f} 分钟，"
+          f"清单见 {manifest_file}")
+
+
+def idm_download_all(links):
+    """逐个把链接加入IDM下载队列"""
+    for name, url in links:
+        command = f'"{idm_path}" /d "{url}" /p "{download_folder}" /n'
+        print(f"添加下载任务：{name}")
+        os.system(command)
+        time.sleep(1)  # 避免过快添加任务
+
+
+def main():
+    # 检查 IDM 路径是否存在
+    if use_idm and not os.path.exists(idm_path):
+        print(f"错误：未找到 IDM 可执行文件，请检查路径：{idm_path}")
+        return
+    # 读取链接文件
+    if not os.path.exists(links_file):
+        print(f"错误：未找到链接文件：{links_file}")
+        return
+
+    links = load_links(links_file)
+    os.makedirs(download_folder, exist_ok=True)
+    if use_idm:
+        idm_download_all(links)
+    else:
+        bulk_download(links)
+    print("所有链接已处理完毕。")
+
 
-# 检查 IDM 路径是否存在
-if not os.path.exists(idm_path):
-    print(f"错误：未找到 IDM 可执行文件，请检查路径：{idm_path}")
-    exit()
-
-# 读取链接文件
-if not os.path.exists(links_file):
-    print(f"错误：未找到链接文件：{links_file}")
-    exit()
-
-with open(links_file, "r") as file:
-    links = file.read().splitlines()
-
-# 遍历链接并添加到 IDM
-for link in links:
-    if not link.strip():  # 跳过空行
-        continue
-    # 对 URL 进行编码处理
-    encoded_link = quote(link, safe=":/?=&%")
-    # 构造 IDM 命令行
-    command = f'"{idm_path}" /d "{encoded_link}" /p "{download_folder}" /n'
-    print(f"添加下载任务：{link}")
-    os.system(command)
-    time.sleep(1)  # 避免过快添加任务
-
-print("所有链接已添加到 IDM 下载队列。")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 指标配置
+throughput_window = 10  # 瞬时下载速度按最近多少秒计算
+textfile_interval = 15  # 写 node-exporter textfile 的间隔（秒）
+
+_registry = []
+
+
+def _escape_label(value):
+    """标签值按文本格式转义反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class Metric:
+    """Prometheus 文本格式的指标，按标签分别计数"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        """采集时调用 function()，返回 {标签字典的元组: 值}"""
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            values = self.function()
+        except Exception:
+            return []
+        return [(self.name, labels, value) for labels, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        super().__init__(name, help_text)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (value <= b) for c, b in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", labels + (("le", f"{bound:g}"),), bucket_count))
+            samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Throughput:
+    """由累计字节数计算最近 throughput_window 秒的平均速度
+
+    下载进度回调每秒最多记录一次累计字节数，采集时再记录一次，因此采集间隔比窗口长也能算出速度。
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.history = []
+        self.lock = threading.Lock()
+
+    def sample(self, force=False):
+        """记录当前累计字节数，丢弃窗口之外的记录"""
+        now = time.time()
+        with self.lock:
+            if not force and self.history and now - self.history[-1][0] < 1:
+                return
+        total = sum(value for _, _, value in self.counter.samples())
+        with self.lock:
+            self.history.append((now, total))
+            self.history = [(t, v) for t, v in self.history if now - t <= throughput_window]
+
+    def __call__(self):
+        self.sample(force=True)
+        with self.lock:
+            (t0, v0), (t1, v1) = self.history[0], self.history[-1]
+        return {(): (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0}
+
+
+seconds_buckets = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+queue_buckets = (60, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400)
+
+# 流水线指标
+requests_submitted = Counter("cds_requests_submitted_total", "已提交的CDS申请数")
+requests_failed = Counter("cds_requests_failed_total", "失败的申请数（按阶段和错误类别）")
+requests_retried = Counter("cds_requests_retried_total", "重试次数（按错误类别）")
+requests_state = Gauge("cds_requests", "在途申请数（按CDS状态）")
+inflight_limit = Gauge("cds_inflight_limit", "当前允许的在途申请数（AIMD）")
+queue_time = Histogram("cds_queue_seconds", "申请从提交到CDS完成的时间", queue_buckets)
+bytes_downloaded = Counter("download_bytes_total", "已下载字节数")
+download_throughput = Gauge("download_throughput_bytes_per_second", "最近一段时间的下载速度")
+download_seconds = Histogram("download_seconds", "单个文件下载耗时", seconds_buckets)
+verify_seconds = Histogram("verify_seconds", "单个文件校验耗时", seconds_buckets)
+ledger_write_seconds = Histogram("ledger_write_seconds", "台账写入耗时", seconds_buckets)
+files_recorded = Counter("files_recorded_total", "已校验并记录的文件数")
+stage_queue_depth = Gauge("pipeline_queue_depth", "各阶段之间队列中等待的任务数")
+volume_free_bytes = Gauge("volume_free_bytes", "各存储卷剩余空间")
+
+throughput = Throughput(bytes_downloaded)
+download_throughput.set_function(throughput)
+
+
+def render():
+    """所有指标的 Prometheus 文本格式"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def progress_counter(callback=None):
+    """下载进度回调：把新增的字节数计入 download_bytes_total，再转给原回调"""
+    state = {"done": None}
+
+    def on_progress(done, total, speed):
+        if state["done"] is not None and done > state["done"]:
+            bytes_downloaded.inc(done - state["done"])
+            throughput.sample()
+        state["done"] = done
+        if callback:
+            callback(done, total, speed)
+
+    return on_progress
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """在后台线程提供 http://host:port/metrics"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 指标地址 http://{host}:{port}/metrics")
+    return server
+
+
+def start_textfile_writer(path, interval=None):
+    """定期把指标写入 node-exporter textfile（先写临时文件再替换，避免读到一半）"""
+    stop = threading.Event()
+
+    def loop():
+        while True:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(render())
+            os.replace(tmp_path, path)
+            if stop.wait(interval or textfile_interval):
+                return
+
+    threading.Thread(target=loop, name="metrics-textfile", daemon=True).start()
+    return stop
@@ -0,0 +1,261 @@
+import os
+import re
+import io
+import json
+import time
+import uuid
+import random
+import zipfile
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ledger import as_list, request_dates, request_hours
+
+# 模拟服务器配置（用于压测，不消耗CDS配额）
+queue_latency = (5, 30)  # 申请从提交到完成的时间范围（秒），在其中均匀随机
+failure_rate = 0.0  # 申请最终为 failed 的比例
+max_active = 0  # 每个账户同时排队/运行的申请数上限，超出时像CDS一样拒绝提交；0 表示不限
+field_bytes = 16 * 1024  # 每个字段（变量 × 日期 × 小时）生成的字节数
+max_file_size = 512 * 1024 ** 2  # 单个结果文件的大小上限
+bandwidth = 0  # 每个连接的下载限速（字节/秒），0 表示不限
+payload_cache_size = 8  # 内存中最多保留多少个不同大小的结果文件
+
+range_pattern = re.compile(r"bytes=(\d*)-(\d*)")
+member_name = "data_0.nc"
+zip_overhead = 98 + 2 * len(member_name)  # 不压缩的单文件 ZIP 的文件头与目录长度
+
+
+def payload_size(request):
+    """按请求的字段数估算结果文件大小"""
+    fields = len(request_dates(request)) * len(request_hours(request)) * len(as_list(request.get("variable", [])))
+    return zip_overhead + min(fields * field_bytes, max_file_size)
+
+
+class MockCDS:
+    """模拟CDS旧版API（cdsapi 使用的部分）：提交申请、查询状态、下载结果（支持 Range）"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.payloads = {}
+        self.lock = threading.Lock()
+        self.block = os.urandom(1024 ** 2)  # 结果文件内容由这块随机数据重复拼成
+        self.stats = {"submitted": 0, "rejected": 0, "bytes_sent": 0}
+
+    def submit(self, dataset, request):
+        """登记一个申请，返回 (HTTP状态码, 回复)"""
+        now = time.time()
+        with self.lock:
+            active = sum(1 for job in self.jobs.values() if job["done"] > now)
+            if max_active and active >= max_active:
+                self.stats["rejected"] += 1
+                return 403, {"message": f"Number of queued requests is temporarily limited: maximum number of "
+                                        f"{max_active} requests per user reached",
+                             "reason": "too many requests queued"}
+            request_id = uuid.uuid4().hex
+            latency = random.uniform(*queue_latency)
+            self.jobs[request_id] = {
+                "dataset": dataset,
+                "size": payload_size(request),
+                "submitted": now,
+                "started": now + latency * 0.8,  # 前 80% 时间排队，之后运行
+                "done": now + latency,
+                "failed": random.random() < failure_rate,
+            }
+            self.stats["submitted"] += 1
+        return 202, self.reply(request_id)
+
+    def reply(self, request_id, base_url=""):
+        """按当前时间给出申请状态"""
+        job = self.jobs.get(request_id)
+        if job is None:
+            return None
+        now = time.time()
+        if now < job["started"]:
+            return {"state": "queued", "request_id": request_id}
+        if now < job["done"]:
+            return {"state": "running", "request_id": request_id}
+        if job["failed"]:
+            return {"state": "failed", "request_id": request_id,
+                    "error": {"message": "Internal error (simulated)", "reason": "simulated failure"}}
+        return {"state": "completed", "request_id": request_id, "content_length": job["size"],
+                "content_type": "application/zip", "location": f"{base_url}/download/{request_id}.zip"}
+
+    def delete(self, request_id):
+        with self.lock:
+            return self.jobs.pop(request_id, None) is not None
+
+    def payload(self, request_id):
+        """已完成申请的结果文件（ZIP），相同大小的文件复用同一份内容"""
+        reply = self.reply(request_id)
+        if reply is None or reply["state"] != "completed":
+            return None
+        size = self.jobs[request_id]["size"]
+        with self.lock:
+            data = self.payloads.pop(size, None)
+            if data is None:
+                data = self.build_zip(size)
+            self.payloads[size] = data  # 移到末尾，淘汰最早使用的
+            while len(self.payloads) > payload_cache_size:
+                self.payloads.pop(next(iter(self.payloads)))
+        return data
+
+    def build_zip(self, size):
+        """生成总大小为 size 的 ZIP（不压缩，CRC 有效），与回复中的 content_length 一致"""
+        length = size - zip_overhead
+        content = (self.block * (length // len(self.block) + 1))[:length]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr(member_name, content)
+        return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MockCDS/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cds(self):
+        return self.server.cds
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host', '%s:%s' % self.server.server_address[:2])}"
+
+    def route(self):
+        """路径最后两段，兼容 /api/v2 等任意前缀"""
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        return parts[-2] if len(parts) > 1 else "", parts[-1]
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        kind, name = self.route()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if kind != "resources":
+            self.send_json(404, {"message": "not found"})
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self.send_json(400, {"message": "invalid request"})
+            return
+        self.send_json(*self.cds.submit(name, request))
+
+    def do_GET(self):
+        self.send_payload(head=False)
+
+    def do_HEAD(self):
+        self.send_payload(head=True)
+
+    def do_DELETE(self):
+        kind, request_id = self.route()
+        if kind == "tasks" and self.cds.delete(request_id):
+            self.send_json(200, {"state": "deleted", "request_id": request_id})
+        else:
+            self.send_json(404, {"message": "request not found"})
+
+    def send_payload(self, head):
+        kind, name = self.route()
+        if name == "status.json":
+            self.send_json(200, {})
+            return
+        if kind == "tasks":
+            reply = self.cds.reply(name, self.base_url())
+            self.send_json(200 if reply else 404, reply or {"message": "request not found"})
+            return
+        data = self.cds.payload(name[:-4]) if kind == "download" and name.endswith(".zip") else None
+        if data is None:
+            self.send_json(404, {"message": "result not found"})
+            return
+
+        start, end, status = 0, len(data) - 1, 200
+        match = range_pattern.fullmatch(self.headers.get("Range", ""))
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            else:
+                start = max(0, len(data) - int(last))
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{name}"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        if not head:
+            self.write_throttled(memoryview(data)[start:end + 1])
+
+    def write_throttled(self, view):
+        """按 bandwidth 限速发送"""
+        chunk = 256 * 1024
+        started = time.time()
+        for offset in range(0, len(view), chunk):
+            piece = view[offset:offset + chunk]
+            self.wfile.write(piece)
+            with self.cds.lock:
+                self.cds.stats["bytes_sent"] += len(piece)
+            if bandwidth:
+                delay = (offset + len(piece)) / bandwidth - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port=0, host="127.0.0.1"):
+    """在后台线程启动模拟服务器，返回 (server, 供 CDSAPI_URL 使用的地址)"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.cds = MockCDS()
+    threading.Thread(target=server.serve_forever, name="mockcds", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v2"
+
+
+def main():
+    global queue_latency, failure_rate, max_active, field_bytes, bandwidth
+
+    parser = argparse.ArgumentParser(description="本地模拟CDS服务器，用于压测下载流水线")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, nargs=2, default=queue_latency, metavar=("最短", "最长"),
+                        help="申请从提交到完成的时间范围（秒）")
+    parser.add_argument("--failure-rate", type=float, default=failure_rate, help="申请失败的比例")
+    parser.add_argument("--max-active", type=int, default=max_active, help="同时排队/运行的申请数上限，0 不限")
+    parser.add_argument("--field-bytes", type=int, default=field_bytes, help="每个字段生成的字节数")
+    parser.add_argument("--bandwidth", type=float, default=bandwidth, help="每个连接限速（字节/秒），0 不限")
+    args = parser.parse_args()
+
+    queue_latency, failure_rate, max_active = tuple(args.latency), args.failure_rate, args.max_active
+    field_bytes, bandwidth = args.field_bytes, args.bandwidth
+    server, url = start_server(args.port, args.host)
+    print(f"🧪 模拟CDS服务器已启动，设置环境变量后运行下载脚本：\n"
+          f"   CDSAPI_URL={url}\n   CDSAPI_KEY=1:mock")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"已收到 {server.cds.stats['submitted']} 个申请，拒绝 {server.cds.stats['rejected']} 个，"
+                  f"已发送 {server.cds.stats['bytes_sent'] / 1024 ** 2:.0f}MB")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,671 @@
+import os
+import time
+import shutil
+import signal
+import asyncio
+
+import cdsapi
+
+import metrics
+from downloader import segmented_download, idm_download, wait_for_stable_size
+from verify import check_download, get_verify_pool, shutdown_verify_pool
+from ledger import Ledger
+from scanner import scan_directory, read_archive_contents, record_contents
+from grib_index import index_file
+from planner import plan_requests, build_request, print_plan
+from storage import Storage
+from cache import ResultCache
+from convert import convert_archive, get_convert_pool, shutdown_convert_pool
+from retry import (AIMDLimiter, PermanentError, classify_error, backoff_delay, retryable, max_attempts,
+                   QUEUE_FULL, RATE_LIMITED)
+
+# 流水线默认配置（可在各脚本的 profile 中覆盖）
+max_inflight_requests = 8  # 同时在CDS排队/处理的申请数上限（实际名额按限流情况自动调节）
+poll_interval = 30  # 申请状态轮询间隔（秒）
+queue_size = 16  # 阶段之间队列长度，满了上游自动等待
+stage_concurrency = {"submit": 4, "download": 4, "verify": 2, "record": 1, "convert": 1}
+lease_seconds = 10 * 60  # 分布式模式下领取的申请的租约时长，每 1/3 时长续约一次
+
+_DONE = object()  # 阶段结束标记
+
+
+class CDSRequestError(Exception):
+    """CDS 返回 failed 状态"""
+
+
+class Pipeline:
+    """asyncio 下载流水线：规划 → 提交 → 轮询 → 下载 → 校验 → 记录，阶段之间用有界队列衔接"""
+
+    def __init__(self, profile, scheduler=None, worker=None):
+        self.profile = profile
+        self.scheduler = scheduler  # 与其他数据集共用CDS账户时由 scheduler.Scheduler 分配在途名额
+        self.worker = worker  # 分布式模式下的工作进程名：不自行规划，从台账的共享工作表中领取申请
+        self.lease = profile.get("lease_seconds", lease_seconds)
+        self.leases = set()  # 本进程持有租约的工作表 id
+        self.lost = set()  # 租约过期后已被其他进程领走的 id
+        self.dataset = profile["dataset"]
+        self.template = profile["request_template"]
+        self.directory = profile["install_directory"]
+        self.volumes = profile.get("storage_volumes") or [self.directory]
+        self.zarr_store = profile.get("zarr_store")  # 设置后，下载的压缩包会追加写入该 Zarr 存储
+        self.concurrency = dict(stage_concurrency, **profile.get("concurrency", {}))
+        self.inflight_limit = profile.get("max_inflight_requests", max_inflight_requests)
+        self.poll_interval = profile.get("poll_interval", poll_interval)
+        self.queues = {}
+        self.stopping = False
+        self.stats = {"planned": 0, "submitted": 0, "downloaded": 0, "recorded": 0, "converted": 0, "cached": 0, "reattached": 0, "failed": 0}
+        self.ledger = None
+        self.client = None
+        self.storage = None
+        self.cache = None
+        self.claimed = set()  # 本次运行已分配的下载路径
+
+    # ---------- 启动与关闭 ----------
+
+    def open(self):
+        """打开台账和存储卷，首次运行时导入旧的 downloaded_dates.txt"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.storage = Storage(self.volumes, self.profile.get("placement"), self.profile.get("min_free_space"))
+        if self.profile.get("cache_directory"):
+            self.cache = ResultCache(self.profile["cache_directory"], self.profile.get("max_cache_size"))
+        self.ledger = Ledger(self.profile.get("ledger_file") or os.path.join(self.directory, "download_ledger.sqlite"),
+                             shared=self.profile.get("shared_ledger", False))
+        if self.profile.get("legacy_dates_file"):
+            self.ledger.import_dates_file(self.profile["legacy_dates_file"], self.dataset, self.template)
+
+    def plan(self, inflight=()):
+        """增量扫描各存储卷后，按台账缺失内容规划申请；inflight 中的申请（已在CDS上）不再重复规划"""
+        for volume in self.volumes:
+            scan_directory(volume, self.ledger, self.dataset, self.template)
+        missing = {}
+        for start, end in self.profile["ranges"]:
+            missing.update(self.ledger.missing_fields(self.dataset, self.template, start, end))
+        for item in inflight:
+            fields = {(h, v) for h in item["hours"] for v in item["variables"]}
+            for date_str in item["dates"]:
+                if date_str in missing:
+                    missing[date_str] -= fields
+        missing = {d: fields for d, fields in missing.items() if fields}
+        return plan_requests(missing, self.profile.get("max_fields_per_request"))
+
+    def reattach(self):
+        """重新接上上次运行中已提交的申请：仍在排队、运行或已完成的从当前状态继续，其余删除后重新规划"""
+        jobs = []
+        for saved in self.ledger.load_jobs(self.dataset, self.template):
+            try:
+                result = cdsapi.api.Result(self.client, {"request_id": saved["request_id"], "state": saved["state"]})
+                result.update()
+                state = result.reply.get("state")
+            except Exception as e:
+                print(f"无法重新连接申请 {saved['request_id']}: {str(e)}")
+                state = None
+            if state not in ("accepted", "queued", "running", "completed"):
+                self.ledger.delete_job(saved["request_id"])
+                continue
+            job = {"item": saved["item"], "request": saved["request"], "result": result,
+                   "submitted": saved["submitted"], "request_id": saved["request_id"]}
+            if saved["path"] and saved["volume"] in self.storage.volumes:
+                job.update(path=saved["path"], volume=saved["volume"])  # 继续上次的断点续传
+                self.claimed.add(saved["path"])
+            jobs.append(job)
+        if jobs:
+            print(f"🔗 重新接上 {len(jobs)} 个上次提交的申请，不再重新排队")
+        return jobs
+
+    def request_stop(self):
+        """优雅停止：不再提交新申请，已提交的申请继续下载、校验、记录完毕"""
+        if not self.stopping:
+            print("\n⏹ 收到停止信号，等待在途任务完成（再按一次 Ctrl+C 强制退出）")
+        self.stopping = True
+        if self.scheduler and self.queues:
+            for _ in range(self.scheduler.cancel(self)):
+                self._settle()
+
+    async def run(self):
+        """运行整条流水线直到全部任务完成或被停止"""
+        self.client = cdsapi.Client(wait_until_complete=False, delete=False)
+        if self.scheduler:
+            self.limiter, self.slots = self.scheduler.attach(self)
+        else:
+            self.limiter = AIMDLimiter(initial=min(4, self.inflight_limit), maximum=self.inflight_limit)
+            self.slots = asyncio.Condition()
+        self.outstanding = 0  # 尚未结束（记录完成或最终失败）的申请数
+        self.produced = False
+        self.settled = asyncio.Event()
+        self.retry_tasks = set()
+        for name in ("submit", "poll", "download", "verify", "record", "convert"):
+            self.queues[name] = asyncio.Queue(maxsize=queue_size)
+        convert_queue = self.queues["convert"] if self.zarr_store else None
+
+        if self.worker:
+            producer = self._produce_claimed()
+            print(f"👷 工作进程 {self.worker} 从共享工作表领取申请")
+        else:
+            inflight = await asyncio.to_thread(self.reattach)
+            plan = await asyncio.to_thread(self.plan, [job["item"] for job in inflight])
+            print(f"规划完成：{len(plan)} 个申请")
+            producer = self._produce(plan, inflight)
+        start_time = time.time()
+        self._start_metrics()
+
+        await asyncio.gather(
+            producer,
+            self._stage("submit", self._submit, self.queues["submit"], self.queues["poll"], 1),
+            self._poll_stage(),
+            self._stage("download", self._download, self.queues["download"], self.queues["verify"],
+                        self.concurrency["verify"]),
+            self._stage("verify", self._verify, self.queues["verify"], self.queues["record"],
+                        self.concurrency["record"]),
+            self._stage("record", self._record, self.queues["record"], convert_queue,
+                        self.concurrency["convert"] if convert_queue else 0),
+            self._stage("convert", self._convert, convert_queue, None, 0) if convert_queue else asyncio.sleep(0),
+        )
+        if not self.scheduler:  # 共用的进程池由调度器在所有流水线结束后关闭
+            await asyncio.to_thread(shutdown_verify_pool)
+            await asyncio.to_thread(shutdown_convert_pool)
+        print(f"🏁 流水线结束，用时 {(time.time() - start_time) / 60:.1f} 分钟：{self.stats}")
+
+    async def _produce(self, plan, inflight=()):
+        """规划阶段：重新接上的申请直接进入轮询，新申请依次放入提交队列（队列满时等待），全部申请结束后通知下游"""
+        for job in inflight:
+            self.outstanding += 1
+            self.limiter.acquire()
+            await self.queues["poll"].put(job)
+            self.stats["reattached"] += 1
+        for item in plan:
+            if self.stopping:
+                break
+            self.outstanding += 1
+            await self._enqueue(item)
+            self.stats["planned"] += 1
+        self.produced = True
+        self._check_settled()
+
+        # 重试的申请会重新进入队列，所以要等全部申请结束才能发结束标记
+        await self.settled.wait()
+        for _ in range(self.concurrency["submit"]):
+            await self.queues["submit"].put(_DONE)
+
+    async def _produce_claimed(self):
+        """分布式模式的规划阶段：本机有空闲时才从共享工作表领取申请（带租约），工作表全部处理完后结束"""
+        heartbeat = asyncio.create_task(self._heartbeat())
+        while not self.stopping:
+            if self.outstanding >= int(self.limiter.limit) + self.concurrency["download"]:
+                await asyncio.sleep(1)
+                continue
+            work = await asyncio.to_thread(self.ledger.claim_work, self.dataset, self.template, self.worker,
+                                           self.lease)
+            if work is None:
+                summary = await asyncio.to_thread(self.ledger.work_summary, self.dataset, self.template)
+                if not any(summary.get(state) for state in ("pending", "leased", "expired")):
+                    break
+                await asyncio.sleep(self.poll_interval)  # 其他进程持有的租约过期后会回到工作表
+                continue
+
+            item = dict(work["item"], work_id=work["id"])
+            self.leases.add(work["id"])
+            self.outstanding += 1
+            if not await asyncio.to_thread(self._still_missing, item):
+                print(f"⏭ {item['filename']} 已由其他进程下载")
+                self._settle(item, "done")
+                continue
+            job = await asyncio.to_thread(self._reattach_work, item, work) if work["request_id"] else None
+            if job:
+                self.limiter.acquire()
+                await self.queues["poll"].put(job)
+                self.stats["reattached"] += 1
+            else:
+                await self._enqueue(item)
+                self.stats["planned"] += 1
+        self.produced = True
+        self._check_settled()
+
+        await self.settled.wait()
+        heartbeat.cancel()
+        for _ in range(self.concurrency["submit"]):
+            await self.queues["submit"].put(_DONE)
+
+    async def _heartbeat(self):
+        """定期续约；续约失败说明租约已过期并被其他进程领走，尚未提交的就不再提交"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            leases = set(self.leases)
+            try:
+                held = await asyncio.to_thread(self.ledger.renew_leases, self.worker, leases, self.lease)
+            except Exception as e:
+                print(f"⚠️ 续约失败: {str(e)}")
+                continue
+            if leases - held:
+                print(f"⚠️ {len(leases - held)} 个申请的租约已过期，已由其他进程接手")
+                self.lost |= leases - held
+                self.leases -= leases - held
+
+    def _still_missing(self, item):
+        """领取的申请是否仍有缺失内容（租约过期前原持有者可能已经记录）"""
+        missing = self.ledger.missing_fields(self.dataset, self.template, item["dates"][0], item["dates"][-1])
+        fields = {(h, v) for h in item["hours"] for v in item["variables"]}
+        return any(missing.get(d, set()) & fields for d in item["dates"])
+
+    def _reattach_work(self, item, work):
+        """接手租约过期的申请：原持有者已经提交过时直接接上该CDS申请"""
+        try:
+            result = cdsapi.api.Result(self.client, {"request_id": work["request_id"], "state": "queued"})
+            result.update()
+        except Exception as e:
+            print(f"无法重新连接申请 {work['request_id']}: {str(e)}")
+            return None
+        if result.reply.get("state") not in ("accepted", "queued", "running", "completed"):
+            return None
+        print(f"🔗 接手 {work['previous_owner']} 提交的申请 {item['filename']}")
+        return {"item": item, "request": build_request(self.template, item), "result": result,
+                "submitted": time.time(), "request_id": work["request_id"]}
+
+    def _settle(self, item=None, outcome="done"):
+        """一个申请结束（记录完成、放弃或停止时丢弃）；分布式模式下同时结束其租约（done / failed / pending）"""
+        self.outstanding -= 1
+        work_id = item.get("work_id") if item else None
+        if work_id in self.leases:
+            self.leases.discard(work_id)
+            self.ledger.finish_work(work_id, self.worker, outcome)
+        self._check_settled()
+
+    def _check_settled(self):
+        if self.produced and self.outstanding == 0:
+            self.settled.set()
+
+    async def _stage(self, name, handler, inq, outq, downstream_workers):
+        """通用阶段：若干个 worker 从 inq 取任务处理后放入 outq，全部结束后通知下游"""
+        async def worker():
+            while True:
+                job = await inq.get()
+                if job is _DONE:
+                    return
+                try:
+                    result = await handler(job)
+                except Exception as e:
+                    self._on_failure(name, job, e)
+                    result = None
+                if result is not None and outq is not None:
+                    await outq.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency[name])))
+        for _ in range(downstream_workers):
+            await outq.put(_DONE)
+
+    def _start_metrics(self):
+        """按配置开启 /metrics 接口或 node-exporter textfile，并登记采集时才计算的指标"""
+        metrics.inflight_limit.set(int(self.limiter.limit))
+        metrics.stage_queue_depth.set_function(
+            lambda: {(("stage", name),): queue.qsize() for name, queue in self.queues.items()})
+        metrics.volume_free_bytes.set_function(
+            lambda: {(("volume", volume),): shutil.disk_usage(volume).free for volume in self.storage.volumes})
+        if self.scheduler:
+            return  # 多个数据集同时运行时由调度器开启一次
+        if self.profile.get("metrics_port"):
+            metrics.start_http_server(self.profile["metrics_port"])
+        if self.profile.get("metrics_textfile"):
+            metrics.start_textfile_writer(self.profile["metrics_textfile"])
+
+    def _on_failure(self, stage, job, error):
+        """失败处理：按错误类别决定退避重试还是放弃，被限流时减少在途名额"""
+        item = job.get("item", job)
+        kind = classify_error(error)
+        if kind in (QUEUE_FULL, RATE_LIMITED):
+            self.limiter.on_throttled()
+            metrics.inflight_limit.set(int(self.limiter.limit))
+            print(f"🐢 CDS限流，在途申请名额降为 {int(self.limiter.limit)}")
+
+        item["attempts"] = item.get("attempts", 0) + 1
+        if kind in retryable and item["attempts"] < max_attempts and not self.stopping:
+            delay = backoff_delay(item["attempts"], kind)
+            # 下载或校验失败时CDS结果仍然有效，直接重新下载；记录失败（如台账被锁）时文件已校验，只重新记录；
+            # 其余（含缓存文件损坏）从提交重来
+            if stage in ("download", "verify") and job.get("url"):
+                target = "download"
+            elif stage == "record" and job.get("path") and os.path.exists(job["path"]):
+                target = "record"
+            else:
+                target = "submit"
+            if target == "submit":
+                self._forget(job)
+            metrics.requests_retried.inc(kind=kind)
+            print(f"🔁 {stage} 失败 {item['filename']} [{kind}]，{delay:.0f}秒后第{item['attempts']}次重试: {str(error)}")
+            task = asyncio.create_task(self._requeue(target, item if target == "submit" else job, delay))
+            self.retry_tasks.add(task)
+            task.add_done_callback(self.retry_tasks.discard)
+        else:
+            self._forget(job)
+            self.stats["failed"] += 1
+            metrics.requests_failed.inc(stage=stage, kind=kind)
+            print(f"❌ {stage} 失败 {item['filename']} [{kind}]: {str(error)}")
+            self._settle(item, "failed")
+
+    def _forget(self, job):
+        """不再需要接续的申请从台账中删除"""
+        if job.get("request_id"):
+            self.ledger.delete_job(job["request_id"])
+
+    async def _requeue(self, stage, job, delay):
+        """退避等待后重新放回队列，不阻塞其他任务"""
+        await asyncio.sleep(delay)
+        if self.stopping and stage == "submit":
+            self._settle(job, "pending")
+            return
+        if stage == "submit":
+            await self._enqueue(job)
+        else:
+            await self.queues[stage].put(job)
+
+    async def _enqueue(self, item):
+        """待提交的申请放入提交队列；共用账户时交给调度器，由它按优先级分配名额后再放入"""
+        if self.scheduler:
+            await self.scheduler.add(self, item)
+        else:
+            await self.queues["submit"].put(item)
+
+    async def _acquire_slot(self):
+        """等待一个在途申请名额（调度器派发申请时已经占好名额）"""
+        if self.scheduler:
+            return
+        async with self.slots:
+            await self.slots.wait_for(lambda: self.limiter.available)
+            self.limiter.acquire()
+
+    async def _release_slot(self):
+        async with self.slots:
+            self.limiter.release()
+            self.slots.notify_all()
+
+    # ---------- 各阶段 ----------
+
+    async def _submit(self, item):
+        """提交阶段：缓存中已有相同或更大的结果时直接取用，否则占用一个在途名额后非阻塞提交"""
+        if self.stopping or item.get("work_id") in self.lost:
+            if self.scheduler:
+                await self._release_slot()
+            self._settle(item, "pending")
+            return None
+        request = build_request(self.template, item)
+        if self.cache and not item.get("skip_cache"):
+            entry = await asyncio.to_thread(self.cache.lookup, self.dataset, request)
+            if entry:
+                if self.scheduler:
+                    await self._release_slot()
+                await self.queues["verify"].put(await asyncio.to_thread(self._from_cache, item, request, entry))
+                return None
+
+        await self._acquire_slot()
+        try:
+            result = await asyncio.to_thread(self.client.retrieve, self.dataset, request)
+        except Exception:
+            await self._release_slot()
+            raise
+        job = {"item": item, "request": request, "result": result, "submitted": time.time(),
+               "request_id": result.reply.get("request_id")}
+        if job["request_id"]:
+            await asyncio.to_thread(self.ledger.save_job, self.dataset, job["request_id"], item, request,
+                                    result.reply.get("state"), job["submitted"])
+            if item.get("work_id") in self.leases:
+                await asyncio.to_thread(self.ledger.update_work, item["work_id"], self.worker, job["request_id"])
+        self.stats["submitted"] += 1
+        metrics.requests_submitted.inc()
+        print(f"📨 已提交申请 {item['filename']}")
+        return job
+
+    def _from_cache(self, item, request, entry):
+        """把缓存文件放到选定的存储卷上，之后与正常下载一样校验、记录"""
+        volume = self.storage.place(entry["size"])
+        try:
+            path = unique_path(os.path.join(volume, download_filename(item, request)), self.claimed)
+            self.claimed.add(path)
+            self.cache.materialize(entry, path)
+        finally:
+            self.storage.release(volume, entry["size"])
+        self.stats["cached"] += 1
+        print(f"♻️ 缓存命中 {item['filename']}，不再向CDS申请")
+        return {
+            "item": item, "request": request, "path": path, "volume": volume, "cache_key": entry["key"],
+            "info": {"path": path, "size": entry["size"], "expected_size": entry["size"], "sha256": entry["sha256"]},
+        }
+
+    async def _poll_stage(self):
+        """轮询阶段：统一查询所有在途申请，完成的交给下载阶段"""
+        inq, outq = self.queues["poll"], self.queues["download"]
+        pending, upstream_done = [], False
+        while pending or not upstream_done:
+            # 收下新提交的申请
+            while True:
+                try:
+                    job = inq.get_nowait() if pending else await inq.get()
+                except asyncio.QueueEmpty:
+                    break
+                if job is _DONE:
+                    upstream_done = True
+                    break
+                pending.append(job)
+            if not pending:
+                continue
+
+            await asyncio.sleep(self.poll_interval)
+            states = await asyncio.gather(*(asyncio.to_thread(poll_state, job["result"]) for job in pending))
+            still_pending, pending_states = [], []
+            for job, state in zip(pending, states):
+                if state == "completed":
+                    self.limiter.on_success(time.time() - job["submitted"])
+                    metrics.queue_time.observe(time.time() - job["submitted"])
+                    metrics.inflight_limit.set(int(self.limiter.limit))
+                    await self._release_slot()
+                    job["url"] = job["result"].location
+                    if job.get("request_id"):
+                        await asyncio.to_thread(self.ledger.update_job, job["request_id"], "completed")
+                    print(f"已创建任务 {job['item']['filename']}")
+                    await outq.put(job)
+                elif state == "failed":
+                    await self._release_slot()
+                    error = job["result"].reply.get("error", {})
+                    self._on_failure("poll", job, CDSRequestError(error.get("message", state)))
+                else:
+                    still_pending.append(job)
+                    pending_states.append(state)
+            pending = still_pending
+            # 按仍在途的申请更新各状态的数量，全部完成后归零，不会一直停在最后一次轮询的数量
+            for state in ("accepted", "queued", "running"):
+                metrics.requests_state.set(pending_states.count(state), state=state)
+
+        for _ in range(self.concurrency["download"]):
+            await outq.put(_DONE)
+
+    async def _download(self, job):
+        """下载阶段：按 Content-Length 预留空间并选择存储卷后下载（内置分段下载器，或IDM兜底）"""
+        size = await asyncio.to_thread(self.storage.expected_size, job["url"])
+        # 重试时沿用上次的卷和路径，从 .part 断点续传
+        volume = self.storage.place(size, job.get("volume"))
+        if not job.get("path"):
+            job["volume"] = volume
+            # 多个工作进程写同一个卷时文件名带上工作进程名，避免同时选中同一个文件名
+            filename = download_filename(job["item"], job["request"], self.worker)
+            job["path"] = unique_path(os.path.join(volume, filename), self.claimed)
+            self.claimed.add(job["path"])
+            if job.get("request_id"):
+                await asyncio.to_thread(self.ledger.update_job, job["request_id"], path=job["path"], volume=volume)
+        path = job["path"]
+
+        start_time = time.time()
+        try:
+            if self.profile.get("use_idm"):
+                await asyncio.to_thread(idm_download, self.profile["idm_path"], job["url"], path)
+                if not await asyncio.to_thread(wait_for_stable_size, path):
+                    raise IOError("IDM下载超时")
+                job["info"] = {"path": path, "size": os.path.getsize(path), "expected_size": size, "sha256": None}
+            else:
+                job["info"] = await asyncio.to_thread(segmented_download, job["url"], path, None, None,
+                                                      metrics.progress_counter())
+        finally:
+            self.storage.release(volume, size)
+        metrics.download_seconds.observe(time.time() - start_time)
+        self.stats["downloaded"] += 1
+        info = job["info"]
+        print(f"📦 下载完成 {os.path.basename(path)} ({info['size'] / 1024 ** 2:.1f}MB)")
+        return job
+
+    async def _verify(self, job):
+        """校验阶段：在进程池中核对大小与CRC，失败删除文件"""
+        loop = asyncio.get_running_loop()
+        path = job["path"]
+        start_time = time.time()
+        ok, reason = await loop.run_in_executor(get_verify_pool(), check_download, path,
+                                                job["info"]["expected_size"])
+        metrics.verify_seconds.observe(time.time() - start_time)
+        if not ok:
+            if os.path.exists(path):
+                os.remove(path)
+            if job.get("cache_key"):
+                # 缓存文件损坏：删除缓存，重试时直接向CDS申请
+                await asyncio.to_thread(self.cache.discard, job["cache_key"])
+                job["item"]["skip_cache"] = True
+            raise IOError(f"校验失败: {reason}")
+        return job
+
+    async def _record(self, job):
+        """记录阶段：按文件实际包含的日期/小时/变量写入台账（CDS少给的小时下次只补这些），读不出内容时按申请参数记录"""
+        info = job["info"]
+        loop = asyncio.get_running_loop()
+        try:
+            contents = await loop.run_in_executor(get_verify_pool(), read_archive_contents, job["path"])
+        except Exception as e:
+            print(f"⚠️ 无法读取 {os.path.basename(job['path'])} 的内容，按申请参数记录: {str(e)}")
+            contents = None
+        start_time = time.time()
+        if contents and contents["times"]:
+            recorded = await asyncio.to_thread(record_contents, self.ledger, self.dataset, job["request"], job["path"],
+                                               info["size"], contents, job["volume"], info["sha256"])
+            if not recorded:
+                # 不计入台账、不放入缓存，按永久失败结束，避免每次运行都重新规划、下载同一个申请
+                raise PermanentError(f"{os.path.basename(job['path'])} 中的变量 {contents['variables']} 都不属于本次申请")
+        else:
+            await asyncio.to_thread(
+                self.ledger.record_archive, self.dataset, job["request"], job["path"], info["size"], info["sha256"],
+                volume=job["volume"],
+            )
+        metrics.ledger_write_seconds.observe(time.time() - start_time)
+        metrics.files_recorded.inc()
+        await self._index_grib(job)
+        if self.cache and not job.get("cache_key"):
+            await asyncio.to_thread(self.cache.store, self.dataset, job["request"], job["path"], info["size"],
+                                    info["sha256"])
+        self._forget(job)
+        self.stats["recorded"] += 1
+        self._settle(job["item"], "done")
+        print(f"✅ 验证完成并记录 {os.path.basename(job['path'])}")
+        return job if self.zarr_store else None
+
+    async def _index_grib(self, job):
+        """未打包的GRIB文件记录后立即建立消息索引，之后可按 (变量, 气压层, 时刻) 直接定位读取"""
+        loop = asyncio.get_running_loop()
+        try:
+            messages = await loop.run_in_executor(get_verify_pool(), index_file, job["path"])
+            if messages:
+                await asyncio.to_thread(self.ledger.save_grib_index, self.dataset, job["request"], job["path"],
+                                        messages)
+        except Exception as e:
+            print(f"⚠️ 建立GRIB索引失败 {os.path.basename(job['path'])}: {str(e)}（可稍后运行 grib_index.py 补建）")
+
+    async def _convert(self, job):
+        """转换阶段：在进程池中把压缩包写入 Zarr；失败只提示，之后可用 convert.py 补转"""
+        loop = asyncio.get_running_loop()
+        name = os.path.basename(job["path"])
+        try:
+            start = min(first for first, _ in self.profile["ranges"])  # 新建存储时时间轴从下载范围的起点开始
+            steps = await loop.run_in_executor(get_convert_pool(), convert_archive, job["path"], self.zarr_store, start)
+        except Exception as e:
+            print(f"⚠️ 转换失败 {name}: {str(e)}")
+            return None
+        await asyncio.to_thread(self.ledger.mark_converted, job["path"], self.zarr_store, steps)
+        self.stats["converted"] += 1
+        print(f"🧊 已写入 Zarr {name}（{steps} 个时刻）")
+        return None
+
+
+def poll_state(result):
+    """查询一个申请的状态，查询失败视为仍在排队"""
+    try:
+        result.update()
+        return result.reply.get("state")
+    except Exception as e:
+        print(f"状态查询失败: {str(e)}")
+        return "queued"
+
+
+def download_extension(request):
+    """按申请的下载格式决定扩展名：打包下载为 .zip，不打包（download_format 为 unarchived）时按 data_format 为 .grib 或 .nc"""
+    if request.get("download_format", "zip") != "unarchived" and request.get("format", "zip") == "zip":
+        return ".zip"
+    return ".nc" if (request.get("data_format") or request.get("format")) in ("netcdf", "netcdf4") else ".grib"
+
+
+def download_filename(item, request, worker=None):
+    """规划的文件名换成实际下载格式的扩展名，分布式模式下带上工作进程名"""
+    name = os.path.splitext(item["filename"])[0]
+    return name + (f"_{worker}" if worker else "") + download_extension(request)
+
+
+def unique_path(path, claimed=()):
+    """目标文件已存在（之前的补缺下载）、正在下载或已被本次运行占用时加序号，避免覆盖"""
+    base, ext = os.path.splitext(path)
+    candidate, n = path, 1
+    while os.path.exists(candidate) or os.path.exists(candidate + ".part") or candidate in claimed:
+        n += 1
+        candidate = f"{base}_{n}{ext}"
+    return candidate
+
+
+def default_profile(name, dataset, request_template, install_directory, **overrides):
+    """各下载脚本共用的 profile：台账、存储卷和旧版记录默认都在 install_directory，其余取下面的默认值，
+    脚本只需给出与数据集有关的项，其他配置（如 ranges、zarr_store、weight、deadlines）按关键字覆盖"""
+    profile = {
+        "name": name,
+        "dataset": dataset,
+        "request_template": request_template,
+        "install_directory": install_directory,
+        "ledger_file": os.path.join(install_directory, "download_ledger.sqlite"),
+        "storage_volumes": [install_directory],  # 可列出多个卷，如 ["M:\\era5", "F:\\data_from_era5", "G:\\data_from_era5"]
+        "placement": "most_free",  # most_free: 放到剩余空间最多的卷；round_robin: 轮流放置
+        "cache_directory": None,  # 各脚本共用的下载结果缓存目录（如 "M:\\cds_cache"），相同或更大的申请已下载过时直接取用
+        "metrics_port": None,  # 设为端口号（如 9108）后提供 http://localhost:端口/metrics 供 Prometheus 抓取
+        "metrics_textfile": None,  # 或定期写入 node-exporter textfile，如 "C:\\node_exporter\\textfile\\era5.prom"
+        "zarr_store": None,  # 设为路径后，下载完成的压缩包自动写入该 Zarr
+        "legacy_dates_file": os.path.join(install_directory, "downloaded_dates.txt"),  # 旧版记录，首次运行时导入台账
+        "idm_path": r"D:\Internet Download Manager\idman.exe",
+        "use_idm": False,  # True 时改用IDM下载（仅限Windows）
+    }
+    profile.update(overrides)
+    return profile
+
+
+def run_pipeline(profile, dry_run=False, worker=None):
+    """脚本入口：dry_run 只打印规划，否则运行流水线，Ctrl+C 优雅停止；worker 为分布式模式的工作进程名"""
+    pipeline = Pipeline(profile, worker=worker)
+    pipeline.open()
+    if dry_run:
+        saved = pipeline.ledger.load_jobs(pipeline.dataset, pipeline.template)
+        print_plan(pipeline.plan([job["item"] for job in saved]))
+        return
+
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        def on_signal(*_):
+            if pipeline.stopping:
+                raise KeyboardInterrupt
+            loop.call_soon_threadsafe(pipeline.request_stop)
+
+        signal.signal(signal.SIGINT, on_signal)
+        await pipeline.run()
+
+    try:
+        asyncio.run(main())
+    finally:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        pipeline.ledger.close()
+        if pipeline.cache:
+            pipeline.cache.close()
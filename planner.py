@@ -0,0 +1,194 @@
+import csv
+import math
+from collections import defaultdict
+from datetime import date
+
+# 规划配置
+max_fields_per_request = 12000  # 单个CDS申请的字段数上限（变量 × 日期 × 小时）
+field_bytes = 4 * 1024 ** 2  # 单个字段的估算大小，用于预估下载量
+merge_months = True  # 是否把相邻月份合并进同一个申请
+split_by_variable = True  # 超出上限时优先按变量拆分
+area_padding = 0.5  # 裁剪范围在站点外再扩出的度数，保证插值用到的相邻格点都在范围内
+native_resolution = 0.1  # ERA5-Land 原始分辨率，裁剪边界按此对齐
+
+
+def month_days(year, month):
+    """某月全部日期"""
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return (next_month - date(year, month, 1)).days
+
+
+def date_signatures(missing):
+    """把某天缺失的 (小时, 变量) 拆成若干个 小时 × 变量 的笛卡尔积"""
+    hours_by_var = defaultdict(set)
+    for hour, variable in missing:
+        hours_by_var[variable].add(hour)
+    vars_by_hours = defaultdict(list)
+    for variable, hours in hours_by_var.items():
+        vars_by_hours[tuple(sorted(hours))].append(variable)
+    return [(hours, tuple(sorted(variables))) for hours, variables in vars_by_hours.items()]
+
+
+def count_fields(item):
+    """申请包含的有效字段数"""
+    return len(item["dates"]) * len(item["hours"]) * len(item["variables"])
+
+
+def _make_item(year, months, days, hours, variables):
+    dates = [
+        date(year, m, d).isoformat()
+        for m in months for d in days if d <= month_days(year, m)
+    ]
+    return {
+        "year": year,
+        "months": list(months),
+        "days": list(days),
+        "hours": list(hours),
+        "variables": list(variables),
+        "dates": dates,
+    }
+
+
+def _split(item, limit):
+    """超出字段上限时按变量、日期、小时依次拆分"""
+    if count_fields(item) <= limit:
+        return [item]
+    year, months, days, hours, variables = (
+        item["year"], item["months"], item["days"], item["hours"], item["variables"]
+    )
+    if len(months) > 1:
+        return [piece for m in months for piece in _split(_make_item(year, [m], days, hours, variables), limit)]
+    if split_by_variable and len(variables) > 1:
+        return [piece for v in variables for piece in _split(_make_item(year, months, days, hours, [v]), limit)]
+    if len(days) > 1:
+        per_request = max(1, limit // (len(hours) * len(variables)))
+        return [
+            piece
+            for i in range(0, len(days), per_request)
+            for piece in _split(_make_item(year, months, days[i:i + per_request], hours, variables), limit)
+        ]
+    if len(variables) > 1:
+        return [piece for v in variables for piece in _split(_make_item(year, months, days, hours, [v]), limit)]
+    per_request = max(1, limit)
+    return [
+        _make_item(year, months, days, hours[i:i + per_request], variables)
+        for i in range(0, len(hours), per_request)
+    ]
+
+
+def plan_requests(missing, limit=None):
+    """把缺失的 {日期: {(小时, 变量)}} 合并为尽量少、且不超过字段上限的申请"""
+    limit = limit or max_fields_per_request
+
+    # 1. 同一个月内，缺失内容相同的日期合并为一个申请
+    groups = defaultdict(list)
+    for date_str, fields in missing.items():
+        year, month, day = (int(x) for x in date_str.split("-"))
+        for hours, variables in date_signatures(fields):
+            groups[(year, month, hours, variables)].append(day)
+
+    # 2. 缺失日期完全相同的相邻月份合并（整月缺失视为相同）
+    by_key = defaultdict(list)
+    for (year, month, hours, variables), days in groups.items():
+        days = sorted(days)
+        day_key = "full" if len(days) == month_days(year, month) else tuple(days)
+        by_key[(year, hours, variables, day_key)].append((month, days))
+
+    plan = []
+    for (year, hours, variables, day_key), months in sorted(by_key.items(), key=lambda kv: (kv[0][0], kv[1][0][0])):
+        months.sort()
+        run = []
+        for month, days in months:
+            candidate = run + [(month, days)]
+            all_days = sorted({d for _, ds in candidate for d in ds})
+            merged = _make_item(year, [m for m, _ in candidate], all_days, hours, variables)
+            contiguous = not run or month == run[-1][0] + 1
+            if run and not (merge_months and contiguous and count_fields(merged) <= limit):
+                plan.append(_make_item(year, [m for m, _ in run], sorted({d for _, ds in run for d in ds}),
+                                       hours, variables))
+                run = [(month, days)]
+            else:
+                run = candidate
+        if run:
+            plan.append(_make_item(year, [m for m, _ in run], sorted({d for _, ds in run for d in ds}),
+                                   hours, variables))
+
+    # 3. 超出上限的申请再拆分
+    plan = [piece for item in plan for piece in _split(item, limit)]
+    plan.sort(key=lambda item: (item["dates"][0], item["variables"]))
+    assign_filenames(plan)
+    return plan
+
+
+def assign_filenames(plan):
+    """按现有命名规则生成文件名：YYYY-MM_partial.zip，跨月时加 _to_MM，重名时加序号"""
+    used = defaultdict(int)
+    for item in plan:
+        name = f"{item['year']}-{item['months'][0]:02d}_partial"
+        if len(item["months"]) > 1:
+            name += f"_to_{item['months'][-1]:02d}"
+        used[name] += 1
+        item["filename"] = name + (f"_{used[name]}" if used[name] > 1 else "") + ".zip"
+
+
+def points_bbox(path):
+    """站点表（x_coordinate, y_coordinate）的经纬度范围 (西, 南, 东, 北)"""
+    xs, ys = [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            xs.append(float(row["x_coordinate"]))
+            ys.append(float(row["y_coordinate"]))
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def subset_area(bbox, padding=None, resolution=None):
+    """外扩并向外对齐到网格，返回CDS的 area [北, 西, 南, 东]"""
+    padding = area_padding if padding is None else padding
+    resolution = resolution or native_resolution
+    west, south, east, north = bbox
+    north = min(90, math.ceil((north + padding) / resolution) * resolution)
+    south = max(-90, math.floor((south - padding) / resolution) * resolution)
+    west = max(-180, math.floor((west - padding) / resolution) * resolution)
+    east = min(180, math.ceil((east + padding) / resolution) * resolution)
+    return [round(v, 6) for v in (north, west, south, east)]
+
+
+def apply_subset(template, points=None, bbox=None, grid=None, resolution=None):
+    """把由站点表或经纬度范围得到的 area（及可选的 grid）写入请求模板
+
+    area、grid 参与台账的请求指纹，裁剪后的数据与全球数据分开记录，不会互相当作已下载。
+    """
+    if not (points or bbox or grid):
+        return template
+    request = template.copy()
+    if points or bbox:
+        request["area"] = subset_area(bbox or points_bbox(points), resolution=resolution or (grid and grid[0]))
+    if grid:
+        request["grid"] = list(grid)
+    return request
+
+
+def build_request(template, item):
+    """用模板和规划条目生成CDS申请参数"""
+    request = template.copy()
+    request.update({
+        "variable": item["variables"],
+        "year": str(item["year"]),
+        "month": [f"{m:02d}" for m in item["months"]],
+        "day": [f"{d:02d}" for d in item["days"]],
+        "time": [f"{h:02d}:00" for h in item["hours"]],
+    })
+    return request
+
+
+def print_plan(plan):
+    """打印申请规划（dry-run）"""
+    total_fields = sum(count_fields(item) for item in plan)
+    print(f"共 {len(plan)} 个申请，{total_fields} 个字段，预计 {total_fields * field_bytes / 1024 ** 3:.1f}GB")
+    for item in plan:
+        months = ",".join(f"{m:02d}" for m in item["months"])
+        print(
+            f"  {item['filename']:<32} {item['year']}-[{months}] {len(item['dates']):>3}天 "
+            f"{len(item['hours']):>2}时 {len(item['variables'])}变量 = {count_fields(item):>6} 字段 "
+            f"≈{count_fields(item) * field_bytes / 1024 ** 2:.0f}MB"
+        )
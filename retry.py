@@ -0,0 +1,86 @@
+import random
+
+import requests
+
+# 重试配置
+max_attempts = 6  # 单个申请最多尝试次数
+base_delay = 30  # 首次重试等待（秒）
+max_delay = 30 * 60  # 最长等待（秒）
+
+# 错误分类
+QUEUE_FULL = "queue_full"  # 账户排队数已满
+RATE_LIMITED = "rate_limited"  # 请求过于频繁（429）
+TRANSIENT = "transient"  # 网络或服务器临时故障
+PERMANENT = "permanent"  # 请求本身有误，重试无意义
+
+retryable = (QUEUE_FULL, RATE_LIMITED, TRANSIENT)
+
+
+class PermanentError(Exception):
+    """已确定重试无意义的错误（如下载结果不含申请的内容）"""
+
+
+_queue_full_markers = ("too many requests queued", "queued requests", "number of queued", "maximum number of")
+# CDS 对请求本身有误时的原话；不用 "unknown"、"not available" 这类也会出现在临时故障信息中的泛词
+_permanent_markers = (
+    "request too large", "cost limits exceeded", "invalid request", "request is not valid",
+    "not a valid combination", "no data is available", "not available for this dataset",
+    "unknown variable", "unknown parameter", "licence", "license",
+)
+
+
+def classify_error(error):
+    """根据异常类型、HTTP状态码和错误信息判断错误类别"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    message = str(error).lower()
+
+    if isinstance(error, PermanentError):
+        return PERMANENT
+    if status == 429 or "rate limit" in message or ("too many requests" in message and "queued" not in message):
+        return RATE_LIMITED
+    if any(marker in message for marker in _queue_full_markers):
+        return QUEUE_FULL
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if status is not None and status >= 500:
+        return TRANSIENT
+    if any(marker in message for marker in _permanent_markers) or status in (400, 401, 403, 404):
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff_delay(attempt, kind=TRANSIENT):
+    """指数退避 + 全抖动；被限流时起点加倍"""
+    base = base_delay * (2 if kind in (QUEUE_FULL, RATE_LIMITED) else 1)
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+class AIMDLimiter:
+    """在途申请数自动调节：成功加性增加，被限流乘性减少（AIMD）"""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, slow_queue_time=2 * 3600):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_queue_time = slow_queue_time  # 排队超过该时长视为服务器已饱和
+        self.inflight = 0
+
+    @property
+    def available(self):
+        return self.inflight < int(self.limit)
+
+    def acquire(self):
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+
+    def on_success(self, queue_time):
+        """申请完成：排队时间正常则名额 +1/limit（约每轮 +1），排队过长则不再增加"""
+        if queue_time < self.slow_queue_time:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttled(self):
+        """被拒绝或限流：名额减半"""
+        self.limit = max(self.minimum, self.limit / 2)
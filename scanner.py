@@ -0,0 +1,164 @@
+import os
+import re
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from grib_index import iter_grib_messages
+from ledger import as_list
+
+# 按天下载的文件名，如 1990-01-01.zip
+daily_pattern = re.compile(r"^(\d{4}-\d{2}-\d{2})\.zip$")
+# 按月补缺的文件名，如 1990-01_partial.zip（含IDM重名产生的 1990-01_partial_2.zip 等；不打包下载时为 .grib/.nc）
+partial_pattern = re.compile(r"^(\d{4})-(\d{2})_partial.*\.(zip|grib|nc)$")
+# 合并后的整月文件，如 1990-01.zip
+monthly_pattern = re.compile(r"^(\d{4})-(\d{2})\.zip$")
+
+# NetCDF 变量短名 -> CDS 请求变量名
+short_names = {
+    "u10": "10m_u_component_of_wind",
+    "v10": "10m_v_component_of_wind",
+    "sp": "surface_pressure",
+    "u": "u_component_of_wind",
+    "v": "v_component_of_wind",
+    "w": "vertical_velocity",
+}
+
+units_pattern = re.compile(
+    r"(seconds|minutes|hours|days) since (\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?"
+)
+
+
+def parse_cf_times(values, units):
+    """把 CF 约定的时间数值（如 hours since 1900-01-01）转换为 datetime"""
+    match = units_pattern.match(units)
+    if not match:
+        raise ValueError(f"无法识别的时间单位: {units}")
+    unit, *parts = match.groups()
+    origin = datetime(*(int(p or 0) for p in parts))
+    return [origin + timedelta(**{unit: float(v)}) for v in values]
+
+
+def read_hdf5_times(fileobj):
+    """读取 NetCDF4(HDF5) 文件的时间轴与变量名"""
+    import h5py
+
+    with h5py.File(fileobj, "r") as f:
+        name = "valid_time" if "valid_time" in f else "time"
+        units = f[name].attrs["units"]
+        units = units.decode() if isinstance(units, bytes) else str(units)
+        times = parse_cf_times(f[name][:], units)
+        variables = [key for key in f.keys() if key in short_names]
+    return times, variables
+
+
+def read_netcdf3_times(fileobj):
+    """读取 NetCDF3 经典格式文件的时间轴与变量名"""
+    from scipy.io import netcdf_file
+
+    with netcdf_file(fileobj, "r", mmap=False) as f:
+        name = "valid_time" if "valid_time" in f.variables else "time"
+        var = f.variables[name]
+        units = var.units.decode() if isinstance(var.units, bytes) else str(var.units)
+        times = parse_cf_times(var[:], units)
+        variables = [key for key in f.variables if key in short_names]
+    return times, variables
+
+
+def read_member_times(fileobj):
+    """根据文件头识别格式并读取时间轴，变量未知时返回 None"""
+    magic = fileobj.read(8)
+    fileobj.seek(0)
+    if magic.startswith(b"\x89HDF"):
+        return read_hdf5_times(fileobj)
+    if magic.startswith(b"CDF"):
+        return read_netcdf3_times(fileobj)
+    if magic.startswith(b"GRIB"):
+        messages = list(iter_grib_messages(fileobj))
+        variables = {m["variable"] for m in messages if m["variable"] in short_names}
+        return sorted({m["valid_time"] for m in messages}), sorted(variables) or None
+    raise ValueError("无法识别的文件格式")
+
+
+def read_archive_contents(path):
+    """打开压缩包（或未打包的GRIB/NetCDF），返回实际包含的 {'variables': [...], 'times': {日期: [小时]}}"""
+    times, variables = [], set()
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            for name in zf.namelist():
+                with zf.open(name) as member:
+                    member_times, member_vars = read_member_times(member)
+                times.extend(member_times)
+                variables.update(member_vars or [])
+    else:
+        with open(path, "rb") as f:
+            times, member_vars = read_member_times(f)
+        variables.update(member_vars or [])
+
+    by_date = defaultdict(set)
+    for t in times:
+        by_date[t.strftime("%Y-%m-%d")].add(t.hour)
+    return {
+        "variables": sorted(short_names[v] for v in variables) or None,
+        "times": {d: sorted(hours) for d, hours in sorted(by_date.items())},
+    }
+
+
+def inspect_file(entry):
+    """识别单个文件覆盖的日期/变量：按天文件、按月补缺文件和合并后的整月文件都读取数据本身的时间轴和变量
+    （共享卷上可能有其他数据集的同名文件，只看文件名会把它们记到本数据集名下）"""
+    match = daily_pattern.match(entry.name)
+    if match:
+        try:
+            datetime.strptime(match.group(1), "%Y-%m-%d")
+        except ValueError:
+            return None
+        return read_archive_contents(entry.path)
+    if partial_pattern.match(entry.name) or monthly_pattern.match(entry.name):
+        return read_archive_contents(entry.path)
+    return None
+
+
+def record_contents(ledger, dataset, request, path, size, contents, volume=None, sha256=None):
+    """把文件实际包含的日期/小时/变量写入台账；识别出的变量都不属于该请求时（如共享卷上其他数据集的文件）不记录，返回 False"""
+    if contents["variables"]:
+        variables = [v for v in contents["variables"] if v in as_list(request["variable"])]
+        if not variables:
+            return False
+        request = dict(request, variable=variables)
+    hours_to_dates = defaultdict(list)
+    for date_str, hours in contents["times"].items():
+        hours_to_dates[tuple(hours)].append(date_str)
+    for hours, dates in hours_to_dates.items():
+        ledger.record_archive(dataset, request, path, size, sha256, dates=dates, hours=list(hours), volume=volume)
+    return True
+
+
+def scan_directory(directory, ledger, dataset, request):
+    """增量扫描下载目录：只检查新增或大小/修改时间变化的文件，结果缓存在台账中"""
+    cached = ledger.scan_cache(dataset, request, directory)
+    inspected = 0
+    seen = set()
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith((".zip", ".grib", ".nc")) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            seen.add(entry.name)
+            if cached.get(entry.name) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            try:
+                contents = inspect_file(entry)
+            except Exception as e:
+                print(f"⚠️ 无法读取 {entry.name}: {str(e)}")
+                continue
+            if contents and contents["times"]:
+                record_contents(ledger, dataset, request, entry.path, stat.st_size, contents, volume=directory)
+            ledger.save_scan(dataset, request, directory, entry.name, stat.st_size, stat.st_mtime_ns)
+            inspected += 1
+
+    ledger.prune_scan(dataset, request, directory, set(cached) - seen)
+    if inspected:
+        print(f"扫描完成：检查了 {inspected} 个新增或变化的文件")
@@ -0,0 +1,191 @@
+import heapq
+import signal
+import asyncio
+import argparse
+import itertools
+import importlib
+from datetime import date, datetime
+
+import metrics
+from pipeline import Pipeline, max_inflight_requests
+from retry import AIMDLimiter
+from verify import shutdown_verify_pool
+from convert import shutdown_convert_pool
+
+# 调度默认配置（可在各脚本的 profile 中覆盖 weight / recent_first / deadlines）
+default_weight = 1  # 在途申请名额按权重分配，权重 2 的数据集分到的名额约为权重 1 的两倍
+recent_first = False  # True 时先申请最近的月份，再向前回填
+
+
+def parse_deadline(value):
+    """截止时间：date/datetime 或 ISO 格式字符串"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
+
+
+def item_deadline(profile, item):
+    """申请包含的日期落在 profile["deadlines"] 的某个范围内时返回最早的截止时间，否则返回 None"""
+    first, last = item["dates"][0], item["dates"][-1]
+    deadlines = [parse_deadline(deadline) for start, end, deadline in profile.get("deadlines", [])
+                 if start <= last and first <= end]
+    return min(deadlines) if deadlines else None
+
+
+def item_order(profile, item):
+    """同一数据集内的先后：默认按日期从早到晚，recent_first 时从晚到早"""
+    if profile.get("recent_first", recent_first):
+        return -date.fromisoformat(item["dates"][-1]).toordinal()
+    return date.fromisoformat(item["dates"][0]).toordinal()
+
+
+class Scheduler:
+    """多个数据集共用一个CDS账户：待提交的申请都放在这里，有空闲在途名额时按优先级分给各数据集
+
+    有截止时间的申请最先（截止早的优先）；其余按权重公平分配——每提交一个申请，该数据集的
+    已用份额增加 1/权重，总是把名额分给已用份额最少的数据集。只要还有申请就不会让名额空着。
+    """
+
+    def __init__(self, max_inflight=None):
+        maximum = max_inflight or max_inflight_requests
+        self.limiter = AIMDLimiter(initial=min(4, maximum), maximum=maximum)
+        self.slots = None
+        self.urgent = []  # (截止时间, 序号, pipeline, 申请)
+        self.queues = {}  # pipeline -> [(先后, 序号, 申请)]
+        self.served = {}  # pipeline -> 已用份额
+        self.counter = itertools.count()
+        self.closed = False
+
+    def _condition(self):
+        """名额条件变量要在事件循环中创建"""
+        if self.slots is None:
+            self.slots = asyncio.Condition()
+        return self.slots
+
+    def attach(self, pipeline):
+        """流水线启动时共用本调度器的在途名额"""
+        self._condition()
+        self.queues.setdefault(pipeline, [])
+        self.served.setdefault(pipeline, 0.0)
+        return self.limiter, self.slots
+
+    def pending(self):
+        return bool(self.urgent) or any(self.queues.values())
+
+    async def add(self, pipeline, item):
+        """放入一个待提交的申请（新规划的或退避后重试的）"""
+        deadline = item_deadline(pipeline.profile, item)
+        async with self.slots:
+            if deadline is not None:
+                heapq.heappush(self.urgent, (deadline, next(self.counter), pipeline, item))
+            else:
+                queue = self.queues[pipeline]
+                if not queue:
+                    # 一段时间没有申请的数据集重新加入时，不能凭积攒的份额独占名额
+                    active = [self.served[p] for p, q in self.queues.items() if q]
+                    if active:
+                        self.served[pipeline] = max(self.served[pipeline], min(active))
+                heapq.heappush(queue, (item_order(pipeline.profile, item), next(self.counter), item))
+            self.slots.notify_all()
+
+    def cancel(self, pipeline):
+        """流水线停止时取出它尚未提交的申请，返回个数"""
+        count = len(self.queues.get(pipeline, []))
+        self.queues[pipeline] = []
+        urgent = [entry for entry in self.urgent if entry[2] is not pipeline]
+        count += len(self.urgent) - len(urgent)
+        heapq.heapify(urgent)
+        self.urgent = urgent
+        return count
+
+    def _pop(self):
+        if self.urgent:
+            _, _, pipeline, item = heapq.heappop(self.urgent)
+        else:
+            pipeline = min((p for p, q in self.queues.items() if q), key=lambda p: self.served[p])
+            _, _, item = heapq.heappop(self.queues[pipeline])
+        self.served[pipeline] += 1 / pipeline.profile.get("weight", default_weight)
+        return pipeline, item
+
+    async def dispatch(self):
+        """有空闲名额就取出优先级最高的申请，占用名额后交给所属流水线的提交阶段"""
+        self._condition()
+        while True:
+            async with self.slots:
+                await self.slots.wait_for(lambda: self.closed or (self.limiter.available and self.pending()))
+                if self.closed:
+                    return
+                pipeline, item = self._pop()
+                self.limiter.acquire()
+            await pipeline.queues["submit"].put(item)
+
+    async def close(self):
+        async with self.slots:
+            self.closed = True
+            self.slots.notify_all()
+
+
+def run_scheduled(profiles, max_inflight=None):
+    """在一个进程中同时运行多个数据集的流水线，共用CDS账户的在途名额，Ctrl+C 优雅停止"""
+    scheduler = Scheduler(max_inflight)
+    pipelines = [Pipeline(profile, scheduler) for profile in profiles]
+    for pipeline in pipelines:
+        pipeline.open()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        def on_signal(*_):
+            if any(p.stopping for p in pipelines):
+                raise KeyboardInterrupt
+            for p in pipelines:
+                loop.call_soon_threadsafe(p.request_stop)
+
+        signal.signal(signal.SIGINT, on_signal)
+        for profile in profiles:
+            if profile.get("metrics_port"):
+                metrics.start_http_server(profile["metrics_port"])
+                break
+        for profile in profiles:
+            if profile.get("metrics_textfile"):
+                metrics.start_textfile_writer(profile["metrics_textfile"])
+                break
+
+        dispatcher = asyncio.create_task(scheduler.dispatch())
+        try:
+            await asyncio.gather(*(p.run() for p in pipelines))
+        finally:
+            await scheduler.close()
+            await dispatcher
+        await asyncio.to_thread(shutdown_verify_pool)
+        await asyncio.to_thread(shutdown_convert_pool)
+
+    try:
+        asyncio.run(main())
+    finally:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for pipeline in pipelines:
+            pipeline.ledger.close()
+            if pipeline.cache:
+                pipeline.cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同时运行多个下载脚本，按权重、截止时间公平分配CDS在途申请名额")
+    parser.add_argument("scripts", nargs="+", help="下载脚本模块名，如 era5 era5_daqi")
+    parser.add_argument("--max-inflight", type=int, help="账户总的在途申请数上限，默认取各脚本中最大的")
+    parser.add_argument("--recent-first", action="store_true", help="所有数据集都先申请最近的月份")
+    args = parser.parse_args()
+
+    profiles = [dict(importlib.import_module(name).profile) for name in args.scripts]
+    if args.recent_first:
+        for profile in profiles:
+            profile["recent_first"] = True
+    max_inflight = args.max_inflight or max(p.get("max_inflight_requests", max_inflight_requests) for p in profiles)
+    run_scheduled(profiles, max_inflight)
+
+
+if __name__ == "__main__":
+    main()
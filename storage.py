@@ -0,0 +1,65 @@
+import os
+import shutil
+import threading
+
+from downloader import get_session, probe_url
+
+# 存储配置
+min_free_space = 10 * 1024 ** 3  # 每个卷至少保留10GB
+placement = "most_free"  # most_free: 放到剩余空间最多的卷；round_robin: 轮流放置，分散磁盘I/O
+unknown_size = 2 * 1024 ** 3  # 拿不到 Content-Length 时按2GB预留
+
+
+class StorageFull(IOError):
+    """所有卷都没有足够空间"""
+
+
+class Storage:
+    """多卷存储：下载前按预估大小预留空间，按剩余空间或轮流选择目标卷"""
+
+    def __init__(self, volumes, strategy=None, reserve=None):
+        self.volumes = [os.path.abspath(v) for v in volumes]
+        self.strategy = strategy or placement
+        self.reserve = min_free_space if reserve is None else reserve
+        self.reserved = {v: 0 for v in self.volumes}
+        self.lock = threading.Lock()
+        self.next_index = 0
+        for volume in self.volumes:
+            os.makedirs(volume, exist_ok=True)
+
+    def headroom(self, volume):
+        """可用空间 = 磁盘剩余 - 已预留 - 保底空间"""
+        return shutil.disk_usage(volume).free - self.reserved[volume] - self.reserve
+
+    def place(self, size, volume=None):
+        """为 size 字节的文件选择卷并预留空间，返回卷路径；指定 volume 时（断点续传）只在该卷上预留"""
+        size = size or unknown_size
+        with self.lock:
+            if volume:
+                self.reserved[volume] += size
+                return volume
+            candidates = [v for v in self.volumes if self.headroom(v) >= size]
+            if not candidates:
+                free = ", ".join(f"{v} {self.headroom(v) / 1024 ** 3:.1f}GB" for v in self.volumes)
+                raise StorageFull(f"磁盘空间不足，需要 {size / 1024 ** 3:.1f}GB（可用: {free}）")
+            if self.strategy == "round_robin":
+                ordered = self.volumes[self.next_index:] + self.volumes[:self.next_index]
+                volume = next(v for v in ordered if v in candidates)
+                self.next_index = (self.volumes.index(volume) + 1) % len(self.volumes)
+            else:
+                volume = max(candidates, key=self.headroom)
+            self.reserved[volume] += size
+        return volume
+
+    def release(self, volume, size):
+        """下载结束（成功或失败）后释放预留"""
+        with self.lock:
+            self.reserved[volume] = max(0, self.reserved[volume] - (size or unknown_size))
+
+    def expected_size(self, url, session=None):
+        """HEAD 请求获取 Content-Length，失败时返回 None"""
+        try:
+            return probe_url(session or get_session(), url)["size"]
+        except Exception as e:
+            print(f"无法获取文件大小: {str(e)}")
+            return None
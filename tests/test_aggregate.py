@@ -0,0 +1,78 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+h5py = pytest.importorskip("h5py")
+
+import aggregate  # noqa: E402
+
+
+def write_month(path, hours):
+    rng = np.random.default_rng(len(path))
+    with h5py.File(path, "w") as f:
+        f["valid_time"] = np.arange(hours) * 3600 + int((datetime(2000, 1, 1) - datetime(1970, 1, 1)).total_seconds())
+        f["valid_time"].attrs["units"] = "seconds since 1970-01-01"
+        f["latitude"] = np.linspace(50, 40, 7)
+        f["longitude"] = np.linspace(100, 104, 5)
+        for name in ("u10", "v10", "sp"):
+            mean, spread = (100000, 500) if name == "sp" else (5, 3)
+            f.create_dataset(name, data=rng.normal(mean, spread, (hours, 7, 5)).astype("f4"), chunks=(24, 3, 5))
+
+
+class FakeLedger:
+    def __init__(self, paths):
+        self.paths = paths
+
+    def files_between(self, dataset, request, start, end):
+        return self.paths.get(start, [])
+
+
+def read_all(directory):
+    result = {}
+    for name in ("climatology.h5", os.path.join("daily", "2000-01.h5")):
+        with h5py.File(os.path.join(directory, name), "r") as f:
+            result.update({(name, key): f[key][()] for key in f})
+    return result
+
+
+def test_row_tiles_match_whole_grid(tmp_path, monkeypatch):
+    """按行块分片（指定行数或按内存自动选择）的结果与整块网格一次处理相同"""
+    write_month(str(tmp_path / "a.nc"), 31 * 24)
+    ledger = FakeLedger({"2000-01-01": [str(tmp_path / "a.nc")]})
+    monkeypatch.setattr(aggregate, "workers", 1)
+
+    outputs = []
+    for name, rows, memory, cells in (("whole", None, 1 << 30, 8192), ("rows", 3, 1 << 30, 8192),
+                                      ("memory", None, 2 * aggregate.row_bytes(5), 4)):
+        monkeypatch.setattr(aggregate, "tile_rows", rows)
+        monkeypatch.setattr(aggregate, "worker_memory", memory)
+        monkeypatch.setattr(aggregate, "histogram_cells", cells)
+        aggregate.run(ledger, "ds", {}, 2000, 2000, str(tmp_path / name))
+        outputs.append(read_all(str(tmp_path / name)))
+
+    whole = outputs[0]
+    for tiled in outputs[1:]:
+        assert whole.keys() == tiled.keys()
+        for key, value in whole.items():
+            assert value.shape == tiled[key].shape
+            if value.dtype.kind == "f":
+                assert np.allclose(value, tiled[key], equal_nan=True, rtol=1e-5), key
+            else:
+                assert (value == tiled[key]).all(), key
+
+
+def test_tile_rows_follow_memory_budget(monkeypatch):
+    """默认取内存放得下的最大行块，整个网格放得下时只分一块（每个文件只读一遍）"""
+    monkeypatch.setattr(aggregate, "tile_rows", None)
+    monkeypatch.setattr(aggregate, "worker_memory", 100 * aggregate.row_bytes(3600))
+    assert aggregate.choose_tile_rows(1801, 3600) == 100
+    assert aggregate.choose_tile_rows(60, 3600) == 60
+    monkeypatch.setattr(aggregate, "worker_memory", 0)
+    assert aggregate.choose_tile_rows(1801, 3600) == 1
+    monkeypatch.setattr(aggregate, "tile_rows", 64)
+    assert aggregate.choose_tile_rows(1801, 3600) == 64
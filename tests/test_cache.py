@@ -0,0 +1,107 @@
+import os
+import sys
+import asyncio
+import itertools
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+from cache import ResultCache, request_key  # noqa: E402
+
+base = {"format": "zip", "variable": ["10m_u_component_of_wind", "10m_v_component_of_wind"],
+        "year": "2000", "month": "01", "day": ["01", "02", "03"], "time": ["00:00", "12:00"]}
+
+
+def write(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+@pytest.fixture
+def result_cache(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache.time, "time", lambda: next(clock))
+    result_cache = ResultCache(str(tmp_path / "cache"))
+    yield result_cache
+    result_cache.close()
+
+
+def test_key_ignores_value_order_except_area():
+    assert request_key("ds", base) == request_key("ds", dict(base, day=["03", "01", "02"]))
+    assert request_key("ds", base) != request_key("other", base)
+    north_first, south_first = dict(base, area=[50, 100, 40, 110]), dict(base, area=[40, 100, 50, 110])
+    assert request_key("ds", north_first) != request_key("ds", south_first)
+
+
+def test_lookup_serves_equal_or_superset_request(tmp_path, result_cache):
+    path = write(tmp_path / "a.zip", 100)
+    key = result_cache.store("ds", base, path, sha256="abc")
+
+    assert result_cache.lookup("ds", base)["key"] == key
+    subset = dict(base, variable=["10m_u_component_of_wind"], day=["02"], time=["12:00"])
+    entry = result_cache.lookup("ds", subset)
+    assert entry == {"key": key, "path": entry["path"], "size": 100, "sha256": "abc"}
+    assert os.path.samefile(entry["path"], path)  # 同卷时以硬链接保存
+
+    assert result_cache.lookup("ds", dict(base, day=["04"])) is None
+    assert result_cache.lookup("ds", dict(base, variable=["surface_pressure"])) is None
+    assert result_cache.lookup("ds", dict(base, area=[50, 100, 40, 110])) is None
+    assert result_cache.lookup("other", base) is None
+
+    target = str(tmp_path / "copy.zip")
+    result_cache.materialize(entry, target)
+    assert os.path.samefile(target, path)
+
+
+def test_missing_or_changed_file_is_discarded(tmp_path, result_cache):
+    result_cache.store("ds", base, write(tmp_path / "a.zip", 100))
+    write(tmp_path / "cache" / (request_key("ds", base) + ".zip"), 50)  # 硬链接指向同一文件，大小随之改变
+    assert result_cache.lookup("ds", base) is None
+    assert not os.path.exists(tmp_path / "cache" / (request_key("ds", base) + ".zip"))
+
+    result_cache.store("ds", base, write(tmp_path / "b.zip", 100))
+    os.remove(tmp_path / "cache" / (request_key("ds", base) + ".zip"))
+    assert result_cache.lookup("ds", base) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, result_cache):
+    result_cache.max_size = 250
+    requests = [dict(base, day=[f"{d:02d}"]) for d in (1, 2, 3)]
+    result_cache.store("ds", requests[0], write(tmp_path / "1.zip", 100))
+    result_cache.store("ds", requests[1], write(tmp_path / "2.zip", 100))
+    assert result_cache.lookup("ds", requests[0])  # 最近用过，不被淘汰
+    result_cache.store("ds", requests[2], write(tmp_path / "3.zip", 100))
+
+    assert result_cache.lookup("ds", requests[1]) is None
+    assert result_cache.lookup("ds", requests[0]) and result_cache.lookup("ds", requests[2])
+    assert os.path.exists(tmp_path / "2.zip")  # 只删除缓存目录中的链接
+
+
+def test_pipeline_serves_repeated_request_from_cache(tmp_path, monkeypatch):
+    """另一个下载目录再次需要同样的数据时直接取用缓存，不向CDS申请"""
+    import mockcds
+    import pipeline
+
+    monkeypatch.setattr(mockcds, "queue_latency", (0, 0))
+    server, url = mockcds.start_server()
+    monkeypatch.setenv("CDSAPI_URL", url)
+    monkeypatch.setenv("CDSAPI_KEY", "1:mock")
+    request = {"format": "zip", "variable": ["10m_u_component_of_wind"], "time": ["00:00", "12:00"]}
+    try:
+        for name in ("first", "second"):
+            p = pipeline.Pipeline({"dataset": "ds", "request_template": request, "install_directory": str(tmp_path / name),
+                                   "cache_directory": str(tmp_path / "cache"), "ranges": [("2000-01-01", "2000-01-03")],
+                                   "poll_interval": 0.1})
+            p.open()
+            try:
+                asyncio.run(p.run())
+                assert p.ledger.missing_dates("ds", request, "2000-01-01", "2000-01-03") == []
+            finally:
+                p.ledger.close()
+                p.cache.close()
+        assert p.stats["cached"] == 1 and p.stats["submitted"] == 0
+        assert server.cds.stats["submitted"] == 1
+    finally:
+        server.shutdown()
@@ -0,0 +1,79 @@
+import os
+import sys
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+h5py = pytest.importorskip("h5py")
+
+import compact  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from scanner import read_archive_contents, record_contents  # noqa: E402
+
+request = {
+    "variable": ["10m_u_component_of_wind", "10m_v_component_of_wind"],
+    "year": "2000", "month": "01", "day": ["01"], "time": [f"{h:02d}:00" for h in range(24)],
+}
+
+
+def write_fragment(directory, name, start, hours, variables, mtime):
+    """写一个只含部分变量/时刻的补缺压缩包"""
+    nc_path = os.path.join(directory, name + ".nc")
+    times = [start + timedelta(hours=h) for h in range(hours)]
+    with h5py.File(nc_path, "w") as f:
+        f["valid_time"] = np.array([(t - datetime(1970, 1, 1)).total_seconds() for t in times], dtype="i8")
+        f["valid_time"].attrs["units"] = "seconds since 1970-01-01"
+        f["latitude"] = np.linspace(50, 40, 3)
+        f["longitude"] = np.linspace(100, 104, 5)
+        for variable in variables:
+            f.create_dataset(variable, data=np.full((hours, 3, 5), len(variable), dtype="f4"))
+    path = os.path.join(directory, name)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        zf.write(nc_path, "data_0.nc")
+    os.remove(nc_path)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite"))
+    yield ledger
+    ledger.close()
+
+
+def record(ledger, path):
+    record_contents(ledger, "ds", request, path, os.path.getsize(path), read_archive_contents(path))
+
+
+def test_variable_split_fragments_merge_once(tmp_path, ledger):
+    month = datetime(2000, 1, 1)
+    for i, variable in enumerate(("u10", "v10")):
+        record(ledger, write_fragment(str(tmp_path), f"2000-01_partial_{i}.zip", month, 31 * 24, [variable], i))
+
+    assert compact.compact_range(ledger, "ds", request, 2000, 2000) == 1
+    assert sorted(n for n in os.listdir(tmp_path) if n.endswith(".zip")) == ["2000-01.zip"]
+    assert read_archive_contents(str(tmp_path / "2000-01.zip"))["variables"] == request["variable"]
+    assert ledger.missing_fields("ds", request, "2000-01-01", "2000-01-31") == {}
+
+    mtime = os.path.getmtime(tmp_path / "2000-01.zip")
+    assert compact.compact_range(ledger, "ds", request, 2000, 2000) == 0
+    assert os.path.getmtime(tmp_path / "2000-01.zip") == mtime
+
+
+def test_incomplete_month_is_left_alone(tmp_path, ledger):
+    month = datetime(2000, 1, 1)
+    record(ledger, write_fragment(str(tmp_path), "2000-01_partial.zip", month, 31 * 24, ["u10", "v10"], 0))
+    record(ledger, write_fragment(str(tmp_path), "2000-01_partial_2.zip", month, 10 * 24, ["u10"], 1))
+    # 第二个文件只补了 u10 的前 10 天，与第一个文件合起来仍是完整的
+    assert compact.compact_range(ledger, "ds", request, 2000, 2000) == 1
+
+    record(ledger, write_fragment(str(tmp_path), "2000-01_partial_3.zip", month + timedelta(days=40), 24, ["v10"], 2))
+    record(ledger, write_fragment(str(tmp_path), "2000-02_partial.zip", month + timedelta(days=31), 24, ["u10"], 3))
+    # 2月只有 u10 的一天和 v10 的另一天：各变量覆盖的时刻不同，不合并
+    assert compact.compact_range(ledger, "ds", request, 2000, 2000) == 0
+    assert not os.path.exists(tmp_path / "2000-02.zip")
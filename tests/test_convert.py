@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("zarr")
+
+import convert  # noqa: E402
+
+lat, lon = np.linspace(50, 40, 3), np.linspace(100, 104, 5)
+
+
+def archive(first, hours, names):
+    """一个包含部分变量、部分时刻的下载文件（值为时刻序号，u10 为正、v10 为负）"""
+    times = np.datetime64(first, "ns") + np.arange(hours) * np.timedelta64(1, "h")
+    offset = (times - np.datetime64("2000-01-01", "ns")) // np.timedelta64(1, "h")
+    data = np.broadcast_to(offset[:, None, None], (hours, 3, 5)).astype("f4")
+    return xr.Dataset(
+        {name: (("valid_time", "latitude", "longitude"), data * (1 if name == "u10" else -1)) for name in names},
+        coords={"valid_time": times, "latitude": lat, "longitude": lon,
+                "expver": ("valid_time", np.full(hours, "0001"))},
+    )
+
+
+def test_split_and_out_of_order_archives(tmp_path, monkeypatch):
+    archives = {
+        "feb_u": archive("2000-02-01", 48, ["u10"]),
+        "jan_uv": archive("2000-01-01", 24 * 31, ["u10", "v10"]),
+        "feb_v": archive("2000-02-01", 48, ["v10"]),
+        "gap": archive("2000-01-20", 5, ["u10", "v10"]),
+    }
+    monkeypatch.setattr(convert, "open_archive", lambda path, workdir: (archives[path], []))
+    store = str(tmp_path / "store.zarr")
+    for name in archives:
+        assert convert.convert_archive(name, store, "2000-01-01") == archives[name].sizes["valid_time"]
+
+    with xr.open_zarr(store, consolidated=False) as ds:
+        times = ds["valid_time"].values
+        assert len(times) == 24 * 33
+        assert (np.diff(times) == np.timedelta64(1, "h")).all()
+        expected = np.arange(len(times), dtype="f4")
+        assert (ds["u10"].values[:, 1, 2] == expected).all()
+        assert (ds["v10"].values[:, 1, 2] == -expected).all()
+
+
+def test_archive_before_store_start_is_rejected(tmp_path, monkeypatch):
+    archives = {"jan": archive("2000-01-01", 24, ["u10"])}
+    monkeypatch.setattr(convert, "open_archive", lambda path, workdir: (archives[path], []))
+    with pytest.raises(ValueError):
+        convert.convert_archive("jan", str(tmp_path / "store.zarr"), "2000-01-02")
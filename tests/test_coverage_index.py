@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coverage_index import CoverageBitmap, day_index  # noqa: E402
+from ledger import Ledger, date_range  # noqa: E402
+
+hours = list(range(24))
+
+
+def test_missing_hours_and_variables():
+    bitmap = CoverageBitmap()
+    bitmap.add(["2000-01-01", "2000-01-02"], hours, ["u10", "v10"])
+    bitmap.add(["2000-01-03"], range(12), ["u10", "v10"])
+    bitmap.add(["2000-01-03"], range(12, 24), ["u10"])
+
+    assert bitmap.complete("2000-01-01", "2000-01-04", hours, ["u10", "v10"]) == {"2000-01-01", "2000-01-02"}
+    missing = bitmap.missing("2000-01-01", "2000-01-04", hours, ["u10", "v10"])
+    assert list(missing) == ["2000-01-03", "2000-01-04"]
+    assert missing["2000-01-03"] == {(h, "v10") for h in range(12, 24)}
+    assert len(missing["2000-01-04"]) == 48
+    # 只申请部分小时的模板不把其他小时算作缺失
+    assert bitmap.missing("2000-01-03", "2000-01-03", [0, 6], ["u10", "v10"]) == {}
+    assert bitmap.last_date() == "2000-01-03"
+
+
+def test_blob_round_trip_and_size():
+    bitmap = CoverageBitmap()
+    dates = list(date_range("1990-01-01", "2019-12-31"))
+    bitmap.add(dates, hours, ["u10", "v10", "sp"])
+    blobs = bitmap.to_blobs()
+    assert sum(len(blob) for blob in blobs.values()) < 10 * 1024  # 整天已下载的位压缩后很小
+    assert all(bits.nbytes < 128 * 1024 for bits in bitmap.bits.values())  # 从1940年起每天 4 字节
+
+    restored = CoverageBitmap.from_blobs(blobs)
+    missing = restored.missing("1990-01-01", "2020-01-02", hours, ["u10", "v10", "sp"])
+    assert missing.keys() == {"2020-01-01", "2020-01-02"}
+    restored.add(["2020-01-01"], hours, ["u10"])  # 解压后的数组可写
+    assert restored.bits["u10"][day_index("2020-01-01")] == np.uint32(0xFFFFFF)
+
+
+def test_dates_before_origin_are_rejected():
+    with pytest.raises(ValueError):
+        day_index("1939-12-31")
+
+
+def test_ledger_builds_bitmap_from_coverage_rows(tmp_path):
+    """旧台账没有位图时由 coverage 表生成，结果与逐条写入时一致"""
+    path = str(tmp_path / "ledger.sqlite")
+    request = {"variable": ["u10", "v10"], "time": [f"{h:02d}:00" for h in hours]}
+    ledger = Ledger(path)
+    ledger.record_archive("ds", dict(request, year="2000", month="01", day=["01", "02"]), str(tmp_path / "a.zip"))
+    ledger.record_archive("ds", dict(request, variable=["u10"], year="2000", month="01", day=["03"], time=["06:00"]),
+                          str(tmp_path / "b.zip"))
+    expected = ledger.missing_fields("ds", request, "2000-01-01", "2000-01-03")
+    with ledger.conn:
+        ledger.conn.execute("DELETE FROM bitmaps")
+        ledger.conn.execute("DELETE FROM meta WHERE key LIKE 'bitmap:%'")
+    ledger.close()
+
+    ledger = Ledger(path)
+    try:
+        assert ledger.missing_fields("ds", request, "2000-01-01", "2000-01-03") == expected
+        assert expected["2000-01-03"] == {(h, v) for h in hours for v in ("u10", "v10")} - {(6, "u10")}
+    finally:
+        ledger.close()
@@ -0,0 +1,117 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mockcds  # noqa: E402
+import retry  # noqa: E402
+from distributed import network_path, shared_profile  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+from planner import build_request, plan_requests  # noqa: E402
+
+request = {"format": "zip", "variable": ["10m_u_component_of_wind"], "time": ["00:00", "12:00"]}
+
+
+def plan(days):
+    return [{"dates": [f"2000-01-{day:02d}"], "hours": [0, 12], "variables": request["variable"],
+             "filename": f"2000-01-{day:02d}_partial.zip"} for day in days]
+
+
+@pytest.fixture
+def ledgers(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    opened = [Ledger(path, shared=True), Ledger(path, shared=True)]
+    yield opened
+    for ledger in opened:
+        ledger.close()
+
+
+def test_claims_are_exclusive(ledgers):
+    first, second = ledgers
+    assert first.publish_work("ds", request, plan([1, 2])) == 2
+    assert first.publish_work("ds", request, plan([1, 2])) == 0  # 已在工作表中待处理的不重复加入
+
+    a = first.claim_work("ds", request, "a", 600)
+    b = second.claim_work("ds", request, "b", 600)
+    assert {a["item"]["filename"], b["item"]["filename"]} == {"2000-01-01_partial.zip", "2000-01-02_partial.zip"}
+    assert second.claim_work("ds", request, "c", 600) is None
+    assert first.work_summary("ds", request) == {"leased": 2}
+
+
+def test_expired_lease_is_taken_over(ledgers):
+    first, second = ledgers
+    first.publish_work("ds", request, plan([1]))
+    work = first.claim_work("ds", request, "dead", -1)
+    first.update_work(work["id"], "dead", "cds-request-1")
+    assert first.work_summary("ds", request) == {"expired": 1}
+
+    taken = second.claim_work("ds", request, "alive", 600)
+    assert taken["id"] == work["id"]
+    assert taken["previous_owner"] == "dead" and taken["request_id"] == "cds-request-1"
+    # 原持有者续约、改写或结束都不再生效
+    assert first.renew_leases("dead", {work["id"]}, 600) == set()
+    first.finish_work(work["id"], "dead", "failed")
+    assert second.renew_leases("alive", {work["id"]}, 600) == {work["id"]}
+
+    second.finish_work(work["id"], "alive", "done")
+    assert first.work_summary("ds", request) == {"done": 1}
+    assert second.claim_work("ds", request, "alive", 600) is None
+
+
+def test_failed_work_reopens_until_max_attempts(ledgers):
+    ledger = ledgers[0]
+    ledger.publish_work("ds", request, plan([1]))
+    work = ledger.claim_work("ds", request, "a", 600)
+    ledger.finish_work(work["id"], "a", "failed")
+    assert ledger.publish_work("ds", request, plan([1]), max_attempts=2) == 1
+    work = ledger.claim_work("ds", request, "a", 600)
+    ledger.finish_work(work["id"], "a", "failed")
+    assert ledger.publish_work("ds", request, plan([1]), max_attempts=2) == 0
+    assert ledger.work_summary("ds", request) == {"failed": 1}
+
+
+def test_network_ledger_paths():
+    assert network_path("\\\\server\\era5\\download_ledger.sqlite")
+    assert network_path("//server/era5/download_ledger.sqlite")
+    assert not network_path("D:\\era5\\download_ledger.sqlite")
+    assert not network_path("/data/era5/download_ledger.sqlite")
+
+
+def test_worker_reattaches_request_of_expired_lease(tmp_path, monkeypatch):
+    """工作进程接手租约过期的申请时直接接上原持有者提交的CDS申请，不重新提交"""
+    monkeypatch.setattr(mockcds, "queue_latency", (0, 0))
+    monkeypatch.setattr(retry, "base_delay", 0)
+    server, url = mockcds.start_server()
+    monkeypatch.setenv("CDSAPI_URL", url)
+    monkeypatch.setenv("CDSAPI_KEY", "1:mock")
+    profile = shared_profile({
+        "dataset": "ds", "request_template": request, "install_directory": str(tmp_path),
+        "ranges": [("2000-01-01", "2000-01-01")], "poll_interval": 0.1, "lease_seconds": 60,
+    })
+    [item] = plan_requests({"2000-01-01": {(0, request["variable"][0]), (12, request["variable"][0])}})
+    ledger = Ledger(str(tmp_path / "download_ledger.sqlite"), shared=True)
+    try:
+        ledger.publish_work("ds", request, [item])
+        work = ledger.claim_work("ds", request, "dead", -1)
+        _, reply = server.cds.submit("ds", build_request(request, item))
+        ledger.update_work(work["id"], "dead", reply["request_id"])
+    finally:
+        ledger.close()
+
+    pipeline = Pipeline(profile, worker="alive")
+    pipeline.open()
+    try:
+        asyncio.run(pipeline.run())
+        assert pipeline.stats["reattached"] == 1 and pipeline.stats["submitted"] == 0
+        assert pipeline.stats["recorded"] == 1
+        assert server.cds.stats["submitted"] == 1
+        assert pipeline.ledger.work_summary("ds", request) == {"done": 1}
+        assert pipeline.ledger.missing_fields("ds", request, "2000-01-01", "2000-01-01") == {}
+        assert os.path.exists(tmp_path / item["filename"].replace(".zip", "_alive.zip"))
+    finally:
+        pipeline.ledger.close()
+        server.shutdown()
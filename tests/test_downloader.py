@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import downloader  # noqa: E402
+from downloader import segmented_download  # noqa: E402
+
+body = bytes(range(256)) * 64
+
+
+class Handler(BaseHTTPRequestHandler):
+    """HEAD 不给大小也不支持 Range；/missing 返回 404，/short 只发一半内容"""
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/missing":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body if self.path == "/full" else body[:len(body) // 2])
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """支持 Range，但每次只返回一小段：/short 每次 1000 字节，/empty 返回空的 206"""
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start = int(self.headers["Range"].split("=")[1].split("-")[0])
+        part = body[start:start + 1000] if self.path == "/short" else b""
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(part)))
+        self.end_headers()
+        self.wfile.write(part)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture(scope="module")
+def server():
+    server, url = serve(Handler)
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture(scope="module")
+def range_server():
+    server, url = serve(RangeHandler)
+    yield url
+    server.shutdown()
+
+
+def test_whole_download_checks_get_content_length(server, tmp_path):
+    info = segmented_download(server + "/full", str(tmp_path / "full.bin"), session=requests.Session())
+    assert info["size"] == info["expected_size"] == len(body)
+
+    with pytest.raises(Exception):
+        segmented_download(server + "/short", str(tmp_path / "short.bin"), session=requests.Session())
+    assert not os.path.exists(tmp_path / "short.bin")
+
+
+def test_whole_download_error_is_raised(server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        segmented_download(server + "/missing", str(tmp_path / "missing.bin"), session=requests.Session())
+    assert not os.path.exists(tmp_path / "missing.bin")
+
+
+def test_short_range_bodies_continue_without_backoff(range_server, tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(downloader.time, "sleep", sleeps.append)
+    info = segmented_download(range_server + "/short", str(tmp_path / "short.bin"), session=requests.Session())
+    assert info["size"] == len(body) and (tmp_path / "short.bin").read_bytes() == body
+    assert sleeps == []
+
+
+def test_empty_range_bodies_give_up_after_retries(range_server, tmp_path, monkeypatch):
+    """一直返回空内容的服务器：按退避重试 segment_retries 次后放弃，而不是无限循环"""
+    sleeps = []
+    monkeypatch.setattr(downloader.time, "sleep", sleeps.append)
+    with pytest.raises(IOError):
+        segmented_download(range_server + "/empty", str(tmp_path / "empty.bin"), session=requests.Session())
+    assert len(sleeps) == downloader.segment_retries
+    assert not os.path.exists(tmp_path / "empty.bin")
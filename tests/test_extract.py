@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract import PointExtractor, interpolation_weights  # noqa: E402
+
+lat = np.arange(25.0, 19.9, -0.5)  # 25.0 ... 20.0
+lon = np.arange(100.0, 111.6, 0.5)  # 100.0 ... 111.5
+
+
+def test_point_partly_outside_grid_has_no_weights():
+    """最后一列之外的站点：四个格点中有的在网格内，也要整体视为网格外"""
+    rows, cols, weights = interpolation_weights(lat, lon, np.array([111.9]), np.array([22.2]))
+    assert weights.sum() == 0
+    assert (rows == 0).all() and (cols == 0).all()
+
+
+def test_edge_point_does_not_break_other_points():
+    xs, ys = np.array([100.2, 111.9]), np.array([24.6, 22.2])
+    extractor = PointExtractor(xs, ys)
+    rows, cols, weights, (r0, r1, c0, c1) = extractor.weights_for(lat, lon)
+    assert rows.min() >= 0 and rows.max() < r1 - r0
+    assert cols.min() >= 0 and cols.max() < c1 - c0
+
+    grid = np.arange(len(lat) * len(lon), dtype=np.float32).reshape(1, len(lat), len(lon))
+    values = extractor.gather(grid[:, r0:r1, c0:c1], rows, cols, weights)
+    expected_rows, expected_cols, expected_weights = interpolation_weights(lat, lon, xs[:1], ys[:1])
+    expected = (grid[0][expected_rows, expected_cols] * expected_weights).sum()
+    assert np.isclose(values[0, 0], expected)
+    assert np.isnan(values[0, 1])
+
+
+def test_series_writer_keeps_time_axis_sorted(tmp_path):
+    """补缺文件或排在后面的日文件早于已写入的时刻时，插入对应位置；重复的时刻只写一次"""
+    h5py = pytest.importorskip("h5py")
+    from extract import SeriesWriter
+
+    path = str(tmp_path / "series.h5")
+    writer = SeriesWriter(path, np.array([100.0, 101.0]), np.array([20.0, 21.0]))
+
+    def speeds(hours):
+        return np.stack([hours, -hours], axis=1).astype(np.float32)
+
+    assert writer.append(np.arange(24, 48), speeds(np.arange(24, 48))) == 24
+    assert writer.append(np.arange(0, 12), speeds(np.arange(0, 12))) == 12
+    batch = np.array([50, 12, 30, 13, 12])
+    assert writer.append(batch, speeds(batch)) == 3
+    writer.close()
+
+    writer = SeriesWriter(path, np.array([100.0, 101.0]), np.array([20.0, 21.0]))
+    assert writer.append(np.array([5, 49]), speeds(np.array([5, 49]))) == 1
+    writer.close()
+
+    with h5py.File(path, "r") as f:
+        times, values = f["time"][:], f["wind_speed"][:]
+    expected = np.concatenate([np.arange(0, 14), np.arange(24, 48), [49, 50]])
+    assert (times == expected).all()
+    assert (values == speeds(expected)).all()
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger, request_fingerprint  # noqa: E402
+
+land = {"format": "zip", "variable": ["10m_u_component_of_wind", "10m_v_component_of_wind"],
+        "time": ["00:00", "12:00"]}
+pressure = dict(land, pressure_level=["850", "1000"])
+
+
+def archive(request, days, month="01"):
+    return dict(request, year="2000", month=month, day=[f"{d:02d}" for d in days])
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite"))
+    yield ledger
+    ledger.close()
+
+
+def test_fingerprint_ignores_time_and_variable_order():
+    assert request_fingerprint(archive(land, [1])) == request_fingerprint(dict(land, variable=land["variable"][::-1]))
+    assert request_fingerprint(pressure) == request_fingerprint(dict(pressure, pressure_level=["1000", "850"]))
+    assert request_fingerprint(land) != request_fingerprint(pressure)
+    # area 的取值顺序有意义（北/西/南/东）
+    assert request_fingerprint(dict(land, area=[50, 100, 40, 110])) != request_fingerprint(dict(land, area=[40, 100, 50, 110]))
+
+
+def test_record_archive_and_missing_dates(tmp_path, ledger):
+    path = tmp_path / "2000-01_partial.zip"
+    path.write_bytes(b"PK" * 10)
+    ledger.record_archive("ds", archive(land, [1, 2, 4]), str(path), sha256="abc")
+
+    assert ledger.missing_dates("ds", land, "2000-01-01", "2000-01-05") == ["2000-01-03", "2000-01-05"]
+    assert ledger.file_for("ds", land, "2000-01-02", 12) == str(path)
+    assert ledger.locate("ds", land, "2000-01-04", 0, "10m_v_component_of_wind") == (str(tmp_path), str(path))
+    assert ledger.locate("ds", land, "2000-01-03") is None
+    assert ledger.files_between("ds", land, "2000-01-01", "2000-01-31") == [str(path)]
+
+
+def test_datasets_and_request_parameters_are_kept_apart(tmp_path, ledger):
+    """气压层与地面数据共用一个目录和台账时互不当作已下载"""
+    ledger.record_archive("ds", archive(land, [1]), str(tmp_path / "land.zip"))
+    assert ledger.missing_dates("ds", land, "2000-01-01", "2000-01-01") == []
+    assert ledger.missing_dates("ds", pressure, "2000-01-01", "2000-01-01") == ["2000-01-01"]
+    assert ledger.missing_dates("other", land, "2000-01-01", "2000-01-01") == ["2000-01-01"]
+
+
+def test_partial_variables_leave_day_missing(tmp_path, ledger):
+    ledger.record_archive("ds", dict(archive(land, [1]), variable=["10m_u_component_of_wind"]), str(tmp_path / "u.zip"))
+    assert ledger.missing_dates("ds", land, "2000-01-01", "2000-01-01") == ["2000-01-01"]
+    ledger.record_archive("ds", dict(archive(land, [1]), variable=["10m_v_component_of_wind"]), str(tmp_path / "v.zip"))
+    assert ledger.missing_dates("ds", land, "2000-01-01", "2000-01-01") == []
+
+
+def test_import_dates_file_once_and_persist(tmp_path):
+    dates_file = tmp_path / "downloaded_dates.txt"
+    dates_file.write_text("2000-01-02\n2000-01-01\n\nnot-a-date\n2000-01-02\n")
+    path = str(tmp_path / "ledger.sqlite")
+
+    ledger = Ledger(path)
+    assert ledger.import_dates_file(str(dates_file), "ds", land) == 2
+    assert ledger.import_dates_file(str(dates_file), "ds", land) == 0
+    ledger.close()
+
+    ledger = Ledger(path)
+    try:
+        assert ledger.missing_dates("ds", land, "2000-01-01", "2000-01-03") == ["2000-01-03"]
+    finally:
+        ledger.close()
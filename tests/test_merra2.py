@@ -0,0 +1,49 @@
+import os
+import sys
+import csv
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import merra2  # noqa: E402
+from verify import file_sha256  # noqa: E402
+
+
+def write_zip(path, content):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("data.nc", content)
+    return str(path)
+
+
+def test_already_valid_checks_recorded_hash(tmp_path, monkeypatch):
+    path = write_zip(tmp_path / "a.zip", b"x" * 100)
+    entry = {"status": "ok", "size": str(os.path.getsize(path)), "sha256": file_sha256(path)}
+    assert merra2.already_valid(path, entry)
+
+    # 大小和格式都没变，但内容与清单中的哈希不符
+    write_zip(tmp_path / "a.zip", b"y" * 100)
+    assert not merra2.already_valid(path, entry)
+    monkeypatch.setattr(merra2, "verify_sha256", False)
+    assert merra2.already_valid(path, entry)
+
+
+def test_unlisted_valid_files_are_adopted(tmp_path, monkeypatch):
+    monkeypatch.setattr(merra2, "download_folder", str(tmp_path))
+    monkeypatch.setattr(merra2, "manifest_file", str(tmp_path / "manifest.csv"))
+    path = write_zip(tmp_path / "a.zip", b"x" * 100)
+    (tmp_path / "b.zip").write_bytes(b"PK\x03\x04 truncated")
+    pending = []
+    monkeypatch.setattr(merra2, "download_pending", lambda files, manifest: pending.extend(files))
+
+    merra2.bulk_download([("a.zip", "https://example/a.zip"), ("b.zip", "https://example/b.zip")])
+    assert pending == [("b.zip", "https://example/b.zip")]
+    with open(tmp_path / "manifest.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["name"], row["status"], row["sha256"]) for row in rows] == [("a.zip", "ok", file_sha256(path))]
+
+    # 补记之后再次运行直接跳过，不再重复补记
+    pending.clear()
+    merra2.bulk_download([("a.zip", "https://example/a.zip")])
+    assert pending == []
+    with open(tmp_path / "manifest.csv", newline="") as f:
+        assert len(list(csv.DictReader(f))) == 1
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def test_label_values_are_escaped():
+    labels = (("path", 'D:\\era5\\"new"\nfile'),)
+    assert metrics._format_labels(labels) == '{path="D:\\\\era5\\\\\\"new\\"\\nfile"}'
+
+
+def test_throughput_between_sparse_scrapes(monkeypatch):
+    """采集间隔比窗口长时，仍由下载进度回调记录的字节数算出速度"""
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(metrics.time, "time", lambda: clock["now"])
+    counter = metrics.Counter("test_bytes_total", "测试")
+    metrics._registry.remove(counter)
+    throughput = metrics.Throughput(counter)
+    assert throughput() == {(): 0.0}
+
+    for _ in range(metrics.textfile_interval):
+        clock["now"] += 1
+        counter.inc(1000)
+        throughput.sample()
+    assert throughput() == {(): 1000.0}
@@ -0,0 +1,158 @@
+import os
+import sys
+import asyncio
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline  # noqa: E402
+from retry import AIMDLimiter  # noqa: E402
+
+
+def test_download_extension_follows_request_format():
+    item = {"filename": "1990-01_partial.zip"}
+    assert pipeline.download_filename(item, {"format": "zip"}) == "1990-01_partial.zip"
+    grib = {"format": "zip", "data_format": "grib", "download_format": "unarchived"}
+    assert pipeline.download_filename(item, grib) == "1990-01_partial.grib"
+    assert pipeline.download_filename(item, dict(grib, data_format="netcdf"), "host-1") == "1990-01_partial_host-1.nc"
+
+
+def test_record_failure_retries_only_record(tmp_path, monkeypatch):
+    """台账写入失败时文件已校验，重新记录即可，不再向CDS重新提交"""
+    monkeypatch.setattr(pipeline, "backoff_delay", lambda attempt, kind: 0)
+    path = tmp_path / "1990-01_partial.zip"
+    path.write_bytes(b"PK")
+
+    async def run():
+        p = pipeline.Pipeline({"dataset": "ds", "request_template": {}, "install_directory": str(tmp_path)})
+        p.limiter, p.retry_tasks = AIMDLimiter(), set()
+        p.queues = {name: asyncio.Queue() for name in ("submit", "download", "record")}
+        job = {"item": {"filename": path.name}, "url": "http://example/x", "path": str(path)}
+        p._on_failure("record", job, sqlite3.OperationalError("database is locked"))
+        await asyncio.gather(*p.retry_tasks)
+        return job, {name: queue.qsize() for name, queue in p.queues.items()}
+
+    job, sizes = asyncio.run(run())
+    assert sizes == {"submit": 0, "download": 0, "record": 1}
+    assert job["item"]["attempts"] == 1
+
+
+def test_download_without_requested_variables_fails_permanently(tmp_path, monkeypatch):
+    """文件中的变量都不属于申请时不记录、不缓存，按永久失败结束而不是记为完成"""
+    monkeypatch.setattr(pipeline, "get_verify_pool", lambda: None)
+    monkeypatch.setattr(pipeline, "read_archive_contents",
+                        lambda path: {"variables": ["u_component_of_wind"], "times": {"1990-01-01": [0]}})
+    monkeypatch.setattr(pipeline, "record_contents", lambda *args, **kwargs: False)
+    path = tmp_path / "1990-01_partial.zip"
+    path.write_bytes(b"PK")
+
+    async def run():
+        p = pipeline.Pipeline({"dataset": "ds", "request_template": {}, "install_directory": str(tmp_path)})
+        p.limiter, p.retry_tasks, p.outstanding, p.produced = AIMDLimiter(), set(), 1, True
+        p.settled = asyncio.Event()
+        p.queues = {name: asyncio.Queue() for name in ("submit", "download", "record")}
+        job = {"item": {"filename": path.name}, "request": {"variable": ["10m_u_component_of_wind"]},
+               "path": str(path), "volume": str(tmp_path), "info": {"size": 2, "sha256": None}}
+        try:
+            await p._record(job)
+        except Exception as e:
+            p._on_failure("record", job, e)
+        return p
+
+    p = asyncio.run(run())
+    assert p.stats["recorded"] == 0 and p.stats["failed"] == 1
+    assert not p.retry_tasks and p.settled.is_set()
+
+
+def test_request_state_gauge_drops_to_zero_when_nothing_pending(tmp_path, monkeypatch):
+    """在途申请全部完成后，各状态的数量归零而不是停在最后一次轮询的值"""
+    class Result:
+        def __init__(self, states):
+            self.states, self.reply, self.location = list(states), {}, "http://example/x"
+
+        def update(self):
+            self.reply = {"state": self.states.pop(0)}
+
+    async def run():
+        p = pipeline.Pipeline({"dataset": "ds", "request_template": {}, "install_directory": str(tmp_path),
+                               "poll_interval": 0})
+        p.limiter, p.slots = AIMDLimiter(), asyncio.Condition()
+        p.queues = {"poll": asyncio.Queue(), "download": asyncio.Queue()}
+        for states in (["queued", "running", "completed"], ["running", "completed"]):
+            await p.queues["poll"].put({"item": {"filename": "x"}, "result": Result(states), "submitted": 0})
+        await p.queues["poll"].put(pipeline._DONE)
+        samples = []
+        original = pipeline.metrics.requests_state.set
+        monkeypatch.setattr(pipeline.metrics.requests_state, "set",
+                            lambda value, **labels: (samples.append((labels["state"], value)), original(value, **labels)))
+        await p._poll_stage()
+        return samples
+
+    samples = asyncio.run(run())
+    assert samples[:3] == [("accepted", 0), ("queued", 1), ("running", 1)]
+    assert samples[-3:] == [("accepted", 0), ("queued", 0), ("running", 0)]
+    assert {labels: value for _, labels, value in pipeline.metrics.requests_state.samples()} == {
+        (("state", "accepted"),): 0, (("state", "queued"),): 0, (("state", "running"),): 0}
+
+
+def test_queue_full_rejections_lower_inflight_limit_and_retry(tmp_path, monkeypatch):
+    """模拟服务器按账户排队上限拒绝提交：名额减半，被拒绝的申请退避后重新提交，最终全部完成"""
+    import mockcds
+    import retry
+
+    monkeypatch.setattr(mockcds, "queue_latency", (0.3, 0.3))
+    monkeypatch.setattr(mockcds, "max_active", 1)
+    monkeypatch.setattr(retry, "base_delay", 0.1)
+    server, url = mockcds.start_server()
+    monkeypatch.setenv("CDSAPI_URL", url)
+    monkeypatch.setenv("CDSAPI_KEY", "1:mock")
+    request = {"format": "zip", "variable": ["10m_u_component_of_wind"], "time": ["00:00", "12:00"]}
+    p = pipeline.Pipeline({"dataset": "ds", "request_template": request, "install_directory": str(tmp_path),
+                           "ranges": [("2000-01-01", "2000-01-04")], "max_fields_per_request": 2,
+                           "poll_interval": 0.1})
+    p.open()
+    try:
+        asyncio.run(p.run())
+        assert p.stats["planned"] == 4 and p.stats["recorded"] == 4 and p.stats["failed"] == 0
+        assert server.cds.stats["rejected"] >= 1
+        assert p.limiter.limit < 4
+        assert p.ledger.missing_dates("ds", request, "2000-01-01", "2000-01-04") == []
+    finally:
+        p.ledger.close()
+        server.shutdown()
+
+
+def test_restart_reattaches_submitted_requests(tmp_path, monkeypatch):
+    """重启后接上仍在CDS上的申请，不重新提交；服务器上已不存在的申请删除后重新规划提交"""
+    import mockcds
+    from ledger import Ledger
+    from planner import build_request, plan_requests
+
+    monkeypatch.setattr(mockcds, "queue_latency", (0.2, 0.2))
+    server, url = mockcds.start_server()
+    monkeypatch.setenv("CDSAPI_URL", url)
+    monkeypatch.setenv("CDSAPI_KEY", "1:mock")
+    template = {"format": "zip", "variable": ["10m_u_component_of_wind"], "time": ["00:00", "12:00"]}
+    fields = {(0, "10m_u_component_of_wind"), (12, "10m_u_component_of_wind")}
+    first, second = plan_requests({"2000-01-01": fields, "2000-01-02": fields}, limit=2)
+
+    ledger = Ledger(str(tmp_path / "download_ledger.sqlite"))
+    _, reply = server.cds.submit("ds", build_request(template, first))
+    ledger.save_job("ds", reply["request_id"], first, build_request(template, first), "queued", 0)
+    ledger.save_job("ds", "expired-on-server", second, build_request(template, second), "queued", 0)
+    ledger.close()
+
+    p = pipeline.Pipeline({"dataset": "ds", "request_template": template, "install_directory": str(tmp_path),
+                           "ranges": [("2000-01-01", "2000-01-02")], "max_fields_per_request": 2,
+                           "poll_interval": 0.1})
+    p.open()
+    try:
+        asyncio.run(p.run())
+        assert p.stats["reattached"] == 1 and p.stats["planned"] == 1 and p.stats["submitted"] == 1
+        assert p.stats["recorded"] == 2
+        assert server.cds.stats["submitted"] == 2
+        assert p.ledger.missing_dates("ds", template, "2000-01-01", "2000-01-02") == []
+        assert p.ledger.load_jobs("ds", template) == []
+    finally:
+        p.ledger.close()
+        server.shutdown()
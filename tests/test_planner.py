@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import planner  # noqa: E402
+from ledger import date_range  # noqa: E402
+from planner import build_request, count_fields, plan_requests, print_plan  # noqa: E402
+
+variables = ("u10", "v10")
+hours = range(24)
+
+
+def missing_days(start, end, fields=None):
+    fields = fields or {(h, v) for h in hours for v in variables}
+    return {d: set(fields) for d in date_range(start, end)}
+
+
+def test_whole_months_merge_up_to_limit():
+    missing = missing_days("2000-01-01", "2000-04-30")
+    plan = plan_requests(missing, limit=2 * 31 * 24 * 2)
+    assert [item["months"] for item in plan] == [[1, 2], [3, 4]]
+    assert [item["filename"] for item in plan] == ["2000-01_partial_to_02.zip", "2000-03_partial_to_04.zip"]
+    assert all(count_fields(item) <= 2 * 31 * 24 * 2 for item in plan)
+    assert sorted(d for item in plan for d in item["dates"]) == sorted(missing)
+
+
+def test_scattered_gaps_in_a_month_become_one_request():
+    missing = {d: {(h, v) for h in hours for v in variables} for d in ("2000-01-03", "2000-01-17", "2000-01-29")}
+    [item] = plan_requests(missing)
+    assert item["days"] == [3, 17, 29] and item["months"] == [1]
+    request = build_request({"format": "zip"}, item)
+    assert request["day"] == ["03", "17", "29"] and request["time"][0] == "00:00" and len(request["time"]) == 24
+
+
+def test_missing_hours_and_variables_are_requested_separately():
+    """只缺个别小时/变量的日期不会整天重新申请"""
+    missing = {"2000-01-01": {(h, "u10") for h in hours} | {(h, "v10") for h in (6, 7)}}
+    plan = plan_requests(missing)
+    assert sorted((tuple(item["hours"]), tuple(item["variables"])) for item in plan) == [
+        (tuple(hours), ("u10",)), ((6, 7), ("v10",))]
+    assert sum(count_fields(item) for item in plan) == 26
+
+
+def test_oversized_request_splits_by_variable_then_days(monkeypatch):
+    missing = missing_days("2000-01-01", "2000-01-31")
+    plan = plan_requests(missing, limit=31 * 24)
+    assert [(item["variables"], len(item["days"])) for item in plan] == [(["u10"], 31), (["v10"], 31)]
+
+    monkeypatch.setattr(planner, "split_by_variable", False)
+    plan = plan_requests(missing, limit=10 * 24 * 2)
+    assert all(item["variables"] == list(variables) for item in plan)
+    assert [len(item["days"]) for item in plan] == [10, 10, 10, 1]
+    assert len({item["filename"] for item in plan}) == len(plan)
+
+
+def test_plan_is_ordered_by_date_and_adjacent_months_only(monkeypatch):
+    missing = missing_days("2000-05-01", "2000-05-31")
+    missing.update(missing_days("2000-01-01", "2000-01-31"))
+    missing.update(missing_days("2000-03-01", "2000-03-31"))
+    plan = plan_requests(missing)
+    assert [item["months"] for item in plan] == [[1], [3], [5]]
+
+    monkeypatch.setattr(planner, "merge_months", False)
+    assert [item["months"] for item in plan_requests(missing_days("2000-01-01", "2000-02-29"))] == [[1], [2]]
+
+
+def test_print_plan_reports_field_counts(capsys):
+    print_plan(plan_requests(missing_days("2000-01-01", "2000-01-02")))
+    output = capsys.readouterr().out
+    assert "共 1 个申请，96 个字段" in output
+    assert "2000-01_partial.zip" in output and "96 字段" in output
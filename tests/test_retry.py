@@ -0,0 +1,82 @@
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retry  # noqa: E402
+from retry import (PERMANENT, QUEUE_FULL, RATE_LIMITED, TRANSIENT, AIMDLimiter, PermanentError,  # noqa: E402
+                   backoff_delay, classify_error)
+
+
+def http_error(status, message):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(message, response=response)
+
+
+def test_cds_request_errors_are_permanent():
+    assert classify_error(Exception("Request too large. Requested 200000 items, limit is 120000")) == PERMANENT
+    assert classify_error(Exception("The requested variable is not available for this dataset")) == PERMANENT
+    assert classify_error(Exception("Required licences not accepted")) == PERMANENT
+    assert classify_error(http_error(404, "Not Found")) == PERMANENT
+
+
+def test_generic_wording_stays_transient():
+    assert classify_error(Exception("Service temporarily not available, please retry")) == TRANSIENT
+    assert classify_error(Exception("Unknown error while processing the request")) == TRANSIENT
+    assert classify_error(Exception("Received invalid response from upstream")) == TRANSIENT
+
+
+def test_permanent_error_is_not_retried():
+    assert classify_error(PermanentError("文件中没有申请的变量")) == PERMANENT
+
+
+def test_throttling_and_network_errors_are_retryable():
+    assert classify_error(Exception("Number of queued requests is temporarily limited: maximum number of "
+                                    "4 requests per user reached")) == QUEUE_FULL
+    assert classify_error(http_error(429, "Too Many Requests")) == RATE_LIMITED
+    assert classify_error(Exception("Rate limit exceeded")) == RATE_LIMITED
+    assert classify_error(requests.ConnectionError("connection reset")) == TRANSIENT
+    assert classify_error(requests.Timeout("read timed out")) == TRANSIENT
+    assert classify_error(http_error(503, "Service Unavailable")) == TRANSIENT
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(retry, "base_delay", 10)
+    monkeypatch.setattr(retry, "max_delay", 100)
+    assert [backoff_delay(attempt) for attempt in range(5)] == [10, 20, 40, 80, 100]
+    assert backoff_delay(1, QUEUE_FULL) == backoff_delay(2, TRANSIENT) == 40
+
+
+def test_aimd_limiter_adds_slowly_and_halves_on_throttling():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=6, slow_queue_time=100)
+    for _ in range(4):
+        limiter.on_success(10)
+    assert 4.9 < limiter.limit < 5  # 每轮（约 limit 个申请完成）增加约 1
+    limiter.on_success(1000)  # 排队过长时不再增加
+    assert 4.9 < limiter.limit < 5
+    for _ in range(100):
+        limiter.on_success(10)
+    assert limiter.limit == 6
+
+    limiter.on_throttled()
+    assert limiter.limit == 3
+    for _ in range(5):
+        limiter.on_throttled()
+    assert limiter.limit == 1
+
+
+def test_aimd_limiter_available_slots():
+    limiter = AIMDLimiter(initial=2)
+    limiter.acquire()
+    assert limiter.available
+    limiter.acquire()
+    assert not limiter.available
+    limiter.on_throttled()
+    limiter.release()
+    assert not limiter.available  # 名额已降为 1，仍有 1 个在途
+    limiter.release()
+    assert limiter.available
@@ -0,0 +1,54 @@
+import os
+import sys
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+h5py = pytest.importorskip("h5py")
+
+from ledger import Ledger  # noqa: E402
+from scanner import scan_directory  # noqa: E402
+
+land = {"variable": ["10m_u_component_of_wind", "10m_v_component_of_wind"], "time": ["00:00", "01:00"]}
+pressure = {"variable": ["u_component_of_wind"], "pressure_level": ["1000"], "time": ["00:00", "01:00"]}
+
+
+def write_daily(directory, day, variables):
+    """按天下载的压缩包，如 1990-01-01.zip"""
+    nc_path = os.path.join(directory, day + ".nc")
+    with h5py.File(nc_path, "w") as f:
+        start = (datetime.fromisoformat(day) - datetime(1970, 1, 1)).total_seconds()
+        f["valid_time"] = np.array([start, start + 3600], dtype="i8")
+        f["valid_time"].attrs["units"] = "seconds since 1970-01-01"
+        for variable in variables:
+            f.create_dataset(variable, data=np.zeros((2, 2, 2), dtype="f4"))
+    with zipfile.ZipFile(os.path.join(directory, day + ".zip"), "w") as zf:
+        zf.write(nc_path, "data_0.nc")
+    os.remove(nc_path)
+
+
+def test_daily_file_of_other_dataset_is_not_credited(tmp_path):
+    write_daily(str(tmp_path), "1990-01-01", ["u"])
+    ledger = Ledger(str(tmp_path / "ledger.sqlite"))
+    try:
+        scan_directory(str(tmp_path), ledger, "land", land)
+        assert ledger.missing_fields("land", land, "1990-01-01", "1990-01-01") != {}
+        scan_directory(str(tmp_path), ledger, "pressure", pressure)
+        assert ledger.missing_fields("pressure", pressure, "1990-01-01", "1990-01-01") == {}
+    finally:
+        ledger.close()
+
+
+def test_daily_file_credits_only_its_contents(tmp_path):
+    write_daily(str(tmp_path), "1990-01-02", ["u10"])
+    ledger = Ledger(str(tmp_path / "ledger.sqlite"))
+    try:
+        scan_directory(str(tmp_path), ledger, "land", land)
+        missing = ledger.missing_fields("land", land, "1990-01-02", "1990-01-02")
+        assert {v for _, v in missing["1990-01-02"]} == {"10m_v_component_of_wind"}
+    finally:
+        ledger.close()
@@ -0,0 +1,141 @@
+import os
+import sys
+import asyncio
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler  # noqa: E402
+from ledger import Ledger, date_range  # noqa: E402
+from scheduler import Scheduler, item_deadline, item_order  # noqa: E402
+
+
+class FakePipeline:
+    def __init__(self, name, **profile):
+        self.name = name
+        self.profile = profile
+        self.queues = {"submit": asyncio.Queue()}
+
+
+def items(start, end):
+    return [{"dates": [d], "filename": d} for d in date_range(start, end)]
+
+
+async def fill(sched, *entries):
+    for pipeline, work in entries:
+        sched.attach(pipeline)
+        for item in work:
+            await sched.add(pipeline, item)
+
+
+def pops(sched, count):
+    return [sched._pop() for _ in range(count)]
+
+
+def test_slots_are_shared_by_weight():
+    async def run():
+        sched = Scheduler(8)
+        heavy, light = FakePipeline("heavy", weight=2), FakePipeline("light")
+        await fill(sched, (heavy, items("2000-01-01", "2000-01-30")), (light, items("2000-01-01", "2000-01-30")))
+        return Counter(p.name for p, _ in pops(sched, 30))
+
+    assert asyncio.run(run()) == {"heavy": 20, "light": 10}
+
+
+def test_idle_dataset_leaves_slots_to_others_and_rejoins_fairly():
+    async def run():
+        sched = Scheduler(8)
+        busy, idle = FakePipeline("busy"), FakePipeline("idle")
+        await fill(sched, (busy, items("2000-01-01", "2000-01-20")), (idle, []))
+        first = Counter(p.name for p, _ in pops(sched, 10))
+        await fill(sched, (idle, items("2000-02-01", "2000-02-10")))
+        # 重新加入的数据集从当前最少份额开始，与其他数据集交替，而不是凭积攒的份额连续独占
+        second = [p.name for p, _ in pops(sched, 6)]
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {"busy": 10}
+    assert Counter(second) == {"busy": 3, "idle": 3}
+
+
+def test_deadlines_come_before_backfill_earliest_first():
+    async def run():
+        sched = Scheduler(8)
+        backfill = FakePipeline("backfill")
+        urgent = FakePipeline("urgent", deadlines=[("2019-06-01", "2019-06-02", "2026-11-01"),
+                                                   ("2019-07-01", "2019-07-01", "2026-10-20")])
+        await fill(sched, (backfill, items("1990-01-01", "1990-01-10")),
+                   (urgent, items("2019-05-31", "2019-06-02") + items("2019-07-01", "2019-07-01")))
+        return [item["dates"][0] for _, item in pops(sched, 4)]
+
+    assert asyncio.run(run()) == ["2019-07-01", "2019-06-01", "2019-06-02", "1990-01-01"]
+
+
+def test_item_order_and_deadline():
+    profile = {"deadlines": [("2019-06-01", "2019-06-30", "2026-11-01T12:00")]}
+    assert item_deadline(profile, {"dates": ["2019-05-30", "2019-06-01"]}).hour == 12
+    assert item_deadline(profile, {"dates": ["2019-07-01"]}) is None
+    early, late = {"dates": ["1990-01-01"]}, {"dates": ["2019-12-31"]}
+    assert item_order({}, early) < item_order({}, late)
+    assert item_order({"recent_first": True}, late) < item_order({"recent_first": True}, early)
+
+
+def test_recent_first_within_dataset():
+    async def run():
+        sched = Scheduler(8)
+        pipeline = FakePipeline("recent", recent_first=True)
+        await fill(sched, (pipeline, items("2000-01-01", "2000-01-03")))
+        return [item["dates"][0] for _, item in pops(sched, 3)]
+
+    assert asyncio.run(run()) == ["2000-01-03", "2000-01-02", "2000-01-01"]
+
+
+def test_dispatch_fills_free_slots_and_cancel_drops_pending():
+    async def run():
+        sched = Scheduler(2)
+        a, b = FakePipeline("a"), FakePipeline("b")
+        await fill(sched, (a, items("2000-01-01", "2000-01-05")), (b, items("2000-01-01", "2000-01-05")))
+        dispatcher = asyncio.create_task(sched.dispatch())
+        await asyncio.sleep(0.05)
+        dispatched = a.queues["submit"].qsize() + b.queues["submit"].qsize()
+        async with sched.slots:
+            sched.limiter.release()
+            sched.slots.notify_all()
+        await asyncio.sleep(0.05)
+        after_release = a.queues["submit"].qsize() + b.queues["submit"].qsize()
+        cancelled = sched.cancel(a)
+        await sched.close()
+        await dispatcher
+        return dispatched, after_release, cancelled, sched.pending()
+
+    dispatched, after_release, cancelled, pending = asyncio.run(run())
+    assert (dispatched, after_release) == (2, 3)
+    assert cancelled == 5 - 2 and pending
+
+
+def test_two_datasets_share_one_account(tmp_path, monkeypatch):
+    """两个数据集在同一进程中共用在途名额，经模拟服务器全部下载完成"""
+    import mockcds
+
+    monkeypatch.setattr(mockcds, "queue_latency", (0.1, 0.1))
+    server, url = mockcds.start_server()
+    monkeypatch.setenv("CDSAPI_URL", url)
+    monkeypatch.setenv("CDSAPI_KEY", "1:mock")
+    request = {"format": "zip", "variable": ["10m_u_component_of_wind"], "time": ["00:00", "12:00"]}
+    extras = {"ds-a": {"weight": 2}, "ds-b": {"deadlines": [("2000-01-02", "2000-01-02", "2026-11-01")]}}
+    profiles = [
+        {"dataset": name, "request_template": request, "install_directory": str(tmp_path / name),
+         "ranges": [("2000-01-01", "2000-01-03")], "max_fields_per_request": 2, "poll_interval": 0.1, **extra}
+        for name, extra in extras.items()
+    ]
+    try:
+        scheduler.run_scheduled(profiles, max_inflight=2)
+    finally:
+        server.shutdown()
+    assert server.cds.stats["submitted"] == 6
+    for profile in profiles:
+        ledger = Ledger(os.path.join(profile["install_directory"], "download_ledger.sqlite"))
+        try:
+            assert ledger.missing_dates(profile["dataset"], request, "2000-01-01", "2000-01-03") == []
+        finally:
+            ledger.close()
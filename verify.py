@@ -0,0 +1,171 @@
+import os
+import hashlib
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+# 校验配置
+verify_workers = max(1, (os.cpu_count() or 2) // 2)  # 压缩包CRC校验进程数
+read_size = 4 * 1024 ** 2
+
+_verify_pool = None
+_pool_lock = threading.Lock()
+
+
+class StreamingHasher:
+    """边下载边计算 SHA-256
+
+    按顺序到达的数据直接在内存中计算；其他分段写入的数据只记录区间，
+    等前面的数据补齐后再从刚写入的文件（系统页缓存）中续算，保证最终结果与整文件哈希一致。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sha256 = hashlib.sha256()
+        self.pos = 0
+        self._starts = {}  # 已写入但尚未计算的区间 start -> end
+        self._ends = {}
+        self._lock = threading.Lock()
+
+    def update(self, offset, data):
+        """数据写入文件后调用；offset 为该块在文件中的起点"""
+        with self._lock:
+            if offset == self.pos:
+                self.sha256.update(data)
+                self.pos += len(data)
+                self._drain()
+            else:
+                self._add_range(offset, offset + len(data))
+
+    def add_written(self, start, end):
+        """登记续传前已在磁盘上的区间"""
+        if end > start:
+            with self._lock:
+                self._add_range(start, end)
+                self._drain()
+
+    def hexdigest(self, size):
+        """返回整文件哈希，要求已覆盖 size 字节"""
+        with self._lock:
+            self._drain()
+            if self.pos != size:
+                raise IOError(f"哈希未覆盖完整文件: {self.pos}/{size} 字节")
+            return self.sha256.hexdigest()
+
+    def _add_range(self, start, end):
+        if start in self._ends:
+            start = self._ends.pop(start)
+            del self._starts[start]
+        if end in self._starts:
+            end = self._starts.pop(end)
+            del self._ends[end]
+        self._starts[start] = end
+        self._ends[end] = start
+
+    def _drain(self):
+        if self.pos not in self._starts:
+            return
+        with open(self.path, "rb") as f:
+            while self.pos in self._starts:
+                end = self._starts.pop(self.pos)
+                del self._ends[end]
+                f.seek(self.pos)
+                while self.pos < end:
+                    data = f.read(min(read_size, end - self.pos))
+                    if not data:
+                        raise IOError(f"读取已写入区间失败: {self.path}@{self.pos}")
+                    self.sha256.update(data)
+                    self.pos += len(data)
+
+
+def detect_format(path):
+    """根据文件头判断格式：zip / grib / netcdf / unknown"""
+    with open(path, "rb") as f:
+        magic = f.read(8)
+    if magic.startswith(b"PK\x03\x04"):
+        return "zip"
+    if magic.startswith(b"GRIB"):
+        return "grib"
+    if magic.startswith(b"CDF") or magic.startswith(b"\x89HDF"):
+        return "netcdf"
+    return "unknown"
+
+
+def check_zip(path):
+    """校验zip中央目录及所有成员的CRC"""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            if not zf.namelist():
+                return False, "压缩包为空"
+            bad = zf.testzip()
+            if bad:
+                return False, f"成员CRC错误: {bad}"
+    except (zipfile.BadZipFile, OSError) as e:
+        return False, f"压缩包损坏: {str(e)}"
+    return True, "ok"
+
+
+def check_grib(path):
+    """检查GRIB文件首尾标记"""
+    with open(path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        if f.read(4) != b"7777":
+            return False, "GRIB文件缺少结束标记"
+    return True, "ok"
+
+
+def file_sha256(path):
+    """整文件 SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(read_size), b""):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def check_download(path, expected_size=None):
+    """校验下载结果：字节数与 Content-Length 一致，压缩包再校验CRC"""
+    if not os.path.exists(path):
+        return False, "文件不存在"
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        return False, f"大小不符: {size}/{expected_size} 字节"
+
+    fmt = detect_format(path)
+    if fmt == "zip":
+        return check_zip(path)
+    if fmt == "grib":
+        return check_grib(path)
+    if fmt == "netcdf":
+        return True, "ok"
+    return False, "未知文件格式"
+
+
+def get_verify_pool():
+    """获取校验进程池（首次使用时创建）"""
+    global _verify_pool
+    with _pool_lock:
+        if _verify_pool is None:
+            _verify_pool = ProcessPoolExecutor(max_workers=verify_workers)
+        return _verify_pool
+
+
+def submit_verification(path, expected_size, callback):
+    """在进程池中校验文件，完成后调用 callback(ok, reason)"""
+    future = get_verify_pool().submit(check_download, path, expected_size)
+
+    def _notify(f):
+        error = f.exception()
+        callback(*(f.result() if error is None else (False, f"校验异常: {str(error)}")))
+
+    future.add_done_callback(_notify)
+    return future
+
+
+def shutdown_verify_pool():
+    """等待所有校验任务结束"""
+    global _verify_pool
+    with _pool_lock:
+        if _verify_pool is not None:
+            _verify_pool.shutdown(wait=True)
+            _verify_pool = None
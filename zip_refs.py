@@ -0,0 +1,336 @@
+import os
+import json
+import mmap
+import zlib
+import base64
+import zipfile
+import argparse
+import itertools
+
+import numpy as np
+
+# 引用索引配置
+save_references = True  # 建好的引用写入压缩包旁的 .refs.json，下次直接读取
+refs_suffix = ".refs.json"
+
+_hdf5_internal_attrs = {
+    "DIMENSION_LIST", "REFERENCE_LIST", "CLASS", "NAME", "_Netcdf4Dimid", "_Netcdf4Coordinates", "_nc3_strict",
+}
+_deflate, _shuffle = 1, 2  # HDF5 过滤器编号
+
+
+class UnsupportedArchive(ValueError):
+    """压缩包成员被压缩、不是 HDF5，或使用了不支持的过滤器，只能解压后读取"""
+
+
+def member_offsets(path):
+    """压缩包中每个成员数据部分在整个文件中的 (成员名, 起始字节, 长度)；成员必须是不压缩存储的"""
+    members = []
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise UnsupportedArchive(f"成员 {info.filename} 经过压缩，无法直接按字节读取")
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = int.from_bytes(header[26:28], "little"), int.from_bytes(header[28:30], "little")
+            members.append((info.filename, info.header_offset + 30 + name_length + extra_length, info.file_size))
+    return members
+
+
+def _json_value(value):
+    """HDF5 属性值转换为可写入 JSON 的值"""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, np.ndarray):
+        return [_json_value(v) for v in value.tolist()] if value.size != 1 else _json_value(value.reshape(-1)[0])
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value) if not np.isnan(value) else "NaN"
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    return value
+
+
+def _attrs(obj):
+    return {k: _json_value(v) for k, v in obj.attrs.items() if k not in _hdf5_internal_attrs}
+
+
+def _codecs(dset):
+    """HDF5 过滤器管线转换为 zarr 的 filters 与 compressor（只支持 shuffle + deflate）"""
+    plist = dset.id.get_create_plist()
+    filters, compressor = [], None
+    for i in range(plist.get_nfilters()):
+        code, _, values, _ = plist.get_filter(i)
+        if code == _shuffle:
+            filters.append({"id": "shuffle", "elementsize": dset.dtype.itemsize})
+        elif code == _deflate:
+            compressor = {"id": "zlib", "level": int(values[0]) if values else 4}
+        else:
+            raise UnsupportedArchive(f"变量 {dset.name} 使用了不支持的过滤器 {code}")
+    return filters or None, compressor
+
+
+def _dimension_names(dset):
+    names = []
+    for i, dim in enumerate(dset.dims):
+        names.append(dim[0].name.split("/")[-1] if len(dim) else f"phony_dim_{i}")
+    return names
+
+
+def _chunk_key(name, index):
+    return f"{name}/{'.'.join(str(i) for i in index) if index else '0'}"
+
+
+def _dataset_refs(dset, base, refs):
+    """一个 HDF5 变量的 zarr 元数据及每个分块在压缩包中的 [文件, 起始, 长度]"""
+    name = dset.name.lstrip("/")
+    if dset.dtype.kind not in "biuf" or dset.dtype.hasobject:
+        return False
+    chunks = dset.chunks or dset.shape
+    filters, compressor = _codecs(dset)
+    fill = dset.fillvalue
+    refs[f"{name}/.zarray"] = json.dumps({
+        "zarr_format": 2, "shape": list(dset.shape), "chunks": list(chunks) if chunks else [],
+        "dtype": dset.dtype.str, "fill_value": _json_value(fill), "order": "C",
+        "filters": filters, "compressor": compressor,
+    })
+    attrs = _attrs(dset)
+    attrs["_ARRAY_DIMENSIONS"] = _dimension_names(dset) if dset.shape else []
+    refs[f"{name}/.zattrs"] = json.dumps(attrs)
+
+    if dset.chunks:
+        for i in range(dset.id.get_num_chunks()):
+            info = dset.id.get_chunk_info(i)
+            if info.filter_mask:
+                raise UnsupportedArchive(f"变量 {name} 的部分分块跳过了过滤器")
+            index = tuple(o // c for o, c in zip(info.chunk_offset, chunks))
+            refs[_chunk_key(name, index)] = ["{{u}}", base + info.byte_offset, info.size]
+    else:
+        offset = dset.id.get_offset()
+        if offset is not None:
+            refs[_chunk_key(name, (0,) * len(dset.shape))] = ["{{u}}", base + offset, dset.id.get_storage_size()]
+        elif dset.size:  # 紧凑存储：数据在文件头中，直接内嵌
+            raw = np.ascontiguousarray(dset[()]).tobytes()
+            refs[_chunk_key(name, (0,) * len(dset.shape))] = "base64:" + base64.b64encode(raw).decode()
+    return True
+
+
+def build_references(path):
+    """为压缩包建立 kerchunk 格式的引用：各成员中每个 HDF5 分块对应整个压缩包中的字节范围"""
+    import h5py
+
+    refs = {".zgroup": json.dumps({"zarr_format": 2})}
+    global_attrs = {}
+    shapes = {}
+    with zipfile.ZipFile(path) as zf:
+        for member, base, _ in member_offsets(path):
+            with zf.open(member) as fileobj:
+                if fileobj.read(8) != b"\x89HDF\r\n\x1a\n":
+                    raise UnsupportedArchive(f"成员 {member} 不是 NetCDF4(HDF5) 文件")
+                fileobj.seek(0)
+                with h5py.File(fileobj, "r") as f:
+                    for key, value in _attrs(f).items():
+                        global_attrs.setdefault(key, value)
+                    for name, dset in f.items():
+                        if not isinstance(dset, h5py.Dataset):
+                            continue
+                        if name in shapes:
+                            # 多个成员（如 stepType 拆分）共用的坐标只保留一份，同名数据变量视为不一致
+                            if shapes[name] != dset.shape or not dset.is_scale:
+                                raise UnsupportedArchive(f"成员之间变量 {name} 不一致，无法合并为一个数据集")
+                            continue
+                        if _dataset_refs(dset, base, refs):
+                            shapes[name] = dset.shape
+    refs[".zattrs"] = json.dumps(global_attrs)
+    stat = os.stat(path)
+    return {
+        "version": 1,
+        "templates": {"u": os.path.abspath(path)},
+        "refs": refs,
+        "source": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+    }
+
+
+def load_references(path):
+    """读取压缩包旁的引用文件（压缩包变化后失效），没有时现场建立并按配置保存"""
+    refs_path = path + refs_suffix
+    stat = os.stat(path)
+    if os.path.exists(refs_path):
+        try:
+            with open(refs_path, encoding="utf-8") as f:
+                refs = json.load(f)
+            if refs.get("source") == {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+                return refs
+        except (OSError, ValueError):
+            pass
+    refs = build_references(path)
+    if save_references:
+        try:
+            tmp_path = refs_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(refs, f)
+            os.replace(tmp_path, refs_path)
+        except OSError as e:
+            print(f"⚠️ 无法保存引用文件 {refs_path}: {str(e)}")
+    return refs
+
+
+class ChunkedVariable:
+    """按需读取的变量：切片时只解码与范围相交的分块"""
+
+    def __init__(self, archive, name, meta, attrs):
+        self.archive = archive
+        self.name = name
+        self.shape = tuple(meta["shape"])
+        self.chunks = tuple(meta["chunks"]) or self.shape
+        self.dtype = np.dtype(meta["dtype"])
+        self.fill_value = meta["fill_value"]
+        self.shuffle = any(f["id"] == "shuffle" for f in meta["filters"] or [])
+        self.compressed = meta["compressor"] is not None
+        self.dims = tuple(attrs.pop("_ARRAY_DIMENSIONS", []))
+        for key in ("_FillValue", "missing_value"):  # JSON 中以字符串保存的 NaN/inf 还原为数值
+            if isinstance(attrs.get(key), str):
+                attrs[key] = float(attrs[key])
+        self.attrs = attrs
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, index):
+        """解码一个分块，未写入的分块返回 None"""
+        ref = self.archive.refs.get(_chunk_key(self.name, index))
+        if ref is None:
+            return None
+        if isinstance(ref, str):
+            raw = base64.b64decode(ref[len("base64:"):])
+        else:
+            _, offset, length = ref
+            raw = self.archive.buffer[offset:offset + length]
+        if self.compressed:
+            raw = zlib.decompress(raw)
+        if self.shuffle and self.dtype.itemsize > 1:
+            raw = np.frombuffer(raw, np.uint8).reshape(self.dtype.itemsize, -1).T.tobytes()
+        return np.frombuffer(raw, self.dtype).reshape(self.chunks if self.shape else ())
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        ranges, squeeze, steps = [], [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step < 0:
+                    raise IndexError("不支持负步长")
+                ranges.append((start, max(start, stop)))
+                steps.append(slice(None, None, step))
+            else:
+                k = int(k) + (n if int(k) < 0 else 0)
+                if not 0 <= k < n:
+                    raise IndexError(f"下标 {k} 超出范围")
+                ranges.append((k, k + 1))
+                steps.append(slice(None))
+                squeeze.append(axis)
+        if not self.shape:
+            chunk = self._chunk(())
+            return np.array(self.fill_value if chunk is None else chunk, self.dtype)
+
+        out = np.full([b - a for a, b in ranges], self._fill(), self.dtype)
+        chunk_ranges = [range(a // c, (b - 1) // c + 1) if b > a else range(0)
+                        for (a, b), c in zip(ranges, self.chunks)]
+        for index in itertools.product(*chunk_ranges):
+            chunk = self._chunk(index)
+            if chunk is None:
+                continue
+            source, target = [], []
+            for (a, b), i, c in zip(ranges, index, self.chunks):
+                lo, hi = max(a, i * c), min(b, (i + 1) * c)
+                source.append(slice(lo - i * c, hi - i * c))
+                target.append(slice(lo - a, hi - a))
+            out[tuple(target)] = chunk[tuple(source)]
+        out = out[tuple(steps)]
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+    def _fill(self):
+        value = self.fill_value
+        if isinstance(value, str):
+            return float(value)
+        return 0 if value is None else value
+
+
+class ArchiveDataset:
+    """把整个压缩包当作一个数据集：内存映射原文件，按引用直接读取分块，不解压到临时目录"""
+
+    def __init__(self, path, refs=None):
+        self.path = path
+        references = refs or load_references(path)
+        self.refs = references["refs"]
+        self.attrs = json.loads(self.refs.get(".zattrs", "{}"))
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.variables = {}
+        for key, value in self.refs.items():
+            if key.endswith("/.zarray"):
+                name = key[:-len("/.zarray")]
+                self.variables[name] = ChunkedVariable(self, name, json.loads(value),
+                                                       json.loads(self.refs.get(f"{name}/.zattrs", "{}")))
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def __contains__(self, name):
+        return name in self.variables
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_archive(path):
+    """能按引用直接读取时返回 ArchiveDataset，否则返回 None（调用方改为解压读取）"""
+    try:
+        return ArchiveDataset(path)
+    except (UnsupportedArchive, zipfile.BadZipFile, OSError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为压缩包建立 kerchunk 格式的分块引用（.refs.json），之后可不解压直接读取")
+    parser.add_argument("paths", nargs="+", help="压缩包或目录")
+    args = parser.parse_args()
+
+    archives = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            archives += sorted(os.path.join(path, n) for n in os.listdir(path) if n.endswith(".zip"))
+        else:
+            archives.append(path)
+    for i, path in enumerate(archives, 1):
+        try:
+            refs = load_references(path)
+        except (UnsupportedArchive, zipfile.BadZipFile, OSError) as e:
+            print(f"⚠️ 跳过 {os.path.basename(path)}: {str(e)}")
+            continue
+        chunks = sum(1 for value in refs["refs"].values() if isinstance(value, list))
+        print(f"[{i}/{len(archives)}] {os.path.basename(path)}: {chunks} 个分块")
+
+
+if __name__ == "__main__":
+    main()